@@ -0,0 +1,165 @@
+"""
+Asyncio-based local runtime
+
+AsyncNativeRuntime executes a flow like NativeRuntime but each task is driven
+by its own coroutine on an asyncio event loop: the logs of the workers are
+read as they become available and the blocking operations of a task (its
+registration with the metadata provider, the loading of its results and the
+saving of its logs and metadata once it terminates) run in a thread pool so
+that those of different tasks overlap.
+
+The scheduling operations that can block (popping a task from the run queue
+may reserve task IDs with the metadata provider and queuing the successors of
+a task may load its artifacts) run in the thread pool as well. The state of
+the runtime (run queue, finished tasks, worker slots, ...) is only accessed
+with the scheduling lock held so that one of these operations runs at a time.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .exception import METAFLOW_EXIT_DISALLOW_RETRY
+from .runtime import NativeRuntime, TaskFailed, Worker
+
+
+class AsyncNativeRuntime(NativeRuntime):
+    def __init__(self, *args, **kwargs):
+        super(AsyncNativeRuntime, self).__init__(*args, **kwargs)
+        # Tasks log from the threads of the executor as well
+        self._logger = _SerializedLogger(self._logger, self._log_many)
+        if self._log_many:
+            self._log_many = self._logger.log_many
+        self._loop = None
+        self._executor = None
+        self._state_lock = None
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        try:
+            self._loop.run_until_complete(self._schedule())
+        finally:
+            # On failure, the workers are left in self._workers so that
+            # _killall can terminate them.
+            pending = [t for t in asyncio.all_tasks(self._loop) if not t.done()]
+            for t in pending:
+                t.cancel()
+            if pending:
+                self._loop.run_until_complete(
+                    asyncio.gather(*pending, return_exceptions=True)
+                )
+            self._executor.shutdown(wait=True)
+            self._loop.close()
+            self._loop = None
+
+    async def _schedule(self):
+        self._state_lock = asyncio.Lock()
+        running = set()
+        while self._run_queue or running:
+            # pop and start tasks while there are available worker slots
+            async with self._state_lock:
+                while self._run_queue and self._num_active_workers < self._max_workers:
+                    item = await self._in_executor(self._queue_pop)
+                    if item is None:
+                        # The remaining tasks are of steps at their concurrency
+                        # limit
+                        break
+                    step, task_kwargs = item
+                    self._acquire_slot(step)
+                    running.add(
+                        self._loop.create_task(self._execute_task(step, task_kwargs))
+                    )
+            done, running = await asyncio.wait(
+                running, return_when=asyncio.FIRST_COMPLETED
+            )
+            for t in done:
+                # re-raises the failure of the task, if any
+                t.result()
+
+    def _in_executor(self, func, *args, **kwargs):
+        return self._loop.run_in_executor(
+            self._executor, partial(func, *args, **kwargs)
+        )
+
+    async def _execute_task(self, step, task_kwargs):
+        try:
+            # Initializing the task registers it with the metadata provider
+            task = await self._in_executor(self._new_task, step, **task_kwargs)
+            if task.is_cloned and task.clone_origin:
+                # Tasks that are cloned (when resuming) do not need a worker
+                await self._in_executor(task.clone)
+            elif not await self._run_attempts(task):
+                return
+            await self._in_executor(self._load_results, task)
+        finally:
+            async with self._state_lock:
+                self._release_slot(step)
+        async with self._state_lock:
+            await self._in_executor(self._queue_tasks, [task])
+
+    async def _run_attempts(self, task):
+        # Returns True if the task finished successfully
+        while True:
+            worker = self._start_worker(task)
+            await self._wait_for_worker(worker)
+            returncode = await self._in_executor(worker.terminate)
+            if not returncode:
+                return True
+            # worker did not finish successfully
+            if worker.cleaned or returncode == METAFLOW_EXIT_DISALLOW_RETRY:
+                self._logger("This failed task will not be retried.", system_msg=True)
+                return False
+            if task.retries < task.user_code_retries + task.error_retries:
+                await self._in_executor(self._next_attempt, task)
+            else:
+                raise TaskFailed(task)
+
+    def _start_worker(self, task):
+        worker = Worker(task, self._max_log_size, self._zygote)
+        for fd in worker.fds():
+            self._workers[fd] = worker
+            # Only used by _killall to flush the logs of interrupted workers
+            self._poll.add(fd)
+        return worker
+
+    async def _wait_for_worker(self, worker):
+        # Emits the logs of the worker until one of its pipes is closed
+        closed = self._loop.create_future()
+        for fd in worker.fds():
+            self._loop.add_reader(fd, self._read_worker_logs, worker, fd, closed)
+        await closed
+        for fd in worker.fds():
+            self._loop.remove_reader(fd)
+            self._poll.remove(fd)
+            del self._workers[fd]
+
+    def _read_worker_logs(self, worker, fd, closed):
+        if closed.done():
+            return
+        try:
+            if not worker.read_loglines(fd):
+                closed.set_result(None)
+        except Exception as ex:
+            closed.set_exception(ex)
+
+    def _load_results(self, task):
+        # Reads the control record of the task which has all _queue_tasks
+        # needs to schedule its successors
+        task.control
+
+
+class _SerializedLogger(object):
+    # Serializes the calls to the logger and to log_many
+    def __init__(self, logger, log_many=None):
+        self._logger = logger
+        self._log_many = log_many
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            return self._logger(*args, **kwargs)
+
+    def log_many(self, lines):
+        with self._lock:
+            return self._log_many(lines)
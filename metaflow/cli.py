@@ -111,17 +111,43 @@ def echo_always(line, **kwargs):
         click.secho(ERASE_TO_EOL, **kwargs)
 
 
-def logger(body="", system_msg=False, head="", bad=False, timestamp=True):
+def _format_logline(body="", system_msg=False, head="", bad=False, timestamp=True):
+    line = ""
     if timestamp:
         if timestamp is True:
             dt = datetime.now()
         else:
             dt = timestamp
         tstamp = dt.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-        click.secho(tstamp + " ", fg=LOGGER_TIMESTAMP, nl=False)
+        line += click.style(tstamp + " ", fg=LOGGER_TIMESTAMP)
     if head:
-        click.secho(head, fg=LOGGER_COLOR, nl=False)
-    click.secho(body, bold=system_msg, fg=LOGGER_BAD_COLOR if bad else None)
+        line += click.style(head, fg=LOGGER_COLOR)
+    return line + click.style(
+        body, bold=system_msg, fg=LOGGER_BAD_COLOR if bad else None
+    )
+
+
+def logger(body="", system_msg=False, head="", bad=False, timestamp=True):
+    click.echo(_format_logline(body, system_msg, head, bad, timestamp))
+
+
+def log_many(lines):
+    # Print many lines, given as tuples of the arguments of logger(), with a
+    # single write to the console. The lines of a batch typically share the
+    # same header and timestamp so their formatting is cached.
+    cache = {}
+
+    def _format(body, system_msg=False, head="", bad=False, timestamp=True):
+        key = (system_msg, head, bad, timestamp)
+        if key not in cache:
+            # "\0" stands for the body
+            cache[key] = _format_logline("\0", *key).split("\0")
+        prefix, suffix = cache[key]
+        return prefix + body + suffix
+
+    if lines:
+        click.echo("\n".join(_format(*line) for line in lines))
+
 
 
 @click.group()
@@ -618,6 +644,15 @@ def common_run_options(func):
         show_default=True,
         help="Maximum number of parallel processes.",
     )
+    @click.option(
+        "--max-workers-per-step",
+        "max_workers_per_step",
+        multiple=True,
+        default=None,
+        help="Maximum number of parallel processes for a step, as "
+        "<step>=<max-workers>. You can specify this option multiple times "
+        "to limit several steps.",
+    )
     @click.option(
         "--max-num-splits",
         default=100,
@@ -642,6 +677,35 @@ def common_run_options(func):
         "option multiple times to attach multiple decorators "
         "in steps.",
     )
+    @click.option(
+        "--launcher",
+        default="subprocess",
+        show_default=True,
+        type=click.Choice(["subprocess", "zygote"]),
+        help="How local tasks are started. With 'zygote', tasks are forked "
+        "from a process that has already imported Metaflow (and the modules "
+        "listed in METAFLOW_ZYGOTE_PRELOAD_MODULES) which reduces their "
+        "startup time.",
+    )
+    @click.option(
+        "--scheduler",
+        default="fifo",
+        show_default=True,
+        type=click.Choice(["fifo", "critical-path", "depth-first"]),
+        help="Order in which ready tasks are launched. 'critical-path' "
+        "launches first the tasks of the steps furthest from the end of the "
+        "flow; 'depth-first' completes foreach branches before launching "
+        "more splits so that joins can start early.",
+    )
+    @click.option(
+        "--event-loop",
+        default="poll",
+        show_default=True,
+        type=click.Choice(["poll", "asyncio"]),
+        help="How the runtime waits for local tasks. With 'asyncio', each "
+        "task is driven by a coroutine so that the metadata, logs and "
+        "results of different tasks are handled concurrently.",
+    )
     @click.option(
         "--run-id-file",
         default=None,
@@ -672,10 +736,14 @@ def resume(
     step_to_rerun=None,
     origin_run_id=None,
     max_workers=None,
+    max_workers_per_step=None,
     max_num_splits=None,
     max_log_size=None,
     decospecs=None,
     run_id_file=None,
+    launcher=None,
+    scheduler=None,
+    event_loop=None,
 ):
 
     before_run(obj, tags, decospecs + obj.environment.decospecs())
@@ -700,7 +768,7 @@ def resume(
             )
         clone_steps = {step_to_rerun}
 
-    runtime = NativeRuntime(
+    runtime = runtime_class(event_loop)(
         obj.flow,
         obj.graph,
         obj.flow_datastore,
@@ -711,11 +779,15 @@ def resume(
         obj.entrypoint,
         obj.event_logger,
         obj.monitor,
+        log_many=obj.log_many,
         clone_run_id=origin_run_id,
         clone_steps=clone_steps,
         max_workers=max_workers,
+        max_workers_per_step=parse_max_workers_per_step(obj, max_workers_per_step),
         max_num_splits=max_num_splits,
         max_log_size=max_log_size * 1024 * 1024,
+        launcher=launcher,
+        scheduler=scheduler,
     )
     runtime.persist_constants()
     runtime.execute()
@@ -742,10 +814,14 @@ def run(
     obj,
     tags=None,
     max_workers=None,
+    max_workers_per_step=None,
     max_num_splits=None,
     max_log_size=None,
     decospecs=None,
     run_id_file=None,
+    launcher=None,
+    scheduler=None,
+    event_loop=None,
     user_namespace=None,
     **kwargs
 ):
@@ -754,7 +830,7 @@ def run(
         namespace(user_namespace or None)
     before_run(obj, tags, decospecs + obj.environment.decospecs())
 
-    runtime = NativeRuntime(
+    runtime = runtime_class(event_loop)(
         obj.flow,
         obj.graph,
         obj.flow_datastore,
@@ -765,9 +841,13 @@ def run(
         obj.entrypoint,
         obj.event_logger,
         obj.monitor,
+        log_many=obj.log_many,
         max_workers=max_workers,
+        max_workers_per_step=parse_max_workers_per_step(obj, max_workers_per_step),
         max_num_splits=max_num_splits,
         max_log_size=max_log_size * 1024 * 1024,
+        launcher=launcher,
+        scheduler=scheduler,
     )
     write_latest_run_id(obj, runtime.run_id)
     write_run_id(run_id_file, runtime.run_id)
@@ -777,6 +857,34 @@ def run(
     runtime.execute()
 
 
+def runtime_class(event_loop):
+    if event_loop == "asyncio":
+        from .async_runtime import AsyncNativeRuntime
+
+        return AsyncNativeRuntime
+    return NativeRuntime
+
+
+def parse_max_workers_per_step(obj, specs):
+    max_workers_per_step = {}
+    for spec in specs or ():
+        step, _, value = spec.partition("=")
+        try:
+            max_workers_per_step[step] = int(value)
+        except ValueError:
+            raise CommandException(
+                "Invalid value *%s* for --max-workers-per-step: expected "
+                "<step>=<max-workers>." % spec
+            )
+        if step not in obj.graph.nodes:
+            raise CommandException(
+                "Invalid step name *%s* specified in --max-workers-per-step. "
+                "Valid step names include: %s"
+                % (step, ",".join(list(obj.graph.nodes.keys())))
+            )
+    return max_workers_per_step
+
+
 def write_run_id(run_id_file, run_id):
     if run_id_file is not None:
         with open(run_id_file, "w") as f:
@@ -940,6 +1048,7 @@ def start(
     ctx.obj.echo_always = echo_always
     ctx.obj.graph = FlowGraph(ctx.obj.flow.__class__)
     ctx.obj.logger = logger
+    ctx.obj.log_many = log_many
     ctx.obj.check = _check
     ctx.obj.pylint = pylint
     ctx.obj.top_cli = cli
@@ -1,12 +1,36 @@
 import gzip
+import mmap
+import os
+import zlib
 
-from collections import namedtuple
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha1
 from io import BytesIO
 
 from ..exception import MetaflowInternalError
+from ..metaflow_config import CAS_COMPRESSION_CODEC, DATASTORE_LOCAL_MMAP
 from .exceptions import DataException
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+# Marks the end of an iterator
+_END = object()
+
+
+def _sha1_hexdigest(blob):
+    # hashlib releases the GIL for large inputs so this can run in a thread pool
+    return sha1(blob).hexdigest()
+
 
 class ContentAddressedStore(object):
     """
@@ -16,6 +40,23 @@ class ContentAddressedStore(object):
 
     save_blobs_result = namedtuple("save_blobs_result", "uri key")
 
+    # Codecs that can be used to pack non-raw blobs (see _pack_v2)
+    CODECS = ("gzip", "zstd", "lz4", "none")
+    # Blobs smaller than this are always compressed; for larger blobs, we first
+    # compress a few samples of the blob to check if compressing it is worth it
+    SAMPLE_MIN_SIZE = 1024 * 1024
+    SAMPLE_SIZE = 64 * 1024
+    SAMPLE_COUNT = 4
+    # Blobs whose samples do not compress below this ratio are stored as is
+    INCOMPRESSIBLE_RATIO = 0.9
+    # When packing blobs in parallel, gzip blobs larger than this are split and
+    # compressed in chunks of this size
+    PACK_CHUNK_SIZE = 64 * 1024 * 1024
+    # Blobs are saved in batches of at most this many blobs and bytes (the
+    # existence of the blobs of a batch is checked in one go)
+    SAVE_BATCH_SIZE = 1000
+    SAVE_BATCH_BYTES = 256 * 1024 * 1024
+
     def __init__(self, prefix, storage_impl):
         """
         Initialize a ContentAddressedStore
@@ -35,10 +76,15 @@ class ContentAddressedStore(object):
         self.TYPE = self._storage_impl.TYPE
         self._blob_cache = None
 
+    def get_blob_cache(self):
+        return self._blob_cache
+
     def set_blob_cache(self, blob_cache):
         self._blob_cache = blob_cache
 
-    def save_blobs(self, blob_iter, raw=False, len_hint=0):
+    def save_blobs(
+        self, blob_iter, raw=False, len_hint=0, max_workers=0, max_inflight_bytes=None
+    ):
         """
         Saves blobs of data to the datastore
 
@@ -60,11 +106,19 @@ class ContentAddressedStore(object):
 
         Parameters
         ----------
-        blob_iter : Iterator over bytes objects to save
+        blob_iter : Iterator over bytes objects to save (or callables returning
+            them, which are called in the pool of threads if max_workers > 1)
         raw : bool, optional
             Whether to save the bytes directly or process them, by default False
         len_hint : Hint of the number of blobs that will be produced by the
             iterator, by default 0
+        max_workers : int, optional
+            If greater than 1, blobs are produced (see blob_iter), hashed and
+            compressed using a pool of this many threads, by default 0
+        max_inflight_bytes : int, optional
+            Maximum number of bytes of blobs read from blob_iter but not yet
+            saved (a single blob larger than this is still saved). By default,
+            SAVE_BATCH_BYTES.
 
         Returns
         -------
@@ -72,35 +126,181 @@ class ContentAddressedStore(object):
             The list order is the same as the blobs passed in. The URI will be
             None if raw is False.
         """
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                return self._save_blobs(
+                    blob_iter, raw, executor, max_workers, max_inflight_bytes
+                )
+        return self._save_blobs(blob_iter, raw)
+
+    def _save_blobs(
+        self, blob_iter, raw, executor=None, max_workers=0, max_inflight_bytes=None
+    ):
+        # Blobs are saved in batches of at most SAVE_BATCH_SIZE blobs and
+        # SAVE_BATCH_BYTES bytes (or max_inflight_bytes if given): the existence
+        # of the blobs of a batch is checked in one go (so that the backing
+        # storage can batch the requests) and the batch is saved before
+        # more blobs are produced past the budget. Blobs produced but not yet
+        # saved thus stay within the budget, give or take the (at most
+        # max_workers) blobs being produced in the pool when it is reached.
+        max_batch_bytes = max_inflight_bytes or self.SAVE_BATCH_BYTES
         results = []
+        # Paths known to exist (checked or saved by a previous batch)
+        existing = set()
+        batch = []
+        batch_bytes = 0
+        for blob, sha in self._produce_blobs(
+            blob_iter, executor, max_workers, lambda: max_batch_bytes - batch_bytes
+        ):
+            batch.append((sha, blob))
+            batch_bytes += len(blob)
+            if len(batch) >= self.SAVE_BATCH_SIZE or batch_bytes >= max_batch_bytes:
+                self._save_batch(
+                    batch, raw, existing, results, executor, max_inflight_bytes
+                )
+                batch = []
+                batch_bytes = 0
+        if batch:
+            self._save_batch(
+                batch, raw, existing, results, executor, max_inflight_bytes
+            )
+        return results
 
-        def packing_iter():
-            for blob in blob_iter:
-                sha = sha1(blob).hexdigest()
-                path = self._storage_impl.path_join(self._prefix, sha[:2], sha)
-                results.append(
-                    self.save_blobs_result(
-                        uri=self._storage_impl.full_uri(path) if raw else None,
-                        key=sha,
-                    )
+    @staticmethod
+    def _produce_blobs(blob_iter, executor, max_workers, available_bytes):
+        # Yields the (blob, sha) of the items of blob_iter in order. Items that
+        # are callables are called to produce their blob. With an executor,
+        # up to max_workers items are produced (and hashed) in the pool at
+        # once, as long as the blobs produced but not yet yielded fit in
+        # available_bytes() (the budget left for the current batch).
+        if not executor:
+            for item in blob_iter:
+                blob = item() if callable(item) else item
+                yield blob, _sha1_hexdigest(blob)
+            return
+
+        def _produce(item):
+            blob = item() if callable(item) else item
+            return blob, _sha1_hexdigest(blob)
+
+        items = iter(blob_iter)
+        pending = deque()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_workers:
+                produced_bytes = sum(
+                    len(f.result()[0])
+                    for f in pending
+                    if f.done() and f.exception() is None
                 )
+                if pending and produced_bytes >= available_bytes():
+                    break
+                item = next(items, _END)
+                if item is _END:
+                    exhausted = True
+                else:
+                    pending.append(executor.submit(_produce, item))
+            if not pending:
+                return
+            yield pending.popleft().result()
 
-                if not self._storage_impl.is_file([path])[0]:
-                    # only process blobs that don't exist already in the
-                    # backing datastore
-                    meta = {"cas_raw": raw, "cas_version": 1}
-                    if raw:
-                        yield path, (BytesIO(blob), meta)
-                    else:
-                        yield path, (self._pack_v1(blob), meta)
+    def _save_batch(self, batch, raw, existing, results, executor, max_inflight_bytes):
+        paths = []
+        for sha, _ in batch:
+            path = self._storage_impl.path_join(self._prefix, sha[:2], sha)
+            results.append(
+                self.save_blobs_result(
+                    uri=self._storage_impl.full_uri(path) if raw else None,
+                    key=sha,
+                )
+            )
+            paths.append(path)
+
+        # Identical blobs are only checked (and saved) once.
+        to_check = [path for path in dict.fromkeys(paths) if path not in existing]
+        if to_check:
+            existing.update(
+                path
+                for path, exists in zip(to_check, self._storage_impl.is_file(to_check))
+                if exists
+            )
+        to_save = len([path for path in to_check if path not in existing])
+
+        def missing_iter():
+            for idx, path in enumerate(paths):
+                # We drop our reference to the blob as soon as we are done with
+                # it to avoid keeping all blobs in memory while they are saved
+                blob, batch[idx] = batch[idx][1], None
+                if path in existing:
+                    continue
+                # only process blobs that don't exist already in the
+                # backing datastore
+                existing.add(path)
+                yield path, blob
+
+        def packing_iter():
+            for path, blob in missing_iter():
+                codec, meta = self._encoding_for_blob(blob, raw)
+                yield path, (self._pack(blob, codec), meta)
 
         # We don't actually want to overwrite but by saying =True, we avoid
         # checking again saving some operations. We are already sure we are not
         # sending duplicate files since we already checked.
-        self._storage_impl.save_bytes(packing_iter(), overwrite=True, len_hint=len_hint)
-        return results
+        if to_save:
+            if executor:
+                to_store = self._parallel_packing_iter(
+                    missing_iter(), raw, executor, max_inflight_bytes
+                )
+            else:
+                to_store = packing_iter()
+            self._storage_impl.save_bytes(to_store, overwrite=True, len_hint=to_save)
+        # The blobs that already existed are released as well
+        del batch[:]
+
+    def _parallel_packing_iter(self, path_and_blobs, raw, executor, max_inflight_bytes):
+        # Blobs are compressed in the pool but are yielded in order. Large gzip
+        # blobs are split into chunks that are compressed concurrently and
+        # concatenated (a multi-member gzip stream is still a valid gzip stream)
+        pending = deque()
+        inflight_bytes = 0
+
+        def _pop_pending():
+            path, size, meta, futures = pending.popleft()
+            if len(futures) == 1:
+                packed = futures[0].result()
+            else:
+                packed = BytesIO(b"".join(f.result() for f in futures))
+            return size, (path, (packed, meta))
 
-    def load_blobs(self, keys, force_raw=False):
+        for path, blob in path_and_blobs:
+            size = len(blob)
+            # We always allow at least one blob to be in flight
+            while (
+                pending
+                and max_inflight_bytes is not None
+                and inflight_bytes + size > max_inflight_bytes
+            ):
+                done_size, to_yield = _pop_pending()
+                inflight_bytes -= done_size
+                yield to_yield
+            codec, meta = self._encoding_for_blob(blob, raw)
+            if codec == "gzip" and size > self.PACK_CHUNK_SIZE:
+                view = memoryview(blob)
+                futures = [
+                    executor.submit(
+                        gzip.compress, view[i : i + self.PACK_CHUNK_SIZE], 3
+                    )
+                    for i in range(0, size, self.PACK_CHUNK_SIZE)
+                ]
+            else:
+                futures = [executor.submit(self._pack, blob, codec)]
+            pending.append((path, size, meta, futures))
+            inflight_bytes += size
+        while pending:
+            _, to_yield = _pop_pending()
+            yield to_yield
+
+    def load_blobs(self, keys, force_raw=False, use_mmap=False):
         """
         Mirror function of save_blobs
 
@@ -115,6 +315,12 @@ class ContentAddressedStore(object):
             Support for backward compatibility with previous datastores. If
             True, this will force the key to be loaded as is (raw). By default,
             False
+        use_mmap : bool, optional
+            If True, blobs stored uncompressed in files that are not temporary
+            copies (see DataStoreStorage.LOAD_IN_PLACE) are returned as
+            copy-on-write memory maps of those files instead of bytes. The
+            memory of these blobs is then shared through the page cache by all
+            the processes loading them. By default, False
 
         Returns
         -------
@@ -138,7 +344,13 @@ class ContentAddressedStore(object):
                 # At this point, we either return the object as is (if raw) or
                 # decode it according to the encoding version
                 with open(file_path, "rb") as f:
-                    if force_raw or (meta and meta.get("cas_raw", False)):
+                    if (
+                        use_mmap
+                        and self._storage_impl.LOAD_IN_PLACE
+                        and self._is_stored_as_is(meta, force_raw)
+                    ):
+                        blob = self._map_file(f)
+                    elif force_raw or (meta and meta.get("cas_raw", False)):
                         blob = f.read()
                     else:
                         if meta is None:
@@ -160,7 +372,7 @@ class ContentAddressedStore(object):
                                     "version" % (version, path)
                                 )
                         try:
-                            blob = unpack_code(f)
+                            blob = unpack_code(f, meta)
                         except Exception as e:
                             raise DataException(
                                 "Could not unpack artifact '%s': %s" % (path, e)
@@ -171,7 +383,87 @@ class ContentAddressedStore(object):
 
                 yield key, blob
 
-    def _unpack_backward_compatible(self, blob):
+    def _encoding_for_blob(self, blob, raw):
+        # Returns the codec to pack the blob with (None if the blob is stored as
+        # is) as well as the metadata to store alongside it
+        if raw:
+            return None, {"cas_raw": True, "cas_version": 1}
+        codec = self._select_codec(blob)
+        if codec == "gzip":
+            # gzip blobs are still encoded using version 1 so that they remain
+            # readable by older versions of Metaflow
+            return codec, {"cas_raw": False, "cas_version": 1}
+        return codec, {"cas_raw": False, "cas_version": 2, "cas_codec": codec}
+
+    def _pack(self, blob, codec):
+        if codec is None:
+            return BytesIO(blob)
+        if codec == "gzip":
+            return self._pack_v1(blob)
+        return self._pack_v2(blob, codec)
+
+    def _select_codec(self, blob):
+        if DATASTORE_LOCAL_MMAP and self._storage_impl.LOAD_IN_PLACE:
+            # Blobs need to be stored as is to be memory-mapped when loaded
+            return "none"
+        codec = CAS_COMPRESSION_CODEC
+        if codec != "auto":
+            if codec not in self.CODECS:
+                raise DataException(
+                    "Unknown compression codec '%s' -- valid values for "
+                    "METAFLOW_CAS_COMPRESSION_CODEC are 'auto', %s"
+                    % (codec, ", ".join("'%s'" % c for c in self.CODECS))
+                )
+            if (codec == "zstd" and zstandard is None) or (
+                codec == "lz4" and lz4_frame is None
+            ):
+                raise DataException(
+                    "Compression codec '%s' requires the '%s' package to be "
+                    "installed" % (codec, "zstandard" if codec == "zstd" else "lz4")
+                )
+            return codec
+        if len(blob) >= self.SAMPLE_MIN_SIZE and not self._is_compressible(blob):
+            return "none"
+        if zstandard is not None:
+            return "zstd"
+        if lz4_frame is not None:
+            return "lz4"
+        return "gzip"
+
+    def _is_compressible(self, blob):
+        # Compress SAMPLE_COUNT evenly spaced samples of the blob with a fast
+        # compression level and check how much they shrink.
+        view = memoryview(blob)
+        stride = (len(view) - self.SAMPLE_SIZE) // max(self.SAMPLE_COUNT - 1, 1)
+        original_size = 0
+        compressed_size = 0
+        for i in range(self.SAMPLE_COUNT):
+            sample = view[i * stride : i * stride + self.SAMPLE_SIZE]
+            original_size += len(sample)
+            compressed_size += len(zlib.compress(sample, 1))
+        return compressed_size < self.INCOMPRESSIBLE_RATIO * original_size
+
+    @staticmethod
+    def _is_stored_as_is(meta, force_raw):
+        if force_raw:
+            return True
+        if meta is None:
+            return False
+        return meta.get("cas_raw", False) or (
+            meta.get("cas_version") == 2 and meta.get("cas_codec") == "none"
+        )
+
+    @staticmethod
+    def _map_file(f):
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files can't be memory-mapped
+            return f.read()
+        # The mapping remains valid after the file is closed. ACCESS_COPY keeps
+        # the pages shared until they are written to (the file is never
+        # modified).
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    def _unpack_backward_compatible(self, blob, meta=None):
         # This is the backward compatible unpack
         # (if the blob doesn't have a version encoded)
         return self._unpack_v1(blob)
@@ -183,10 +475,40 @@ class ContentAddressedStore(object):
         buf.seek(0)
         return buf
 
-    def _unpack_v1(self, blob):
+    def _unpack_v1(self, blob, meta=None):
         with gzip.GzipFile(fileobj=blob, mode="rb") as f:
             return f.read()
 
+    def _pack_v2(self, blob, codec):
+        # Version 2 records the codec used in the metadata of the blob
+        if codec == "zstd":
+            return BytesIO(zstandard.ZstdCompressor(level=3).compress(blob))
+        elif codec == "lz4":
+            return BytesIO(lz4_frame.compress(blob))
+        elif codec == "gzip":
+            return self._pack_v1(blob)
+        elif codec == "none":
+            return BytesIO(blob)
+        raise DataException("Unknown compression codec '%s'" % codec)
+
+    def _unpack_v2(self, blob, meta=None):
+        codec = meta.get("cas_codec") if meta else None
+        if codec == "zstd":
+            if zstandard is None:
+                raise DataException(
+                    "the 'zstandard' package is required to decompress it"
+                )
+            return zstandard.ZstdDecompressor().decompress(blob.read())
+        elif codec == "lz4":
+            if lz4_frame is None:
+                raise DataException("the 'lz4' package is required to decompress it")
+            return lz4_frame.decompress(blob.read())
+        elif codec == "gzip":
+            return self._unpack_v1(blob)
+        elif codec == "none":
+            return blob.read()
+        raise DataException("unknown compression codec '%s'" % codec)
+
 
 class BlobCache(object):
     def load_key(self, key):
@@ -41,16 +41,21 @@ class TaskDataStoreSet(object):
             cache = ImmutableBlobCache(preloaded)
             flow_datastore.ca_store.set_blob_cache(cache)
 
-        self.pathspec_index_cache = {}
+        # The pathspec index requires loading the _foreach_stack artifact of
+        # each datastore so we only compute it if it is used.
+        self.pathspec_index_cache = None
         self.pathspec_cache = {}
         for ds in task_datastores:
-            self.pathspec_index_cache[ds.pathspec_index] = ds
             self.pathspec_cache[ds.pathspec] = ds
 
     def get_with_pathspec(self, pathspec):
         return self.pathspec_cache.get(pathspec, None)
 
     def get_with_pathspec_index(self, pathspec_index):
+        if self.pathspec_index_cache is None:
+            self.pathspec_index_cache = {
+                ds.pathspec_index: ds for ds in self.pathspec_cache.values()
+            }
         return self.pathspec_index_cache.get(pathspec_index, None)
 
     def __iter__(self):
@@ -37,6 +37,9 @@ class DataStoreStorage(object):
     TYPE = None
     datastore_root = None
     path_rexp = None
+    # True if the files returned by load_bytes are the stored objects themselves
+    # as opposed to temporary copies. Such files can be memory-mapped.
+    LOAD_IN_PLACE = False
 
     list_content_result = namedtuple("list_content_result", "path is_file")
 
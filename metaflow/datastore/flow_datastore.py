@@ -100,9 +100,8 @@ class FlowDataStore(object):
             Task datastores for all the tasks specified.
         """
         task_urls = []
-        # Note: When `pathspecs` is specified, we avoid the potentially
-        # eventually consistent `list_content` operation, and directly construct
-        # the task_urls list.
+        # Note: When `pathspecs` is specified, we do not list the steps to
+        # find the tasks, and directly construct the task_urls list.
         if pathspecs:
             task_urls = [
                 self._storage_impl.path_join(self.flow_name, pathspec)
@@ -125,41 +124,29 @@ class FlowDataStore(object):
                 for task in self._storage_impl.list_content(step_urls)
                 if task.is_file is False
             ]
-        urls = []
-        for task_url in task_urls:
-            for attempt in range(metaflow_config.MAX_ATTEMPTS):
-                for suffix in [
-                    TaskDataStore.METADATA_DATA_SUFFIX,
-                    TaskDataStore.METADATA_ATTEMPT_SUFFIX,
-                    TaskDataStore.METADATA_DONE_SUFFIX,
-                ]:
-                    urls.append(
-                        self._storage_impl.path_join(
-                            task_url,
-                            TaskDataStore.metadata_name_for_attempt(suffix, attempt),
-                        )
-                    )
 
         latest_started_attempts = {}
         done_attempts = set()
-        data_objs = {}
-        with self._storage_impl.load_bytes(urls) as get_results:
-            for key, path, meta in get_results:
-                if path is not None:
-                    _, run, step, task, fname = self._storage_impl.path_split(key)
-                    attempt, fname = TaskDataStore.parse_attempt_metadata(fname)
-                    attempt = int(attempt)
-                    if fname == TaskDataStore.METADATA_DONE_SUFFIX:
-                        done_attempts.add((run, step, task, attempt))
-                    elif fname == TaskDataStore.METADATA_ATTEMPT_SUFFIX:
-                        latest_started_attempts[(run, step, task)] = max(
-                            latest_started_attempts.get((run, step, task), 0), attempt
-                        )
-                    elif fname == TaskDataStore.METADATA_DATA_SUFFIX:
-                        # This somewhat breaks the abstraction since we are using
-                        # load_bytes directly instead of load_metadata
-                        with open(path, "rb") as f:
-                            data_objs[(run, step, task, attempt)] = json.load(f)
+        data_attempts = set()
+        for task_file in self._attempt_metadata_files(task_urls):
+            _, run, step, task, fname = self._storage_impl.path_split(task_file)
+            try:
+                attempt, fname = TaskDataStore.parse_attempt_metadata(fname)
+                attempt = int(attempt)
+            except ValueError:
+                # Not a file of an attempt (legacy metadata for example)
+                continue
+            if attempt >= metaflow_config.MAX_ATTEMPTS:
+                continue
+            if fname == TaskDataStore.METADATA_DONE_SUFFIX:
+                done_attempts.add((run, step, task, attempt))
+            elif fname == TaskDataStore.METADATA_ATTEMPT_SUFFIX:
+                latest_started_attempts[(run, step, task)] = max(
+                    latest_started_attempts.get((run, step, task), 0), attempt
+                )
+            elif fname == TaskDataStore.METADATA_DATA_SUFFIX:
+                data_attempts.add((run, step, task, attempt))
+
         # We now figure out the latest attempt that started *and* finished.
         # Note that if an attempt started but didn't finish, we do *NOT* return
         # the previous attempt
@@ -171,12 +158,68 @@ class FlowDataStore(object):
             latest_to_fetch = latest_started_attempts
         else:
             latest_to_fetch = latest_started_attempts & done_attempts
+
+        # Only then do we load the data metadata, and only for those attempts
+        data_urls = [
+            self._storage_impl.path_join(
+                self.flow_name,
+                run,
+                step,
+                task,
+                TaskDataStore.metadata_name_for_attempt(
+                    TaskDataStore.METADATA_DATA_SUFFIX, attempt
+                ),
+            )
+            for run, step, task, attempt in latest_to_fetch & data_attempts
+        ]
+        data_objs = {}
+        with self._storage_impl.load_bytes(data_urls) as get_results:
+            for key, path, meta in get_results:
+                if path is not None:
+                    _, run, step, task, fname = self._storage_impl.path_split(key)
+                    attempt, fname = TaskDataStore.parse_attempt_metadata(fname)
+                    # This somewhat breaks the abstraction since we are using
+                    # load_bytes directly instead of load_metadata
+                    with open(path, "rb") as f:
+                        data_objs[(run, step, task, int(attempt))] = json.load(f)
+
+        # Attempts that are not done (if allow_not_done) have no data metadata
         latest_to_fetch = [
-            (v[0], v[1], v[2], v[3], data_objs[v], "r", allow_not_done)
+            (v[0], v[1], v[2], v[3], data_objs.get(v, {}), "r", allow_not_done)
             for v in latest_to_fetch
         ]
         return list(itertools.starmap(self.get_task_datastore, latest_to_fetch))
 
+    def _attempt_metadata_files(self, task_urls):
+        # Returns the paths of the files of the tasks in task_urls, among which
+        # the metadata files of their attempts.
+        if not metaflow_config.DATASTORE_PROBE_ATTEMPTS:
+            # We list the content of each task instead of probing for the
+            # files of every possible attempt (most of which do not exist).
+            # This is only safe when the data was just written if listings
+            # are strongly consistent (as they are on AWS S3 and local
+            # filesystems); see METAFLOW_DATASTORE_PROBE_ATTEMPTS.
+            return [
+                task_file.path
+                for task_file in self._storage_impl.list_content(task_urls)
+                if task_file.is_file
+            ]
+        urls = [
+            self._storage_impl.path_join(
+                task_url, TaskDataStore.metadata_name_for_attempt(suffix, attempt)
+            )
+            for task_url in task_urls
+            for attempt in range(metaflow_config.MAX_ATTEMPTS)
+            for suffix in [
+                TaskDataStore.METADATA_DATA_SUFFIX,
+                TaskDataStore.METADATA_ATTEMPT_SUFFIX,
+                TaskDataStore.METADATA_DONE_SUFFIX,
+            ]
+        ]
+        return [
+            url for url, exists in zip(urls, self._storage_impl.is_file(urls)) if exists
+        ]
+
     def get_task_datastore(
         self,
         run_id,
@@ -199,6 +242,44 @@ class FlowDataStore(object):
             allow_not_done=allow_not_done,
         )
 
+    def load_control_record(self, run_id, step_name, task_id, attempt):
+        """
+        Loads the control record of an attempt of a task (see
+        TaskDataStore.CONTROL_FIELDS) in a single fetch, without opening the
+        datastore of the task.
+
+        Parameters
+        ----------
+        run_id : str
+            Run ID of the task
+        step_name : str
+            Step of the task
+        task_id : str
+            Task ID of the task
+        attempt : int
+            Attempt of the task; it should be done
+
+        Returns
+        -------
+        Dict: string -> JSON decoded object
+            The control record or None if the attempt doesn't have one
+        """
+        path = self._storage_impl.path_join(
+            self.flow_name,
+            run_id,
+            step_name,
+            task_id,
+            TaskDataStore.metadata_name_for_attempt(
+                TaskDataStore.METADATA_CONTROL_SUFFIX, attempt
+            ),
+        )
+        with self._storage_impl.load_bytes([path]) as get_results:
+            for _, local_path, _ in get_results:
+                if local_path is not None:
+                    with open(local_path, "rb") as f:
+                        return json.load(f)
+        return None
+
     def save_data(self, data_iter, len_hint=0):
         """Saves data to the underlying content-addressed store
 
@@ -1,3 +1,8 @@
+from collections import defaultdict
+
+from .content_addressed_store import BlobCache
+
+
 class Inputs(object):
     """
     split: inputs.step_a.x inputs.step_b.x
@@ -16,3 +21,141 @@ class Inputs(object):
 
     def __iter__(self):
         return iter(self.flows)
+
+
+class InputsBlobCache(BlobCache):
+    """
+    Blob cache shared by the input datastores of a join.
+
+    Artifacts of the inputs are still loaded (and unpickled) lazily, when
+    they are first accessed. However, as soon as the same artifact has been
+    loaded from PREFETCH_AFTER different inputs, the blobs for that artifact
+    in the other inputs are fetched using a single load_blobs call. This makes
+    accesses like `[i.score for i in inputs]` cost one round trip to the
+    datastore instead of one per input.
+
+    At most MAX_PREFETCH_BYTES bytes of prefetched blobs (as per the sizes
+    recorded for the artifacts) are held at once; the blobs of an artifact
+    that do not fit are prefetched when they are first accessed, as space
+    frees up.
+    """
+
+    PREFETCH_AFTER = 2
+    MAX_PREFETCH_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, ca_store, datastores, parent_cache=None):
+        self._ca_store = ca_store
+        self._parent_cache = parent_cache
+        # key -> names of the artifacts (in any input) with that key
+        self._key_names = defaultdict(set)
+        # name -> keys of the artifact with that name in all the inputs
+        self._name_keys = defaultdict(list)
+        # key -> size of the artifact with that key
+        self._key_sizes = {}
+        for ds in datastores:
+            names_keys = list(ds.items())
+            sizes = dict(ds.get_artifact_sizes([name for name, _ in names_keys]))
+            for name, key in names_keys:
+                self._key_names[key].add(name)
+                self._name_keys[name].append(key)
+                self._key_sizes[key] = sizes[name]
+        self._load_counts = defaultdict(int)
+        # names of the artifacts whose blobs have all been prefetched
+        self._prefetched = set()
+        # key -> number of times the blob was loaded through this cache
+        self._key_loads = defaultdict(int)
+        # key -> [blob, number of inputs that have not loaded the blob yet]
+        self._blobs = {}
+        self._blobs_bytes = 0
+        self._in_prefetch = False
+
+    def load_key(self, key):
+        if self._in_prefetch:
+            return None
+        self._key_loads[key] += 1
+        if self._parent_cache:
+            blob = self._parent_cache.load_key(key)
+            if blob is not None:
+                return blob
+        names = self._key_names.get(key, ())
+        # We can only tell which artifact is being loaded if the blob is not
+        # shared by artifacts with different names
+        if key not in self._blobs and len(names) == 1:
+            (name,) = names
+            self._load_counts[name] += 1
+            if (
+                name not in self._prefetched
+                and self._load_counts[name] >= self.PREFETCH_AFTER
+            ):
+                self._prefetch([name], first_key=key)
+        entry = self._blobs.get(key)
+        if entry is None:
+            # The content addressed store will load it directly
+            return None
+        # We only keep the blob around until all the inputs referencing it have
+        # loaded it; the unpickled artifact is then cached in each input.
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._blobs[key]
+            self._blobs_bytes -= self._key_sizes.get(key, 0)
+        return entry[0]
+
+    def prefetch(self, names):
+        """
+        Fetches the blobs for the artifacts named `names` in all the inputs
+        using a single call to load_blobs (up to MAX_PREFETCH_BYTES bytes).
+
+        Parameters
+        ----------
+        names : List[string]
+            Names of the artifacts to prefetch
+        """
+        self._prefetch(names)
+
+    def _prefetch(self, names, first_key=None):
+        to_fetch = defaultdict(int)
+        if first_key is not None:
+            # Make sure the blob being loaded is fetched first
+            to_fetch[first_key] = 0
+        for name in names:
+            if name in self._prefetched:
+                continue
+            for key in self._name_keys.get(name, ()):
+                if key not in self._blobs:
+                    to_fetch[key] += 1
+        fetch_bytes = 0
+        complete = True
+        for key, count in list(to_fetch.items()):
+            # Inputs that already loaded this blob will not load it again
+            count -= self._key_loads.get(key, 0)
+            if key == first_key:
+                # the current load is served from the prefetched blob
+                count += 1
+            if count <= 0:
+                del to_fetch[key]
+                continue
+            size = self._key_sizes.get(key, 0)
+            if (
+                fetch_bytes
+                and self._blobs_bytes + fetch_bytes + size > self.MAX_PREFETCH_BYTES
+            ):
+                complete = False
+                del to_fetch[key]
+                continue
+            to_fetch[key] = count
+            fetch_bytes += size
+        if complete:
+            self._prefetched.update(names)
+        if not to_fetch:
+            return
+        self._in_prefetch = True
+        try:
+            for key, blob in self._ca_store.load_blobs(list(to_fetch)):
+                self._blobs[key] = [blob, to_fetch[key]]
+                self._blobs_bytes += self._key_sizes.get(key, 0)
+        finally:
+            self._in_prefetch = False
+
+    def store_key(self, key, blob):
+        # Only prefetched blobs are cached
+        pass
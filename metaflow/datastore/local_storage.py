@@ -1,7 +1,16 @@
 import json
 import os
 
-from ..metaflow_config import DATASTORE_LOCAL_DIR, DATASTORE_SYSROOT_LOCAL
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from ..metaflow_config import (
+    DATASTORE_LOCAL_DIR,
+    DATASTORE_LOCAL_FSYNC,
+    DATASTORE_LOCAL_SAVE_MAX_WORKERS,
+    DATASTORE_SYSROOT_LOCAL,
+)
 from .datastore_storage import CloseAfterUse, DataStoreStorage
 from .exceptions import DataException
 
@@ -9,6 +18,7 @@ from .exceptions import DataException
 class LocalStorage(DataStoreStorage):
     TYPE = "local"
     METADATA_DIR = "_meta"
+    LOAD_IN_PLACE = True
 
     @classmethod
     def get_datastore_root_from_config(cls, echo, create_on_absent=True):
@@ -105,20 +115,66 @@ class LocalStorage(DataStoreStorage):
         return results
 
     def save_bytes(self, path_and_bytes_iter, overwrite=False, len_hint=0):
-        for path, obj in path_and_bytes_iter:
-            if isinstance(obj, tuple):
-                byte_obj, metadata = obj
-            else:
-                byte_obj, metadata = obj, None
-            full_path = self.full_uri(path)
-            if not overwrite and os.path.exists(full_path):
-                continue
-            LocalStorage._makedirs(os.path.dirname(full_path))
-            with open(full_path, mode="wb") as f:
-                f.write(byte_obj.read())
-            if metadata:
-                with open("%s_meta" % full_path, mode="w") as f:
-                    json.dump(metadata, f)
+        max_workers = min(len_hint, DATASTORE_LOCAL_SAVE_MAX_WORKERS)
+        if max_workers <= 1:
+            for path, obj in path_and_bytes_iter:
+                self._save_one(path, obj, overwrite)
+            return
+        # Files are written by a pool of threads. We bound the number of
+        # pending writes so as to not hold all the objects of the iterator in
+        # memory at once.
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            for path, obj in path_and_bytes_iter:
+                if len(pending) >= 2 * max_workers:
+                    pending.popleft().result()
+                pending.append(executor.submit(self._save_one, path, obj, overwrite))
+            for future in pending:
+                future.result()
+
+    def _save_one(self, path, obj, overwrite):
+        # Saves a single object and its metadata (if any). The metadata is
+        # written first so that it is always present when the object is.
+        if isinstance(obj, tuple):
+            byte_obj, metadata = obj
+        else:
+            byte_obj, metadata = obj, None
+        full_path = self.full_uri(path)
+        if not overwrite and os.path.exists(full_path):
+            return
+        LocalStorage._makedirs(os.path.dirname(full_path))
+        if metadata:
+            self._write_atomically(
+                "%s_meta" % full_path, json.dumps(metadata).encode("utf-8")
+            )
+        self._write_atomically(full_path, byte_obj.read())
+
+    @staticmethod
+    def _write_atomically(full_path, data):
+        # Write to a temporary file in the same directory and rename it so
+        # that concurrent readers never see a partially written file.
+        dirname, basename = os.path.split(full_path)
+        tmp_path = os.path.join(dirname, ".%s.%s.tmp" % (basename, uuid4().hex))
+        try:
+            with open(tmp_path, mode="xb") as f:
+                f.write(data)
+                if DATASTORE_LOCAL_FSYNC:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, full_path)
+        except:  # noqa E722
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        if DATASTORE_LOCAL_FSYNC:
+            # Also persist the rename itself
+            dir_fd = os.open(dirname, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
 
     def load_bytes(self, paths):
         def iter_results():
@@ -7,14 +7,6 @@ from ..metaflow_config import DATASTORE_SYSROOT_S3
 from .datastore_storage import CloseAfterUse, DataStoreStorage
 
 
-try:
-    # python2
-    from urlparse import urlparse
-except:
-    # python3
-    from urllib.parse import urlparse
-
-
 class S3Storage(DataStoreStorage):
     TYPE = "s3"
 
@@ -32,14 +24,8 @@ class S3Storage(DataStoreStorage):
             tmproot=os.getcwd(),
             external_client=self.s3_client,
         ) as s3:
-            if len(paths) > 10:
-                s3objs = s3.info_many(paths, return_missing=True)
-                return [s3obj.exists for s3obj in s3objs]
-            else:
-                result = []
-                for path in paths:
-                    result.append(s3.info(path, return_missing=True).exists)
-                return result
+            s3objs = s3.info_many(paths, return_missing=True)
+            return [s3obj.exists for s3obj in s3objs]
 
     def info_file(self, path):
         with S3(
@@ -66,12 +52,10 @@ class S3Storage(DataStoreStorage):
             tmproot=os.getcwd(),
             external_client=self.s3_client,
         ) as s3:
-            results = s3.list_paths(paths)
+            results = [(o.url, o.exists) for o in s3.list_paths(paths)]
             return [
-                self.list_content_result(
-                    path=o.url[strip_prefix_len:], is_file=o.exists
-                )
-                for o in results
+                self.list_content_result(path=url[strip_prefix_len:], is_file=is_file)
+                for url, is_file in results
             ]
 
     def save_bytes(self, path_and_bytes_iter, overwrite=False, len_hint=0):
@@ -89,24 +73,14 @@ class S3Storage(DataStoreStorage):
             tmproot=os.getcwd(),
             external_client=self.s3_client,
         ) as s3:
-            # HACK: The S3 datatools we rely on does not currently do a good job
-            # determining if uploading things in parallel is more efficient than
-            # serially. We use a heuristic for now where if we have a lot of
-            # files, we will go in parallel and if we have few files, we will
-            # serially upload them. This is not ideal because there is also a size
-            # factor and one very large file with a few other small files, for
-            # example, would benefit from a parallel upload.
+            # put_many uploads the objects from memory using a pool of threads
+            # (without starting a s3op subprocess) so it is used as soon as
+            # there is more than one object to upload.
             #
-            # In the case of save_artifacts, currently len_hint is based on the
-            # total number of artifacts, not taking into account how many of them
-            # already exist in the CAS, i.e. it can be a gross overestimate. As a
-            # result, it is possible we take a latency hit by using put_many only
-            # for a few artifacts.
-            #
-            # A better approach would be to e.g. write all blobs to temp files
-            # and based on the total size and number of files use either put_files
-            # (which avoids re-writing the files) or s3.put sequentially.
-            if len_hint > 10:
+            # In the case of save_artifacts, len_hint is the number of blobs
+            # that are not already present in the CAS (the ContentAddressedStore
+            # checks for their existence in bulk before saving them).
+            if len_hint > 1:
                 # Use put_many
                 s3.put_many(starmap(S3PutObject, _convert()), overwrite)
             else:
@@ -125,21 +99,10 @@ class S3Storage(DataStoreStorage):
         )
 
         def iter_results():
-            # We similarly do things in parallel for many files. This is again
-            # a hack.
-            if len(paths) > 10:
-                results = s3.get_many(paths, return_missing=True, return_info=True)
-                for r in results:
-                    if r.exists:
-                        yield r.key, r.path, r.metadata
-                    else:
-                        yield r.key, None, None
-            else:
-                for p in paths:
-                    r = s3.get(p, return_missing=True, return_info=True)
-                    if r.exists:
-                        yield r.key, r.path, r.metadata
-                    else:
-                        yield r.key, None, None
+            for r in s3.get_many(paths, return_missing=True, return_info=True):
+                if r.exists:
+                    yield r.key, r.path, r.metadata
+                else:
+                    yield r.key, None, None
 
         return CloseAfterUse(iter_results(), closer=s3)
@@ -4,7 +4,7 @@ import pickle
 import sys
 import time
 
-from functools import wraps
+from functools import partial, wraps
 from io import BufferedIOBase, FileIO, RawIOBase
 from types import MethodType, FunctionType
 
@@ -75,6 +75,27 @@ class TaskDataStore(object):
     METADATA_ATTEMPT_SUFFIX = "attempt.json"
     METADATA_DONE_SUFFIX = "DONE.lock"
     METADATA_DATA_SUFFIX = "data.json"
+    METADATA_CONTROL_SUFFIX = "control.json"
+
+    # Internal artifacts the runtime needs to schedule the successors of a
+    # task. They are also saved, as plain JSON, in a "control record" written
+    # with the done marker so that the runtime can read them all at once
+    # without opening the datastore of the task (see load_control_record).
+    CONTROL_FIELDS = [
+        "_transition",
+        "_foreach_stack",
+        "_foreach_num_splits",
+        "_foreach_var",
+        "_unbounded_foreach",
+        "_control_mapper_tasks",
+        "_control_task_is_mapper_zero",
+    ]
+
+    # Artifacts with this encoding are pickled with protocol 5 and each of their
+    # out-of-band buffers is stored as a separate blob in the CAS. The blob for
+    # the artifact itself is a JSON header listing the keys of the buffers,
+    # followed by a newline and the pickle stream.
+    OUT_OF_BAND_ENCODING = "pickle-v5+buffers"
 
     @staticmethod
     def metadata_name_for_attempt(name, attempt):
@@ -119,8 +140,11 @@ class TaskDataStore(object):
         if ver >= 34:
             self._encodings.add("pickle-v4")
             self._encodings.add("gzip+pickle-v4")
+        if ver >= 38:
+            self._encodings.add(self.OUT_OF_BAND_ENCODING)
 
         self._is_done_set = False
+        self._control = None
 
         # If the mode is 'write', we initialize things to empty
         if self._mode == "w":
@@ -256,56 +280,119 @@ class TaskDataStore(object):
             Estimated number of items in artifacts_iter
         """
         artifact_names = []
+        # Artifacts pickled with out-of-band buffers are saved in two phases:
+        # their buffers are saved along with the other artifacts and the
+        # artifacts themselves are saved once the keys of the buffers are known.
+        out_of_band = (
+            metaflow_config.ARTIFACT_PICKLE_OUT_OF_BAND
+            and self.OUT_OF_BAND_ENCODING in self._encodings
+        )
+        out_of_band_streams = []
 
-        def pickle_iter():
-            for name, obj in artifacts_iter:
-                do_v4 = (
-                    force_v4 and force_v4
-                    if isinstance(force_v4, bool)
-                    else force_v4.get(name, False)
-                )
-                if do_v4:
+        def pickle_artifact(name, obj):
+            do_v4 = (
+                force_v4 and force_v4
+                if isinstance(force_v4, bool)
+                else force_v4.get(name, False)
+            )
+            if do_v4:
+                encode_type = "gzip+pickle-v4"
+                if encode_type not in self._encodings:
+                    raise DataException(
+                        "Artifact *%s* requires a serialization encoding that "
+                        "requires Python 3.4 or newer." % name
+                    )
+                try:
+                    blob = pickle.dumps(obj, protocol=4)
+                except TypeError:
+                    raise UnpicklableArtifactException(name)
+            else:
+                try:
+                    blob = pickle.dumps(obj, protocol=2)
+                    encode_type = "gzip+pickle-v2"
+                except (SystemError, OverflowError):
                     encode_type = "gzip+pickle-v4"
                     if encode_type not in self._encodings:
                         raise DataException(
-                            "Artifact *%s* requires a serialization encoding that "
-                            "requires Python 3.4 or newer." % name
+                            "Artifact *%s* is very large (over 2GB). "
+                            "You need to use Python 3.4 or newer if you want to "
+                            "serialize large objects." % name
                         )
                     try:
                         blob = pickle.dumps(obj, protocol=4)
-                    except TypeError as e:
+                    except TypeError:
                         raise UnpicklableArtifactException(name)
-                else:
+                except TypeError:
+                    raise UnpicklableArtifactException(name)
+
+            self._info[name] = {
+                "size": len(blob),
+                "type": str(type(obj)),
+                "encoding": encode_type,
+            }
+            return blob
+
+        def pickle_iter():
+            for name, obj in artifacts_iter:
+                if out_of_band:
+                    # Out-of-band pickling stays on this thread: the number of
+                    # blobs (buffers) of an artifact is only known once it is
+                    # pickled and the buffers are not copies, so there is
+                    # little to gain from producing them in the pool.
+                    buffers = []
                     try:
-                        blob = pickle.dumps(obj, protocol=2)
-                        encode_type = "gzip+pickle-v2"
-                    except (SystemError, OverflowError):
-                        encode_type = "gzip+pickle-v4"
-                        if encode_type not in self._encodings:
-                            raise DataException(
-                                "Artifact *%s* is very large (over 2GB). "
-                                "You need to use Python 3.4 or newer if you want to "
-                                "serialize large objects." % name
-                            )
-                        try:
-                            blob = pickle.dumps(obj, protocol=4)
-                        except TypeError as e:
-                            raise UnpicklableArtifactException(name)
-                    except TypeError as e:
+                        stream = pickle.dumps(
+                            obj, protocol=5, buffer_callback=buffers.append
+                        )
+                    except TypeError:
                         raise UnpicklableArtifactException(name)
-
-                self._info[name] = {
-                    "size": len(blob),
-                    "type": str(type(obj)),
-                    "encoding": encode_type,
-                }
-                artifact_names.append(name)
-                yield blob
+                    # The buffers reference the memory of obj directly; they
+                    # are not copied until they are packed by the CAS
+                    buffers = [b.raw() for b in buffers]
+                    self._info[name] = {
+                        "size": len(stream) + sum(b.nbytes for b in buffers),
+                        "type": str(type(obj)),
+                        "encoding": self.OUT_OF_BAND_ENCODING,
+                    }
+                    out_of_band_streams.append((name, stream))
+                    for b in buffers:
+                        artifact_names.append((name, True))
+                        yield b
+                    continue
+
+                # The artifact is pickled by the CAS, in its pool of threads if
+                # it has one. Pickling mostly holds the GIL but it still
+                # overlaps with the hashing, compression and saving of the
+                # other artifacts, which release it.
+                artifact_names.append((name, False))
+                yield partial(pickle_artifact, name, obj)
 
         # Use the content-addressed store to store all artifacts
-        save_result = self._ca_store.save_blobs(pickle_iter(), len_hint=len_hint)
-        for name, result in zip(artifact_names, save_result):
-            self._objects[name] = result.key
+        save_result = self._ca_store.save_blobs(
+            pickle_iter(),
+            len_hint=len_hint,
+            max_workers=metaflow_config.ARTIFACT_SAVE_MAX_WORKERS,
+            max_inflight_bytes=metaflow_config.ARTIFACT_SAVE_MAX_INFLIGHT_BYTES,
+        )
+        buffer_keys = defaultdict(list)
+        for (name, is_buffer), result in zip(artifact_names, save_result):
+            if is_buffer:
+                buffer_keys[name].append(result.key)
+            else:
+                self._objects[name] = result.key
+
+        if out_of_band_streams:
+
+            def header_iter():
+                for name, stream in out_of_band_streams:
+                    header = json.dumps({"buffers": buffer_keys[name]})
+                    yield header.encode("utf-8") + b"\n" + stream
+
+            save_result = self._ca_store.save_blobs(
+                header_iter(), len_hint=len(out_of_band_streams)
+            )
+            for (name, _), result in zip(out_of_band_streams, save_result):
+                self._objects[name] = result.key
 
     @require_mode(None)
     def load_artifacts(self, names):
@@ -339,6 +426,7 @@ class TaskDataStore(object):
                 "load artifacts" % self._path
             )
         to_load = defaultdict(list)
+        out_of_band_keys = set()
         for name in names:
             info = self._info.get(name)
             # We use gzip+pickle-v2 as this is the oldest/most compatible.
@@ -349,16 +437,33 @@ class TaskDataStore(object):
             else:
                 encode_type = "gzip+pickle-v2"
             if encode_type not in self._encodings:
+                if encode_type == self.OUT_OF_BAND_ENCODING:
+                    raise DataException(
+                        "Python 3.8 or later is required to load artifact '%s'" % name
+                    )
                 raise DataException(
                     "Python 3.4 or later is required to load artifact '%s'" % name
                 )
             else:
                 to_load[self._objects[name]].append(name)
+                if encode_type == self.OUT_OF_BAND_ENCODING:
+                    out_of_band_keys.add(self._objects[name])
         # At this point, we load what we don't have from the CAS
         # We assume that if we have one "old" style artifact, all of them are
         # like that which is an easy assumption to make since artifacts are all
         # stored by the same implementation of the datastore for a given task.
-        for (key, blob) in self._ca_store.load_blobs(to_load.keys()):
+        headers = {}
+        for (key, blob) in self._ca_store.load_blobs(
+            to_load.keys(), use_mmap=metaflow_config.DATASTORE_LOCAL_MMAP
+        ):
+            if key in out_of_band_keys:
+                # We load all the buffers for these artifacts in one go below
+                sep = blob.find(b"\n")
+                headers[key] = (
+                    json.loads(blob[:sep].decode("utf-8"))["buffers"],
+                    memoryview(blob)[sep + 1 :],
+                )
+                continue
             names = to_load[key]
             for name in names:
                 # We unpickle everytime to have fully distinct objects (the user
@@ -366,6 +471,34 @@ class TaskDataStore(object):
                 # be aliases of one another)
                 yield name, pickle.loads(blob)
 
+        if headers:
+            buffers = dict(
+                self._ca_store.load_blobs(
+                    set(k for buffer_keys, _ in headers.values() for k in buffer_keys),
+                    use_mmap=metaflow_config.DATASTORE_LOCAL_MMAP,
+                )
+            )
+            # Keys of the buffers already used by a loaded artifact
+            used = set()
+            for key, (buffer_keys, stream) in headers.items():
+                for name in to_load[key]:
+                    # The buffers are passed as memoryviews to avoid copying
+                    # them; objects reconstructed from them share memory with
+                    # the loaded blobs (they are read-only unless the blobs are
+                    # memory-mapped). A buffer used by more than one artifact
+                    # is copied for all but the first so that, as above, the
+                    # artifacts are fully distinct objects.
+                    obj_buffers = []
+                    for k in buffer_keys:
+                        view = memoryview(buffers[k])
+                        if k in used:
+                            view = memoryview(
+                                bytes(view) if view.readonly else bytearray(view)
+                            )
+                        used.add(k)
+                        obj_buffers.append(view)
+                    yield name, pickle.loads(stream, buffers=obj_buffers)
+
     @require_mode("r")
     def get_artifact_sizes(self, names):
         """
@@ -494,6 +627,22 @@ class TaskDataStore(object):
             for k, v in self._load_file(names, add_attempt).items()
         }
 
+    @require_mode("r")
+    def load_control_record(self):
+        """
+        Loads the control record of this task (see CONTROL_FIELDS)
+
+        Returns
+        -------
+        Dict: string -> JSON decoded object
+            Value of each of the CONTROL_FIELDS or None if the task has no
+            control record (if it was executed by an older version of Metaflow
+            for example)
+        """
+        return self.load_metadata([self.METADATA_CONTROL_SUFFIX])[
+            self.METADATA_CONTROL_SUFFIX
+        ]
+
     @require_mode(None)
     def has_metadata(self, name, add_attempt=True):
         """
@@ -581,19 +730,20 @@ class TaskDataStore(object):
 
         Will throw an exception if mode != 'w'
         """
-        self.save_metadata(
-            {
-                self.METADATA_DATA_SUFFIX: {
-                    "datastore": self.TYPE,
-                    "version": "1.0",
-                    "attempt": self._attempt,
-                    "python_version": sys.version,
-                    "objects": self._objects,
-                    "info": self._info,
-                },
-                self.METADATA_DONE_SUFFIX: "",
+        to_save = {
+            self.METADATA_DATA_SUFFIX: {
+                "datastore": self.TYPE,
+                "version": "1.0",
+                "attempt": self._attempt,
+                "python_version": sys.version,
+                "objects": self._objects,
+                "info": self._info,
             }
-        )
+        }
+        if self._control is not None:
+            to_save[self.METADATA_CONTROL_SUFFIX] = self._control
+        to_save[self.METADATA_DONE_SUFFIX] = ""
+        self.save_metadata(to_save)
 
         if self._metadata:
             self._metadata.register_metadata(
@@ -641,6 +791,7 @@ class TaskDataStore(object):
         """
         self._objects = origin._objects
         self._info = origin._info
+        self._control = origin.load_control_record()
 
     @only_if_not_done
     @require_mode("w")
@@ -677,6 +828,14 @@ class TaskDataStore(object):
             self._objects.update(flow._datastore._objects)
             self._info.update(flow._datastore._info)
 
+        control = {name: getattr(flow, name, None) for name in self.CONTROL_FIELDS}
+        try:
+            json.dumps(control)
+        except (TypeError, ValueError):
+            # The runtime will load these fields from the artifacts instead
+            control = None
+        self._control = control
+
         # we create a list of valid_artifacts in advance, outside of
         # artifacts_iter so we can provide a len_hint below
         valid_artifacts = []
@@ -11,7 +11,11 @@ from tempfile import mkdtemp, NamedTemporaryFile
 
 from .. import FlowSpec
 from ..current import current
-from ..metaflow_config import DATATOOLS_S3ROOT, S3_RETRY_COUNT
+from ..metaflow_config import (
+    DATATOOLS_S3ROOT,
+    S3_INPROCESS_MAX_KEYS,
+    S3_RETRY_COUNT,
+)
 from ..util import (
     namedtuple_with_defaults,
     is_stringish,
@@ -31,13 +35,16 @@ except:
     # python3
     from urllib.parse import urlparse
 
-from .s3util import get_s3_client, read_in_chunks, get_timestamp
+from .s3util import (
+    download_object,
+    get_s3_client,
+    get_timestamp,
+    read_in_chunks,
+)
 
 try:
     import boto3
-    from boto3.s3.transfer import TransferConfig
 
-    DOWNLOAD_FILE_THRESHOLD = 2 * TransferConfig().multipart_threshold
     DOWNLOAD_MAX_CHUNK = 2 * 1024 * 1024 * 1024 - 1
     boto_found = True
 except:
@@ -81,6 +88,45 @@ class MetaflowS3AccessDenied(MetaflowException):
     headline = "S3 access denied"
 
 
+def _check_put_object(key, obj):
+    # Returns a file object or a stream (see _is_stream) for the value of a
+    # put
+    if isinstance(obj, (RawIOBase, BufferedIOBase)):
+        if not obj.readable():
+            raise MetaflowS3InvalidObject(
+                "Object corresponding to the key '%s' is not readable" % key
+            )
+        return obj
+    if is_stringish(obj):
+        return to_fileobj(obj)
+    if isinstance(obj, (memoryview, bytearray)):
+        return obj
+    if hasattr(obj, "__next__"):
+        # Only iterators (and not any iterable like a list, a dict or an
+        # array) are streamed
+        return _check_chunks(key, obj)
+    raise MetaflowS3InvalidObject(
+        "Object corresponding to the key '%s' is not a string, a bytes object, "
+        "a file object or an iterator of bytes." % key
+    )
+
+
+def _check_chunks(key, chunks):
+    for chunk in chunks:
+        if not isinstance(chunk, (bytes, bytearray, memoryview)):
+            raise MetaflowS3InvalidObject(
+                "Iterator corresponding to the key '%s' produced a %s instead "
+                "of bytes." % (key, type(chunk).__name__)
+            )
+        yield chunk
+
+
+def _is_stream(obj):
+    # Streams are uploaded in parts by upload_in_parts; seekable file objects
+    # are uploaded (and retried) as a whole
+    return not isinstance(obj, (RawIOBase, BufferedIOBase)) or not obj.seekable()
+
+
 class S3Object(object):
     """
     This object represents a path or an object in S3,
@@ -590,17 +636,12 @@ class S3(object):
                 resp = s3.get_object(
                     Bucket=src.netloc, Key=src.path.lstrip("/"), Range=r
                 )
-            else:
-                resp = s3.get_object(Bucket=src.netloc, Key=src.path.lstrip("/"))
-            sz = resp["ContentLength"]
-            if not r and sz > DOWNLOAD_FILE_THRESHOLD:
-                # In this case, it is more efficient to use download_file as it
-                # will download multiple parts in parallel (it does it after
-                # multipart_threshold)
-                s3.download_file(src.netloc, src.path.lstrip("/"), tmp)
-            else:
+                sz = resp["ContentLength"]
                 with open(tmp, mode="wb") as t:
                     read_in_chunks(t, resp["Body"], sz, DOWNLOAD_MAX_CHUNK)
+            else:
+                # Large objects are downloaded in ranges, concurrently
+                resp = download_object(s3, src.netloc, src.path.lstrip("/"), tmp)
             if return_info:
                 return {
                     "content_type": resp["ContentType"],
@@ -645,66 +686,52 @@ class S3(object):
             a list of S3Objects corresponding to the objects requested.
         """
 
-        def _get():
-            res = self._read_many_files(
-                "get",
-                map(self._url_and_range, keys),
-                allow_missing=return_missing,
-                verify=True,
-                verbose=False,
-                info=return_info,
-                listing=True,
-            )
-
-            for s3prefix, s3url, fname in res:
-                if return_info:
-                    if fname:
-                        # We have a metadata file to read from
-                        with open(
-                            os.path.join(self._tmpdir, "%s_meta" % fname), "r"
-                        ) as f:
-                            info = json.load(f)
-                        yield self._s3root, s3url, os.path.join(
-                            self._tmpdir, fname
-                        ), None, info["content_type"], info["metadata"], None, info[
-                            "last_modified"
-                        ]
-                    else:
-                        yield self._s3root, s3prefix, None
-                else:
-                    if fname:
-                        yield self._s3root, s3url, os.path.join(self._tmpdir, fname)
-                    else:
-                        # missing entries per return_missing=True
-                        yield self._s3root, s3prefix, None
-
-        return list(starmap(S3Object, _get()))
+        res = self._read_many_files(
+            "get",
+            map(self._url_and_range, keys),
+            allow_missing=return_missing,
+            verify=True,
+            verbose=False,
+            info=return_info,
+            listing=True,
+        )
+        return list(starmap(S3Object, self._get_many_results(res, return_info)))
 
-    def get_recursive(self, keys, return_info=False):
+    def iter_get_many(
+        self, keys, return_missing=False, return_info=True, max_spooled=None
+    ):
         """
-        Get many objects from S3 recursively in parallel.
+        Get many objects from S3 in parallel, yielding each object as soon as
+        it is downloaded.
         Args:
-            keys: (required) a list of suffixes for paths to download
-                  recursively.
-            return_info: (optional, default False) if set to True, fetch the
+            keys: (required) a list of suffixes identifying the objects, as
+                  for get_many.
+            return_missing: (optional, default False) if set to True, do
+                            not raise an exception for a missing key but
+                            return it as an S3Object with .exists == False.
+            return_info: (optional, default True) if set to True, fetch the
                          content-type and user metadata associated with the object.
+            max_spooled: (optional) if set, at most this many objects are
+                         downloaded ahead of the consumer and the local file
+                         of each object is removed when the next object is
+                         requested: its content must be read (or the file
+                         moved) before then.
         Returns:
-            a list of S3Objects corresponding to the objects requested.
+            an iterator of S3Objects corresponding to the objects requested,
+            in the order in which their downloads complete.
         """
+        res = self._iter_get(
+            map(self._url_and_range, keys),
+            max_spooled,
+            allow_missing=return_missing,
+            info=return_info,
+        )
+        return self._spool(self._get_many_results(res, return_info), max_spooled)
 
-        def _get():
-            res = self._read_many_files(
-                "get",
-                map(self._url_and_range, keys),
-                recursive=True,
-                verify=True,
-                verbose=False,
-                info=return_info,
-                listing=True,
-            )
-
-            for s3prefix, s3url, fname in res:
-                if return_info:
+    def _get_many_results(self, res, return_info):
+        for s3prefix, s3url, fname in res:
+            if return_info:
+                if fname:
                     # We have a metadata file to read from
                     with open(os.path.join(self._tmpdir, "%s_meta" % fname), "r") as f:
                         info = json.load(f)
@@ -714,9 +741,106 @@ class S3(object):
                         "last_modified"
                     ]
                 else:
-                    yield s3prefix, s3url, os.path.join(self._tmpdir, fname)
+                    yield self._s3root, s3prefix, None
+            else:
+                if fname:
+                    yield self._s3root, s3url, os.path.join(self._tmpdir, fname)
+                else:
+                    # missing entries per return_missing=True
+                    yield self._s3root, s3prefix, None
+
+    def get_recursive(self, keys, return_info=False):
+        """
+        Get many objects from S3 recursively in parallel.
+        Args:
+            keys: (required) a list of suffixes for paths to download
+                  recursively.
+            return_info: (optional, default False) if set to True, fetch the
+                         content-type and user metadata associated with the object.
+        Returns:
+            a list of S3Objects corresponding to the objects requested.
+        """
+
+        res = self._read_many_files(
+            "get",
+            map(self._url_and_range, keys),
+            recursive=True,
+            verify=True,
+            verbose=False,
+            info=return_info,
+            listing=True,
+        )
+        return list(starmap(S3Object, self._get_recursive_results(res, return_info)))
 
-        return list(starmap(S3Object, _get()))
+    def iter_get_recursive(self, keys, return_info=False, max_spooled=None):
+        """
+        Get many objects from S3 recursively in parallel, yielding each object
+        as soon as it is downloaded.
+        Args:
+            keys: (required) a list of suffixes for paths to download
+                  recursively.
+            return_info: (optional, default False) if set to True, fetch the
+                         content-type and user metadata associated with the object.
+            max_spooled: (optional) if set, at most this many objects are
+                         downloaded ahead of the consumer and the local file
+                         of each object is removed when the next object is
+                         requested (see iter_get_many).
+        Returns:
+            an iterator of S3Objects corresponding to the objects requested,
+            in the order in which their downloads complete.
+        """
+        res = self._iter_get(
+            map(self._url_and_range, keys),
+            max_spooled,
+            recursive=True,
+            info=return_info,
+        )
+        return self._spool(self._get_recursive_results(res, return_info), max_spooled)
+
+    def _get_recursive_results(self, res, return_info):
+        for s3prefix, s3url, fname in res:
+            if return_info:
+                # We have a metadata file to read from
+                with open(os.path.join(self._tmpdir, "%s_meta" % fname), "r") as f:
+                    info = json.load(f)
+                yield self._s3root, s3url, os.path.join(
+                    self._tmpdir, fname
+                ), None, info["content_type"], info["metadata"], None, info[
+                    "last_modified"
+                ]
+            else:
+                yield s3prefix, s3url, os.path.join(self._tmpdir, fname)
+
+    def _iter_get(self, prefixes_and_ranges, max_spooled, **options):
+        # Streaming downloads are always done in process: s3op only reports
+        # its results once all the objects are downloaded.
+        from .s3transfer import MetaflowS3TransferError, S3TransferEngine
+
+        prefixes_and_ranges = list(prefixes_and_ranges)
+        engine = S3TransferEngine(self._tmpdir)
+        try:
+            for res in engine.iter_get(
+                prefixes_and_ranges, max_spooled=max_spooled, **options
+            ):
+                yield res
+        except MetaflowS3TransferError as ex:
+            raise self._transfer_exception(
+                ex,
+                "Getting S3 files failed.\nFirst prefix requested: %s\n"
+                % (prefixes_and_ranges[0],),
+            )
+
+    @staticmethod
+    def _spool(args, max_spooled):
+        for obj in starmap(S3Object, args):
+            yield obj
+            if max_spooled and obj.downloaded:
+                # the consumer is done with this object
+                for path in (obj.path, "%s_meta" % obj.path):
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
 
     def get_all(self, return_info=False):
         """
@@ -741,7 +865,10 @@ class S3(object):
         Args:
             key:           (required) suffix for the object.
             obj:           (required) a bytes, string, or a unicode object to
-                           be stored in S3.
+                           be stored in S3. It can also be a file object, a
+                           memoryview or an iterator of bytes objects; these are
+                           streamed to S3 without being staged to disk (see
+                           S3_UPLOAD_PART_SIZE and S3_UPLOAD_MAX_MEMORY).
             overwrite:     (optional) overwrites the key with obj, if it exists
             content_type:  (optional) string representing the MIME type of the
                            object
@@ -749,20 +876,10 @@ class S3(object):
         Returns:
             an S3 URL corresponding to the object stored.
         """
-        if isinstance(obj, (RawIOBase, BufferedIOBase)):
-            if not obj.readable() or not obj.seekable():
-                raise MetaflowS3InvalidObject(
-                    "Object corresponding to the key '%s' is not readable or seekable"
-                    % key
-                )
-            blob = obj
-        else:
-            if not is_stringish(obj):
-                raise MetaflowS3InvalidObject(
-                    "Object corresponding to the key '%s' is not a string "
-                    "or a bytes object." % key
-                )
-            blob = to_fileobj(obj)
+        obj = _check_put_object(key, obj)
+        if _is_stream(obj):
+            return self._put_stream(key, obj, overwrite, content_type, metadata)
+        blob = obj
         # We override the close functionality to prevent closing of the
         # file if it is used multiple times when uploading (since upload_fileobj
         # will/may close it on failure)
@@ -805,12 +922,26 @@ class S3(object):
                 real_close()
             return url
 
+    def _put_stream(self, key, obj, overwrite, content_type, metadata):
+        # A stream can't be rewound so the upload is not retried as a whole
+        # (upload_in_parts retries each of its requests)
+        url = self._url(key)
+        store_info = {"obj": obj, "url": url, "content_type": content_type}
+        if metadata:
+            store_info["metadata"] = {"metaflow-user-attributes": json.dumps(metadata)}
+        self._in_process(
+            lambda engine: engine.put_objects([store_info], overwrite),
+            "Uploading S3 files failed.\n",
+        )
+        return url
+
     def put_many(self, key_objs, overwrite=True):
         """
         Put objects to S3 in parallel.
         Args:
             key_objs:  (required) an iterator of (key, value) tuples. Value must
-                       be a string, bytes, or a unicode object. Instead of
+                       be a string, bytes, or a unicode object or any of the
+                       objects S3.put can stream. Instead of
                        (key, value) tuples, you can also pass any object that
                        has the following properties 'key', 'value', 'content_type',
                        'metadata' like the S3PutObject for example. 'key' and
@@ -820,7 +951,7 @@ class S3(object):
             a list of (key, S3 URL) tuples corresponding to the files sent.
         """
 
-        def _store():
+        def _objects():
             for key_obj in key_objs:
                 if isinstance(key_obj, tuple):
                     key = key_obj[0]
@@ -830,6 +961,8 @@ class S3(object):
                     obj = key_obj.value
                 store_info = {
                     "key": key,
+                    "obj": _check_put_object(key, obj),
+                    "url": self._url(key),
                     "content_type": getattr(key_obj, "content_type", None),
                 }
                 metadata = getattr(key_obj, "metadata", None)
@@ -837,30 +970,22 @@ class S3(object):
                     store_info["metadata"] = {
                         "metaflow-user-attributes": json.dumps(metadata)
                     }
-                if isinstance(obj, (RawIOBase, BufferedIOBase)):
-                    if not obj.readable() or not obj.seekable():
-                        raise MetaflowS3InvalidObject(
-                            "Object corresponding to the key '%s' is not readable or seekable"
-                            % key
-                        )
-                else:
-                    if not is_stringish(obj):
-                        raise MetaflowS3InvalidObject(
-                            "Object corresponding to the key '%s' is not a string "
-                            "or a bytes object." % key
-                        )
-                    obj = to_fileobj(obj)
-                with NamedTemporaryFile(
-                    dir=self._tmpdir,
-                    delete=False,
-                    mode="wb",
-                    prefix="metaflow.s3.put_many.",
-                ) as tmp:
-                    tmp.write(obj.read())
-                    tmp.close()
-                    yield tmp.name, self._url(key), store_info
-
-        return self._put_many_files(_store(), overwrite)
+                # Only the key and URL are kept: keeping store_info would keep
+                # every object in memory until all of them are uploaded
+                uploaded.append((key, store_info["url"]))
+                yield store_info
+
+        # The objects are uploaded from memory (or streamed) by threads of this
+        # process, whatever their number, instead of being written to
+        # temporary files for s3op.
+        uploaded = []
+        urls = set(
+            self._in_process(
+                lambda engine: engine.put_objects(_objects(), overwrite),
+                "Uploading S3 files failed.\n",
+            )
+        )
+        return [(key, url) for key, url in uploaded if url in urls]
 
     def put_files(self, key_paths, overwrite=True):
         """
@@ -938,8 +1063,24 @@ class S3(object):
     # bytes. All inputs and outputs from these functions are Unicode.
     # Conversion between bytes and unicode is done through
     # and url_unquote.
+    #
+    # Batches of at most S3_INPROCESS_MAX_KEYS objects are processed by a
+    # S3TransferEngine in this process; larger ones (and recursive downloads
+    # which may expand to many more objects) by the s3op subprocess.
     def _read_many_files(self, op, prefixes_and_ranges, **options):
         prefixes_and_ranges = list(prefixes_and_ranges)
+        if not prefixes_and_ranges:
+            return
+        if len(prefixes_and_ranges) <= S3_INPROCESS_MAX_KEYS and not (
+            op == "get" and options.get("recursive")
+        ):
+            for res in self._in_process(
+                lambda engine: engine.read_many(op, prefixes_and_ranges, **options),
+                "Getting S3 files failed.\nFirst prefix requested: %s\n"
+                % (prefixes_and_ranges[0],),
+            ):
+                yield res
+            return
         with NamedTemporaryFile(
             dir=self._tmpdir,
             mode="wb",
@@ -976,6 +1117,17 @@ class S3(object):
             )
             for local, url, info in url_info
         ]
+        if not url_dicts:
+            return []
+        if len(url_dicts) <= S3_INPROCESS_MAX_KEYS:
+            urls = set(
+                self._in_process(
+                    lambda engine: engine.put_many(url_dicts, overwrite),
+                    "Uploading S3 files failed.\nFirst key: %s\n"
+                    % url_info[0][2]["key"],
+                )
+            )
+            return [(info["key"], url) for _, url, info in url_info if url in urls]
 
         with NamedTemporaryFile(
             dir=self._tmpdir,
@@ -1006,6 +1158,32 @@ class S3(object):
                     urls.add(url)
                 return [(info["key"], url) for _, url, info in url_info if url in urls]
 
+    def _in_process(self, func, error_msg):
+        from .s3transfer import MetaflowS3TransferError, S3TransferEngine
+
+        try:
+            return func(S3TransferEngine(self._tmpdir))
+        except MetaflowS3TransferError as ex:
+            raise self._transfer_exception(ex, error_msg)
+
+    @staticmethod
+    def _transfer_exception(ex, error_msg):
+        # Maps the errors of the S3TransferEngine to the exceptions raised
+        # for the exit codes of s3op
+        from . import s3op
+
+        if ex.code == s3op.ERROR_URL_NOT_FOUND:
+            return MetaflowS3NotFound("URL not found: %s" % ex.url)
+        elif ex.code == s3op.ERROR_URL_ACCESS_DENIED:
+            return MetaflowS3AccessDenied("Access denied to URL: %s" % ex.url)
+        elif ex.code == s3op.ERROR_INVALID_URL:
+            return MetaflowS3URLException("Invalid url: %s" % ex.url)
+        elif ex.code == s3op.ERROR_NOT_FULL_PATH:
+            return MetaflowS3URLException("URL not a full path: %s" % ex.url)
+        elif ex.code == s3op.ERROR_LOCAL_FILE_NOT_FOUND:
+            return MetaflowS3NotFound("Local file not found: %s" % ex.url)
+        return MetaflowS3Exception("%sError: %s" % (error_msg, ex))
+
     def _s3op_with_retries(self, mode, **options):
         from . import s3op
 
@@ -8,19 +8,17 @@ import os
 import traceback
 from hashlib import sha1
 from tempfile import NamedTemporaryFile
-from multiprocessing import Process, Queue
+import random
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import BoundedSemaphore, Lock
 from itertools import starmap, chain, islice
 
-from boto3.s3.transfer import TransferConfig
-
 try:
     # python2
     from urlparse import urlparse
-    from Queue import Full as QueueFull
 except:
     # python3
     from urllib.parse import urlparse
-    from queue import Full as QueueFull
 
 import click
 
@@ -28,15 +26,32 @@ import click
 # PYTHONPATH for the parent Metaflow explicitly.
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
 
-# we use Metaflow's parallel_imap_unordered instead of
-# multiprocessing.Pool because https://bugs.python.org/issue31886
-from metaflow.util import TempDir, url_quote, url_unquote
-from metaflow.multicore_utils import parallel_map
-from metaflow.datatools.s3util import aws_retry, read_in_chunks, get_timestamp
+from metaflow.util import url_quote, url_unquote
+from metaflow.datatools.s3util import (
+    aws_retry,
+    download_object,
+    get_s3_client,
+    read_in_chunks,
+    get_timestamp,
+)
+from metaflow.metaflow_config import (
+    S3_DOWNLOAD_MAX_CONCURRENCY,
+    S3_RETRY_COUNT,
+)
 
-NUM_WORKERS_DEFAULT = 64
+# Maximum number of concurrent operations; the actual number is adjusted
+# between INITIAL_WORKERS and this value depending on the throughput achieved
+# (see AdaptiveConcurrency)
+NUM_WORKERS_DEFAULT = 256
+INITIAL_WORKERS = 16
+# Throughput is measured over windows of this many seconds and a doubling of
+# the concurrency is kept if it improves the throughput by this factor
+THROUGHPUT_WINDOW = 1.0
+THROUGHPUT_GAIN = 1.1
+# Maximum number of large objects downloaded in ranges at once; each of them
+# uses up to S3_DOWNLOAD_MAX_CONCURRENCY connections of the shared client
+MAX_RANGED_DOWNLOADS = 4
 
-DOWNLOAD_FILE_THRESHOLD = 2 * TransferConfig().multipart_threshold
 DOWNLOAD_MAX_CHUNK = 2 * 1024 * 1024 * 1024 - 1
 
 
@@ -97,13 +112,164 @@ def normalize_client_error(err):
 
 
 # S3 worker pool
+#
+# Operations on URLs are performed by a pool of threads which share a boto3
+# client (and thus its pool of connections). The number of operations
+# performed concurrently is adjusted by AdaptiveConcurrency.
+
+_shared_client_lock = Lock()
+_shared_client = None
+_shared_client_pool_size = 0
+_ranged_downloads = BoundedSemaphore(MAX_RANGED_DOWNLOADS)
+
+
+def get_shared_s3_client(max_pool_connections=0):
+    # boto3 clients are thread-safe but creating them is not
+    global _shared_client, _shared_client_pool_size
+    with _shared_client_lock:
+        if _shared_client is None or max_pool_connections > _shared_client_pool_size:
+            pool_size = max(max_pool_connections, _shared_client_pool_size)
+            _shared_client = get_s3_client(max_pool_connections=pool_size)
+            _shared_client_pool_size = pool_size
+        return _shared_client
+
+
+class AdaptiveConcurrency(object):
+    """
+    Number of operations performed concurrently by the worker threads.
+
+    The concurrency starts at `initial` and doubles, up to `maximum`, after
+    each window of `window` seconds in which the throughput (in bytes or in
+    operations per second) improved by at least THROUGHPUT_GAIN over the
+    best throughput seen at the previous levels. It is halved when S3
+    throttles requests (503 SlowDown), at most once per window, after which
+    the throughput is measured again before ramping up.
+    """
+
+    def __init__(self, initial, maximum, window=THROUGHPUT_WINDOW):
+        self.maximum = maximum
+        self.target = max(1, min(initial, maximum))
+        self.peak = self.target
+        self.num_throttled = 0
+        self.total_bytes = 0
+        self._window = window
+        self._lock = Lock()
+        self._best = (0, 0)
+        self._measure_only = False
+        self._last_backoff = 0
+        self._start_window()
+
+    def _start_window(self):
+        self._window_start = time.time()
+        self._window_bytes = 0
+        self._window_ops = 0
+
+    def record(self, num_bytes):
+        # Called when an operation on a URL completes
+        with self._lock:
+            self.total_bytes += num_bytes
+            self._window_bytes += num_bytes
+            self._window_ops += 1
+            elapsed = time.time() - self._window_start
+            if elapsed < self._window:
+                return
+            throughput = (self._window_bytes / elapsed, self._window_ops / elapsed)
+            if self._measure_only:
+                self._measure_only = False
+                self._best = throughput
+            elif any(
+                new > THROUGHPUT_GAIN * old for new, old in zip(throughput, self._best)
+            ):
+                self._best = throughput
+                self.target = min(self.maximum, self.target * 2)
+                self.peak = max(self.peak, self.target)
+            else:
+                self._best = tuple(map(max, throughput, self._best))
+            self._start_window()
+
+    def throttled(self):
+        # Called when S3 responds with a 503 SlowDown
+        with self._lock:
+            self.num_throttled += 1
+            now = time.time()
+            if now - self._last_backoff < self._window:
+                return
+            self._last_backoff = now
+            self.target = max(1, self.target // 2)
+            self._measure_only = True
+            self._start_window()
+
+
+def is_throttling_error(error_code):
+    return error_code in (503, "SlowDown")
+
+
+def register_throttling_handler(s3, concurrency):
+    # botocore retries throttled requests itself; this handler only notifies
+    # `concurrency` of each throttled response (it returns None so that the
+    # retry handler of botocore still decides whether to retry).
+    def _on_needs_retry(response=None, **kwargs):
+        if response is not None:
+            http_response, parsed = response
+            code = parsed.get("Error", {}).get("Code")
+            if http_response.status_code == 503 or code == "SlowDown":
+                concurrency.throttled()
+
+    s3.meta.events.register_first("needs-retry.s3", _on_needs_retry)
+    return _on_needs_retry
+
+
+def op_info(s3, client_error, url):
+    try:
+        head = s3.head_object(Bucket=url.bucket, Key=url.path)
+        to_return = {
+            "error": None,
+            "size": head["ContentLength"],
+            "content_type": head["ContentType"],
+            "metadata": head["Metadata"],
+            "last_modified": get_timestamp(head["LastModified"]),
+        }
+    except client_error as err:
+        error_code = normalize_client_error(err)
+        if error_code == 404:
+            to_return = {"error": ERROR_URL_NOT_FOUND}
+        elif error_code == 403:
+            to_return = {"error": ERROR_URL_ACCESS_DENIED}
+        else:
+            to_return = {"error": error_code}
+    return to_return
 
 
-def worker(result_file_name, queue, mode):
+def process_url(s3, client_error, mode, url, concurrency):
+    # Performs the operation `mode` on `url`, retrying it if S3 still
+    # throttles it after the retries of botocore. Returns the result of the
+    # operation (see _process_url).
+    for i in range(S3_RETRY_COUNT + 1):
+        try:
+            result, num_bytes = _process_url(s3, client_error, mode, url)
+            concurrency.record(num_bytes)
+            return result
+        except client_error as err:
+            if i == S3_RETRY_COUNT or not is_throttling_error(
+                normalize_client_error(err)
+            ):
+                raise
+            concurrency.throttled()
+            # add some jitter to make sure retries are not synchronized
+            time.sleep(2 ** i + random.randint(0, 10))
+
+
+def _process_url(s3, client_error, mode, url):
     # Interpret mode, it can either be a single op or something like
     # info_download or info_upload which implies:
     #  - for download: we need to return the information as well
     #  - for upload: we need to not overwrite the file if it exists
+    #
+    # Returns a tuple (result, number of bytes transferred) where result is:
+    #  - for info: None
+    #  - for download: the size of the object (only for info_download), or
+    #    -ERROR_URL_NOT_FOUND or -ERROR_URL_ACCESS_DENIED
+    #  - for upload: 0 if the file was uploaded, None otherwise
     modes = mode.split("_")
     pre_op_info = False
     if len(modes) > 1:
@@ -112,168 +278,130 @@ def worker(result_file_name, queue, mode):
     else:
         mode = modes[0]
 
-    def op_info(url):
+    if mode == "info":
+        result = op_info(s3, client_error, url)
+        with open(url.local, "w") as f:
+            json.dump(result, f)
+        if is_throttling_error(result["error"]):
+            raise client_error({"Error": {"Code": str(result["error"])}}, "HeadObject")
+        return None, 0
+    elif mode == "download":
+        tmp = NamedTemporaryFile(dir=".", mode="wb", delete=False)
         try:
-            head = s3.head_object(Bucket=url.bucket, Key=url.path)
-            to_return = {
-                "error": None,
-                "size": head["ContentLength"],
-                "content_type": head["ContentType"],
-                "metadata": head["Metadata"],
-                "last_modified": get_timestamp(head["LastModified"]),
-            }
+            if url.range:
+                resp = s3.get_object(Bucket=url.bucket, Key=url.path, Range=url.range)
+                read_in_chunks(
+                    tmp, resp["Body"], resp["ContentLength"], DOWNLOAD_MAX_CHUNK
+                )
+                tmp.close()
+            else:
+                # Large objects are downloaded in ranges, concurrently
+                tmp.close()
+                resp = download_object(
+                    s3, url.bucket, url.path, tmp.name, range_slots=_ranged_downloads
+                )
+            sz = resp["ContentLength"]
+            os.rename(tmp.name, url.local)
         except client_error as err:
+            tmp.close()
+            os.unlink(tmp.name)
             error_code = normalize_client_error(err)
             if error_code == 404:
-                to_return = {"error": ERROR_URL_NOT_FOUND, "raise_error": err}
+                return -ERROR_URL_NOT_FOUND, 0
             elif error_code == 403:
-                to_return = {"error": ERROR_URL_ACCESS_DENIED, "raise_error": err}
+                return -ERROR_URL_ACCESS_DENIED, 0
             else:
-                to_return = {"error": error_code, "raise_error": err}
-        return to_return
-
-    with open(result_file_name, "w") as result_file:
-        try:
-            from metaflow.datatools.s3util import get_s3_client
-
-            s3, client_error = get_s3_client()
-            while True:
-                url, idx = queue.get()
-                if url is None:
-                    break
-                if mode == "info":
-                    result = op_info(url)
-                    orig_error = result.get("raise_error", None)
-                    if orig_error:
-                        del result["raise_error"]
-                    with open(url.local, "w") as f:
-                        json.dump(result, f)
-                elif mode == "download":
-                    tmp = NamedTemporaryFile(dir=".", mode="wb", delete=False)
-                    try:
-                        if url.range:
-                            resp = s3.get_object(
-                                Bucket=url.bucket, Key=url.path, Range=url.range
-                            )
-                        else:
-                            resp = s3.get_object(Bucket=url.bucket, Key=url.path)
-                        sz = resp["ContentLength"]
-                        if not url.range and sz > DOWNLOAD_FILE_THRESHOLD:
-                            # In this case, it is more efficient to use download_file as it
-                            # will download multiple parts in parallel (it does it after
-                            # multipart_threshold)
-                            s3.download_file(url.bucket, url.path, tmp.name)
-                        else:
-                            read_in_chunks(tmp, resp["Body"], sz, DOWNLOAD_MAX_CHUNK)
-                        tmp.close()
-                        os.rename(tmp.name, url.local)
-                    except client_error as err:
-                        tmp.close()
-                        os.unlink(tmp.name)
-                        error_code = normalize_client_error(err)
-                        if error_code == 404:
-                            result_file.write("%d %d\n" % (idx, -ERROR_URL_NOT_FOUND))
-                            continue
-                        elif error_code == 403:
-                            result_file.write(
-                                "%d %d\n" % (idx, -ERROR_URL_ACCESS_DENIED)
-                            )
-                            continue
-                        else:
-                            raise
-                        # TODO specific error message for out of disk space
-                    # If we need the metadata, get it and write it out
-                    if pre_op_info:
-
-                        with open("%s_meta" % url.local, mode="w") as f:
-                            args = {"size": resp["ContentLength"]}
-                            if resp["ContentType"]:
-                                args["content_type"] = resp["ContentType"]
-                            if resp["Metadata"] is not None:
-                                args["metadata"] = resp["Metadata"]
-                            if resp["LastModified"]:
-                                args["last_modified"] = get_timestamp(
-                                    resp["LastModified"]
-                                )
-                            json.dump(args, f)
-                        # Finally, we push out the size to the result_pipe since
-                        # the size is used for verification and other purposes and
-                        # we want to avoid file operations for this simple process
-                        result_file.write("%d %d\n" % (idx, resp["ContentLength"]))
-                else:
-                    # This is upload, if we have a pre_op, it means we do not
-                    # want to overwrite
-                    do_upload = False
-                    if pre_op_info:
-                        result_info = op_info(url)
-                        if result_info["error"] == ERROR_URL_NOT_FOUND:
-                            # We only upload if the file is not found
-                            do_upload = True
-                    else:
-                        # No pre-op so we upload
-                        do_upload = True
-                    if do_upload:
-                        extra = None
-                        if url.content_type or url.metadata:
-                            extra = {}
-                            if url.content_type:
-                                extra["ContentType"] = url.content_type
-                            if url.metadata is not None:
-                                extra["Metadata"] = url.metadata
-                        s3.upload_file(url.local, url.bucket, url.path, ExtraArgs=extra)
-                        # We indicate that the file was uploaded
-                        result_file.write("%d %d\n" % (idx, 0))
+                raise
+            # TODO specific error message for out of disk space
         except:
-            traceback.print_exc()
-            sys.exit(ERROR_WORKER_EXCEPTION)
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+        # If we need the metadata, get it and write it out
+        if pre_op_info:
+            with open("%s_meta" % url.local, mode="w") as f:
+                args = {"size": resp["ContentLength"]}
+                if resp["ContentType"]:
+                    args["content_type"] = resp["ContentType"]
+                if resp["Metadata"] is not None:
+                    args["metadata"] = resp["Metadata"]
+                if resp["LastModified"]:
+                    args["last_modified"] = get_timestamp(resp["LastModified"])
+                json.dump(args, f)
+            # Finally, we return the size since it is used for verification
+            # and other purposes
+            return resp["ContentLength"], sz
+        return None, sz
+    else:
+        # This is upload, if we have a pre_op, it means we do not
+        # want to overwrite
+        do_upload = False
+        if pre_op_info:
+            result_info = op_info(s3, client_error, url)
+            if result_info["error"] == ERROR_URL_NOT_FOUND:
+                # We only upload if the file is not found
+                do_upload = True
+        else:
+            # No pre-op so we upload
+            do_upload = True
+        if do_upload:
+            extra = None
+            if url.content_type or url.metadata:
+                extra = {}
+                if url.content_type:
+                    extra["ContentType"] = url.content_type
+                if url.metadata is not None:
+                    extra["Metadata"] = url.metadata
+            s3.upload_file(url.local, url.bucket, url.path, ExtraArgs=extra)
+            # We indicate that the file was uploaded
+            return 0, os.path.getsize(url.local)
+        return None, 0
 
 
 def start_workers(mode, urls, num_workers):
-    # We start the minimum of len(urls) or num_workers to avoid starting
-    # workers that will definitely do nothing
-    num_workers = min(num_workers, len(urls))
-    queue = Queue(len(urls) + num_workers)
-    procs = {}
-
-    # 1. push sources and destinations to the queue
-    for idx, elt in enumerate(urls):
-        queue.put((elt, idx))
-
-    # 2. push end-of-queue markers
-    for i in range(num_workers):
-        queue.put((None, None))
-
-    # 3. Prepare the result structure
+    # Returns the results of the operations (see _process_url) and the
+    # AdaptiveConcurrency used (for its statistics)
+    concurrency = AdaptiveConcurrency(INITIAL_WORKERS, min(num_workers, len(urls)))
     sz_results = [None] * len(urls)
-
-    # 4. start processes
-    with TempDir() as output_dir:
-        for i in range(num_workers):
-            file_path = os.path.join(output_dir, str(i))
-            p = Process(target=worker, args=(file_path, queue, mode))
-            p.start()
-            procs[p] = file_path
-
-        # 5. wait for the processes to finish; we continuously update procs
-        # to remove all processes that have finished already
-        while procs:
-            new_procs = {}
-            for proc, out_path in procs.items():
-                proc.join(timeout=1)
-                if proc.exitcode is not None:
-                    if proc.exitcode != 0:
-                        msg = "Worker process failed (exit code %d)" % proc.exitcode
-                        exit(msg, proc.exitcode)
-                    # Read the output file if all went well
-                    with open(out_path, "r") as out_file:
-                        for line in out_file:
-                            line_split = line.split(" ")
-                            sz_results[int(line_split[0])] = int(line_split[1])
-                else:
-                    # Put this process back in the processes to check
-                    new_procs[proc] = out_path
-            procs = new_procs
-    return sz_results
+    if not urls:
+        return sz_results, concurrency
+
+    # Each worker uses one connection at a time, except the ones downloading
+    # an object in ranges (which wait for the threads fetching the ranges)
+    s3, client_error = get_shared_s3_client(
+        max_pool_connections=concurrency.maximum
+        + MAX_RANGED_DOWNLOADS * S3_DOWNLOAD_MAX_CONCURRENCY
+    )
+    handler = register_throttling_handler(s3, concurrency)
+    to_process = iter(enumerate(urls))
+    pending = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency.maximum) as executor:
+            try:
+                while True:
+                    # Keep concurrency.target operations in flight
+                    for idx, url in islice(
+                        to_process, max(0, concurrency.target - len(pending))
+                    ):
+                        future = executor.submit(
+                            process_url, s3, client_error, mode, url, concurrency
+                        )
+                        pending[future] = idx
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        sz_results[pending.pop(future)] = future.result()
+            except:
+                for future in pending:
+                    future.cancel()
+                raise
+    except Exception:
+        traceback.print_exc()
+        exit(ERROR_WORKER_EXCEPTION, None)
+    finally:
+        s3.meta.events.unregister("needs-retry.s3", handler)
+    return sz_results, concurrency
 
 
 def process_urls(mode, urls, verbose, num_workers):
@@ -282,20 +410,23 @@ def process_urls(mode, urls, verbose, num_workers):
         print("%sing %d files.." % (mode.capitalize(), len(urls)), file=sys.stderr)
 
     start = time.time()
-    sz_results = start_workers(mode, urls, num_workers)
+    sz_results, concurrency = start_workers(mode, urls, num_workers)
     end = time.time()
 
     if verbose:
-        total_size = sum(sz for sz in sz_results if sz is not None and sz > 0)
-        bw = total_size / (end - start)
+        total_size = concurrency.total_bytes
+        bw = total_size / max(end - start, 1e-3)
         print(
-            "%sed %d files, %s in total, in %d seconds (%s/s)."
+            "%sed %d files, %s in total, in %d seconds (%s/s), "
+            "with up to %d concurrent operations (%d throttled requests)."
             % (
                 mode.capitalize(),
                 len(urls),
                 with_unit(total_size),
                 end - start,
                 with_unit(bw),
+                concurrency.peak,
+                concurrency.num_throttled,
             ),
             file=sys.stderr,
         )
@@ -325,10 +456,13 @@ class S3Ops(object):
         self.client_error = None
 
     def reset_client(self, hard_reset=False):
-        from metaflow.datatools.s3util import get_s3_client
-
-        if hard_reset or self.s3 is None:
-            self.s3, self.client_error = get_s3_client()
+        if hard_reset:
+            # Other threads may still be using the shared client: a new client
+            # is only used by this S3Ops
+            with _shared_client_lock:
+                self.s3, self.client_error = get_s3_client()
+        elif self.s3 is None:
+            self.s3, self.client_error = get_shared_s3_client()
 
     @aws_retry
     def get_info(self, url):
@@ -482,7 +616,7 @@ def generate_local_path(url, suffix=None):
 
 def parallel_op(op, lst, num_workers):
     # parallel op divides work equally amongst num_workers
-    # processes. This is a good strategy if the cost is
+    # threads. This is a good strategy if the cost is
     # uniform over the units of work, e.g. op_get_info, which
     # is a single HEAD request to S3.
     #
@@ -504,9 +638,9 @@ def parallel_op(op, lst, num_workers):
                 batches.append(batch)
             else:
                 break
-        it = parallel_map(op, batches, max_parallel=num)
-        for x in chain.from_iterable(it):
-            yield x
+        with ThreadPoolExecutor(max_workers=num) as executor:
+            for x in chain.from_iterable(executor.map(op, batches)):
+                yield x
 
 
 # CLI
@@ -0,0 +1,546 @@
+"""
+In-process S3 transfer engine
+
+S3TransferEngine performs the batch operations of s3op (list, info, get and
+put) with a pool of threads in the current process. This avoids starting a
+Python interpreter (and importing boto3) for each batch which dominates the
+time taken by small and medium batches. The results are the same as the ones
+s3op prints with --listing and the files are stored in the same way so the S3
+class can use either of them.
+
+Each operation on a URL is retried like the s3op subprocess is: up to
+S3_RETRY_COUNT times with an exponential backoff. Missing objects and denied
+accesses are not retried.
+"""
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from io import BufferedIOBase, RawIOBase
+from itertools import islice
+from tempfile import NamedTemporaryFile
+
+try:
+    # python2
+    from urlparse import urlparse
+except:
+    # python3
+    from urllib.parse import urlparse
+
+from ..exception import MetaflowException
+from ..metaflow_config import (
+    S3_INPROCESS_MAX_WORKERS,
+    S3_RETRY_COUNT,
+    S3_UPLOAD_PART_SIZE,
+)
+from . import s3op
+from .s3util import (
+    download_object,
+    get_s3_client,
+    get_timestamp,
+    iter_chunks,
+    read_in_chunks,
+    upload_in_parts,
+)
+
+
+class MetaflowS3TransferError(Exception):
+    # Raised by an operation on a URL that can't be retried; code is one of
+    # the s3op.ERROR_* codes
+    def __init__(self, code, url, error=None):
+        msg = url if error is None else "Key requested: %s\n%s" % (url, error)
+        super(MetaflowS3TransferError, self).__init__(msg)
+        self.code = code
+        self.url = url
+
+
+class S3ClientPool(object):
+    """
+    Pool of boto3 S3 clients shared by the threads of the transfer engines of
+    this process. Creating a client is expensive (tens of milliseconds) so
+    clients are reused across batches; a client that failed is discarded.
+    """
+
+    def __init__(self, max_size=S3_INPROCESS_MAX_WORKERS):
+        self._max_size = max_size
+        self._clients = []
+        self._lock = threading.Lock()
+        # boto3 clients are thread-safe but creating them is not
+        self._create_lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._clients:
+                return self._clients.pop()
+        with self._create_lock:
+            return get_s3_client()
+
+    def release(self, client):
+        with self._lock:
+            if len(self._clients) < self._max_size:
+                self._clients.append(client)
+
+
+_client_pool = S3ClientPool()
+
+
+class S3TransferEngine(object):
+    """
+    Parameters
+    ----------
+    tmpdir : str
+        Directory where downloaded files (and their metadata) are stored
+    num_workers : int, optional
+        Maximum number of concurrent operations
+    client_pool : S3ClientPool, optional
+        Pool of clients to use, by default the one shared by the process
+    """
+
+    def __init__(self, tmpdir, num_workers=S3_INPROCESS_MAX_WORKERS, client_pool=None):
+        self._tmpdir = tmpdir
+        self._num_workers = num_workers
+        self._client_pool = client_pool or _client_pool
+
+    def read_many(self, op, prefixes_and_ranges, **options):
+        """
+        Equivalent of `s3op <op> --listing` for the given URL prefixes.
+
+        Parameters
+        ----------
+        op : str
+            One of "list", "info" or "get"
+        prefixes_and_ranges : List[Tuple[str, str]]
+            URLs and optional ranges (for get)
+        options : Dict
+            Options of the s3op command; "recursive", "allow_missing" and
+            "info" are supported.
+
+        Returns
+        -------
+        List[Tuple[str, str, str]]
+            Same as the lines printed by s3op: (prefix, url, size) for list,
+            (prefix, url, local file) for info and get.
+        """
+        urls = [self._make_url(prefix, r) for prefix, r in prefixes_and_ranges]
+        if op == "list":
+            return self._list(urls, options.get("recursive", False))
+        elif op == "info":
+            return self._info(urls)
+        elif op == "get":
+            return self._get(
+                urls,
+                options.get("recursive", False),
+                options.get("allow_missing", False),
+                options.get("info", True),
+            )
+        raise ValueError("Unknown S3 operation: %s" % op)
+
+    def put_many(self, url_dicts, overwrite=True):
+        """
+        Equivalent of `s3op put --listing`.
+
+        Parameters
+        ----------
+        url_dicts : List[Dict]
+            Files to upload as given to s3op in --filelist: "local", "url" and
+            optionally "content_type" and "metadata".
+        overwrite : bool, optional
+            If False, objects that already exist are not uploaded
+
+        Returns
+        -------
+        List[str]
+            URLs uploaded
+        """
+        urls = []
+        for d in url_dicts:
+            url = self._make_url(d["url"], None)
+            url.local = d["local"]
+            url.content_type = d.get("content_type")
+            url.metadata = d.get("metadata")
+            if not url.path:
+                raise MetaflowS3TransferError(s3op.ERROR_NOT_FULL_PATH, url.url)
+            if not os.path.exists(url.local):
+                raise MetaflowS3TransferError(
+                    s3op.ERROR_LOCAL_FILE_NOT_FOUND, url.local
+                )
+            urls.append(url)
+
+        return [
+            url
+            for url in self._map(lambda url: self._put_one(url, overwrite), urls)
+            if url is not None
+        ]
+
+    def put_objects(self, objects, overwrite=True):
+        """
+        Upload objects directly from memory or from streams.
+
+        The iterator is consumed as the uploads progress: at most twice as
+        many objects as there are workers are pending at any given time.
+
+        Parameters
+        ----------
+        objects : Iterator[Dict]
+            Objects to upload: "obj", "url" and optionally "content_type" and
+            "metadata". "obj" is a seekable file object (uploaded with
+            retries) or a stream (memoryview, non-seekable file object or
+            iterator of bytes) uploaded in parts with upload_in_parts.
+        overwrite : bool, optional
+            If False, objects that already exist are not uploaded
+
+        Returns
+        -------
+        List[str]
+            URLs uploaded
+        """
+        results = []
+        with ThreadPoolExecutor(max_workers=self._num_workers) as executor:
+            pending = deque()
+            for d in objects:
+                url = self._make_url(d["url"], None)
+                url.obj = d["obj"]
+                url.content_type = d.get("content_type")
+                url.metadata = d.get("metadata")
+                if not url.path:
+                    raise MetaflowS3TransferError(s3op.ERROR_NOT_FULL_PATH, url.url)
+                if len(pending) >= 2 * self._num_workers:
+                    results.append(pending.popleft().result())
+                pending.append(executor.submit(self._put_one, url, overwrite))
+            results.extend(future.result() for future in pending)
+        return [url for url in results if url is not None]
+
+    def _put_one(self, url, overwrite):
+        if not overwrite:
+            try:
+                self._with_retries(self._op_head, url)
+                return None
+            except MetaflowS3TransferError as ex:
+                if ex.code != s3op.ERROR_URL_NOT_FOUND:
+                    raise
+        if url.local is None and not _is_seekable(url.obj):
+            # Streams can't be rewound to retry the upload as a whole;
+            # upload_in_parts retries each of its requests instead.
+            self._with_retries(self._op_upload_stream, url, retry=False)
+        else:
+            self._with_retries(self._op_upload, url)
+        return url.url
+
+    def _make_url(self, prefix, r):
+        src = urlparse(prefix)
+        if src.scheme != "s3":
+            raise MetaflowS3TransferError(s3op.ERROR_INVALID_URL, prefix)
+        return s3op.S3Url(
+            url=prefix,
+            bucket=src.netloc,
+            path=src.path.lstrip("/"),
+            local=None,
+            prefix=prefix,
+            range=r,
+        )
+
+    def _list(self, urls, recursive):
+        delimiter = "" if recursive else "/"
+        results = []
+        for listing in self._map(
+            lambda url: self._with_retries(self._op_list, url, delimiter), urls
+        ):
+            for url, size in listing:
+                results.append((url.prefix, url.url, "" if size is None else str(size)))
+        return results
+
+    def _info(self, urls):
+        def _head(url):
+            url.local = s3op.generate_local_path(url.url, suffix="info")
+            try:
+                info = self._with_retries(self._op_head, url)
+                info["error"] = None
+            except MetaflowS3TransferError as ex:
+                if ex.code not in (
+                    s3op.ERROR_URL_NOT_FOUND,
+                    s3op.ERROR_URL_ACCESS_DENIED,
+                ):
+                    raise
+                info = {"error": ex.code}
+            with open(os.path.join(self._tmpdir, url.local), "w") as f:
+                json.dump(info, f)
+            return url.prefix, url.url, url.local
+
+        return self._map(_head, urls)
+
+    def iter_get(
+        self,
+        prefixes_and_ranges,
+        recursive=False,
+        allow_missing=False,
+        info=True,
+        max_spooled=None,
+    ):
+        """
+        Equivalent of `s3op get --listing` which yields the result of each
+        download as soon as it completes (and not in the order requested).
+
+        Parameters
+        ----------
+        prefixes_and_ranges : List[Tuple[str, str]]
+            URLs and optional ranges
+        recursive : bool, optional
+            If True, download all the objects under the given prefixes
+        allow_missing : bool, optional
+            If True, missing objects are reported instead of raising an error
+        info : bool, optional
+            If True, store the metadata of the objects
+        max_spooled : int, optional
+            If set, at most this many objects are downloaded ahead of the
+            consumer: the download of the next object only starts when a
+            result is consumed. The consumer can therefore bound the disk
+            space used by removing the files it is done with.
+
+        Yields
+        ------
+        Tuple[str, str, str]
+            (prefix, url, local file) for each object downloaded and
+            (url, "", "") for each missing one.
+        """
+        urls = [self._make_url(prefix, r) for prefix, r in prefixes_and_ranges]
+        to_load = self._get_targets(urls, recursive, allow_missing)
+        # without a spool limit, all the downloads are started right away
+        max_pending = max_spooled or max(1, len(to_load))
+        to_load = iter(to_load)
+        with ThreadPoolExecutor(
+            max_workers=min(max_pending, self._num_workers)
+        ) as executor:
+            pending = set()
+            try:
+                while True:
+                    for item in islice(to_load, max_pending - len(pending)):
+                        pending.add(
+                            executor.submit(
+                                self._download_one, item, allow_missing, info
+                            )
+                        )
+                    if not pending:
+                        break
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            finally:
+                # the consumer stopped early or a download failed
+                for future in pending:
+                    future.cancel()
+
+    def _get(self, urls, recursive, allow_missing, info):
+        return self._map(
+            lambda item: self._download_one(item, allow_missing, info),
+            self._get_targets(urls, recursive, allow_missing),
+        )
+
+    def _get_targets(self, urls, recursive, allow_missing):
+        # Returns a list of (url, exists) for the objects to download
+        if recursive:
+            to_load = []
+            for prefix_url, listing in zip(
+                urls,
+                self._map(lambda url: self._list_or_missing(url, allow_missing), urls),
+            ):
+                if listing is None:
+                    to_load.append((prefix_url, False))
+                for url, _ in listing or []:
+                    url.local = s3op.generate_local_path(url.url)
+                    to_load.append((url, True))
+            return to_load
+        if not all(url.path for url in urls):
+            raise MetaflowS3TransferError(
+                s3op.ERROR_NOT_FULL_PATH,
+                next(url.url for url in urls if not url.path),
+            )
+        for url in urls:
+            url.local = s3op.generate_local_path(url.url)
+        return [(url, True) for url in urls]
+
+    def _download_one(self, item, allow_missing, info):
+        url, exists = item
+        if exists:
+            try:
+                self._with_retries(self._op_download, url, info)
+                return url.prefix, url.url, url.local
+            except MetaflowS3TransferError as ex:
+                if not (allow_missing and ex.code == s3op.ERROR_URL_NOT_FOUND):
+                    raise
+        # missing entries are reported as the URL only
+        return url.url, "", ""
+
+    def _list_or_missing(self, url, allow_missing):
+        try:
+            return self._with_retries(self._op_list, url, "")
+        except MetaflowS3TransferError as ex:
+            if allow_missing and ex.code == s3op.ERROR_URL_NOT_FOUND:
+                return None
+            raise
+
+    def _map(self, func, items):
+        items = list(items)
+        if len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(
+            max_workers=min(len(items), self._num_workers)
+        ) as executor:
+            return list(executor.map(func, items))
+
+    def _with_retries(self, op, url, *args, **kwargs):
+        # With retry=False, the operation is tried once (but its errors are
+        # still mapped and its client discarded on failure)
+        num_retries = S3_RETRY_COUNT if kwargs.get("retry", True) else 0
+        error = None
+        for i in range(num_retries + 1):
+            client, client_error = self._client_pool.acquire()
+            try:
+                result = op(client, url, *args)
+            except client_error as err:
+                error_code = s3op.normalize_client_error(err)
+                if error_code in (404, "NoSuchBucket"):
+                    self._client_pool.release((client, client_error))
+                    raise MetaflowS3TransferError(s3op.ERROR_URL_NOT_FOUND, url.url)
+                elif error_code == 403:
+                    self._client_pool.release((client, client_error))
+                    raise MetaflowS3TransferError(s3op.ERROR_URL_ACCESS_DENIED, url.url)
+                error = err
+            except (MetaflowS3TransferError, MetaflowException):
+                # MetaflowExceptions are not related to S3, don't retry
+                self._client_pool.release((client, client_error))
+                raise
+            except Exception as ex:
+                # TODO specific error message for out of disk space
+                error = ex
+            else:
+                self._client_pool.release((client, client_error))
+                return result
+            if i < num_retries:
+                # add some jitter to make sure retries are not synchronized
+                time.sleep(2 ** i + random.randint(0, 10))
+        raise MetaflowS3TransferError(s3op.ERROR_WORKER_EXCEPTION, url.url, error)
+
+    # Operations on one URL with a given client. Client errors are handled by
+    # _with_retries.
+
+    @staticmethod
+    def _op_head(client, url):
+        head = client.head_object(Bucket=url.bucket, Key=url.path)
+        return {
+            "size": head["ContentLength"],
+            "content_type": head["ContentType"],
+            "metadata": head["Metadata"],
+            "last_modified": get_timestamp(head["LastModified"]),
+        }
+
+    @staticmethod
+    def _op_list(client, url, delimiter):
+        url_base = "s3://%s/" % url.bucket
+        urls = []
+        paginator = client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(
+            Bucket=url.bucket, Prefix=url.path, Delimiter=delimiter
+        ):
+            # note that an url may be both a prefix and an object
+            # - the trailing slash is significant in S3
+            for key in page.get("Contents", []):
+                urls.append(
+                    (
+                        s3op.S3Url(
+                            url=url_base + key["Key"],
+                            bucket=url.bucket,
+                            path=key["Key"],
+                            local=None,
+                            prefix=url.url,
+                        ),
+                        key["Size"],
+                    )
+                )
+            # we get CommonPrefixes if Delimiter is a non-empty string
+            for key in page.get("CommonPrefixes", []):
+                urls.append(
+                    (
+                        s3op.S3Url(
+                            url=url_base + key["Prefix"],
+                            bucket=url.bucket,
+                            path=key["Prefix"],
+                            local=None,
+                            prefix=url.url,
+                        ),
+                        None,
+                    )
+                )
+        return urls
+
+    def _op_download(self, client, url, info):
+        local = os.path.join(self._tmpdir, url.local)
+        tmp = NamedTemporaryFile(dir=self._tmpdir, mode="wb", delete=False)
+        try:
+            if url.range:
+                resp = client.get_object(
+                    Bucket=url.bucket, Key=url.path, Range=url.range
+                )
+                read_in_chunks(
+                    tmp, resp["Body"], resp["ContentLength"], s3op.DOWNLOAD_MAX_CHUNK
+                )
+                tmp.close()
+            else:
+                # Large objects are downloaded in ranges, concurrently
+                tmp.close()
+                resp = download_object(client, url.bucket, url.path, tmp.name)
+            sz = resp["ContentLength"]
+            if os.stat(tmp.name).st_size != sz:
+                raise MetaflowS3TransferError(s3op.ERROR_VERIFY_FAILED, url.url)
+            os.rename(tmp.name, local)
+        except:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+        if info:
+            args = {"size": sz}
+            if resp["ContentType"]:
+                args["content_type"] = resp["ContentType"]
+            if resp["Metadata"] is not None:
+                args["metadata"] = resp["Metadata"]
+            if resp["LastModified"]:
+                args["last_modified"] = get_timestamp(resp["LastModified"])
+            with open("%s_meta" % local, mode="w") as f:
+                json.dump(args, f)
+
+    @staticmethod
+    def _op_upload(client, url):
+        extra = _extra_args(url)
+        if url.local is not None:
+            client.upload_file(url.local, url.bucket, url.path, ExtraArgs=extra)
+        else:
+            # We make sure we are at the beginning in case we are retrying
+            url.obj.seek(0)
+            client.upload_fileobj(url.obj, url.bucket, url.path, ExtraArgs=extra)
+
+    @staticmethod
+    def _op_upload_stream(client, url):
+        upload_in_parts(
+            client,
+            url.bucket,
+            url.path,
+            iter_chunks(url.obj, S3_UPLOAD_PART_SIZE),
+            extra_args=_extra_args(url),
+        )
+
+
+def _extra_args(url):
+    extra = None
+    if url.content_type or url.metadata:
+        extra = {}
+        if url.content_type:
+            extra["ContentType"] = url.content_type
+        if url.metadata is not None:
+            extra["Metadata"] = url.metadata
+    return extra
+
+
+def _is_seekable(obj):
+    return isinstance(obj, (RawIOBase, BufferedIOBase)) and obj.seekable()
@@ -1,29 +1,52 @@
 from __future__ import print_function
 from datetime import datetime
 import random
+import threading
 import time
 import sys
 import os
 
 from metaflow.exception import MetaflowException
 from metaflow.metaflow_config import (
+    S3_DOWNLOAD_CHUNK_SIZE,
+    S3_DOWNLOAD_MAX_CONCURRENCY,
     S3_ENDPOINT_URL,
     S3_VERIFY_CERTIFICATE,
     S3_RETRY_COUNT,
+    S3_UPLOAD_MAX_CONCURRENCY,
+    S3_UPLOAD_MAX_MEMORY,
+    S3_UPLOAD_PART_SIZE,
 )
 
 
 TEST_S3_RETRY = "TEST_S3_RETRY" in os.environ
 
 
-def get_s3_client():
+# Size of the reads of the body of a ranged download
+RANGE_READ_SIZE = 1024 * 1024
+
+# Maximum number of parts of a multipart upload allowed by S3
+MAX_UPLOAD_PARTS = 10000
+
+
+def get_s3_client(max_pool_connections=0):
     from metaflow.plugins.aws.aws_client import get_aws_client
 
-    return get_aws_client(
-        "s3",
-        with_error=True,
-        params={"endpoint_url": S3_ENDPOINT_URL, "verify": S3_VERIFY_CERTIFICATE},
-    )
+    params = {"endpoint_url": S3_ENDPOINT_URL, "verify": S3_VERIFY_CERTIFICATE}
+    try:
+        from botocore.config import Config
+
+        # download_in_ranges uses up to S3_DOWNLOAD_MAX_CONCURRENCY connections
+        # of the client at once (boto3 keeps 10 of them by default); clients
+        # shared by many threads need more
+        params["config"] = Config(
+            max_pool_connections=max(
+                10, S3_DOWNLOAD_MAX_CONCURRENCY, max_pool_connections
+            )
+        )
+    except ImportError:
+        pass
+    return get_aws_client("s3", with_error=True, params=params)
 
 
 # decorator to retry functions that access S3
@@ -81,6 +104,320 @@ def read_in_chunks(dst, src, src_sz, max_chunk_size):
         remaining -= len(buf)
 
 
+def download_object(
+    client,
+    bucket,
+    key,
+    dst,
+    chunk_size=S3_DOWNLOAD_CHUNK_SIZE,
+    max_concurrency=S3_DOWNLOAD_MAX_CONCURRENCY,
+    range_slots=None,
+):
+    """
+    Download the object `key` to the file `dst`.
+
+    The first `chunk_size` bytes are fetched with a range request which also
+    tells the size of the object; the rest of the object, if any, is then
+    downloaded with download_in_ranges. If `range_slots` (a semaphore) is
+    given, it is held while the rest of the object is downloaded.
+
+    Returns the response of the first request, with the size of the whole
+    object as ContentLength (and without Body).
+    """
+    try:
+        resp = client.get_object(
+            Bucket=bucket, Key=key, Range="bytes=0-%d" % (chunk_size - 1)
+        )
+    except Exception as ex:
+        # S3 does not satisfy range requests on empty objects
+        if _error_code(ex) not in ("416", "InvalidRange"):
+            raise
+        resp = client.get_object(Bucket=bucket, Key=key)
+    body = resp.pop("Body")
+    length = resp["ContentLength"]
+    size = length
+    if resp.get("ContentRange"):
+        # ContentRange is "bytes <start>-<end>/<size>"
+        size = int(resp["ContentRange"].rsplit("/", 1)[1])
+    with open(dst, "wb") as f:
+        read_in_chunks(f, body, length, RANGE_READ_SIZE)
+    if size > length:
+        if range_slots is not None:
+            range_slots.acquire()
+        try:
+            download_in_ranges(
+                client,
+                bucket,
+                key,
+                size,
+                dst,
+                etag=resp.get("ETag"),
+                chunk_size=chunk_size,
+                max_concurrency=max_concurrency,
+                start=length,
+            )
+        finally:
+            if range_slots is not None:
+                range_slots.release()
+    resp["ContentLength"] = size
+    return resp
+
+
+def download_in_ranges(
+    client,
+    bucket,
+    key,
+    size,
+    dst,
+    etag=None,
+    chunk_size=S3_DOWNLOAD_CHUNK_SIZE,
+    max_concurrency=S3_DOWNLOAD_MAX_CONCURRENCY,
+    start=0,
+):
+    """
+    Download the object `key` of `size` bytes to the file `dst` by fetching
+    ranges of `chunk_size` bytes, up to `max_concurrency` of them at once.
+    The file is preallocated and each range is written at its offset. If
+    `start` is given, the file already holds the first `start` bytes of the
+    object and only the rest is downloaded. If `etag` is given, the download
+    fails if the object is modified while it is downloaded.
+
+    Each range is retried (up to S3_RETRY_COUNT times) independently of the
+    others; missing objects and denied accesses are not retried.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    with open(dst, "r+b" if start else "wb") as f:
+        f.truncate(size)
+    ranges = [
+        (offset, min(offset + chunk_size, size))
+        for offset in range(start, size, chunk_size)
+    ]
+    extra = {"IfMatch": etag} if etag else {}
+
+    def _download_range(r):
+        start, end = r
+        resp = client.get_object(
+            Bucket=bucket, Key=key, Range="bytes=%d-%d" % (start, end - 1), **extra
+        )
+        with open(dst, "r+b") as f:
+            f.seek(start)
+            read_in_chunks(f, resp["Body"], end - start, RANGE_READ_SIZE)
+            if f.tell() != end:
+                raise Exception(
+                    "Got %d bytes instead of %d" % (f.tell() - start, end - start)
+                )
+
+    def _download_range_with_retries(r):
+        _retry_request(
+            _download_range, r, "Download of %s (bytes %d-%d)" % (key, r[0], r[1] - 1)
+        )
+
+    if len(ranges) <= 1:
+        for r in ranges:
+            _download_range_with_retries(r)
+        return
+    with ThreadPoolExecutor(max_workers=min(len(ranges), max_concurrency)) as executor:
+        # list() re-raises the first error, if any
+        list(executor.map(_download_range_with_retries, ranges))
+
+
+def upload_in_parts(
+    client,
+    bucket,
+    key,
+    chunks,
+    extra_args=None,
+    part_size=S3_UPLOAD_PART_SIZE,
+    max_concurrency=S3_UPLOAD_MAX_CONCURRENCY,
+    max_memory=S3_UPLOAD_MAX_MEMORY,
+):
+    """
+    Upload the data produced by the iterator `chunks` (of bytes-like objects)
+    to the object `key` without staging it to disk.
+
+    The data is split in parts of `part_size` bytes which are uploaded (as a
+    multipart upload) up to `max_concurrency` at once while the next parts
+    are produced. At most `max_memory` bytes of parts are held in memory: the
+    iterator is not consumed further until the upload of a part completes.
+    Data that fits in a single part is uploaded with a single request.
+
+    Each request is retried (up to S3_RETRY_COUNT times) independently of the
+    others; the multipart upload is aborted if one of them fails or if the
+    data does not fit in MAX_UPLOAD_PARTS parts.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    extra_args = extra_args or {}
+    # The first two parts are needed to decide whether to use a multipart upload
+    max_parts = max(2, max_memory // part_size)
+    # One slot per part held in memory (being produced or uploaded)
+    slots = threading.Semaphore(max_parts)
+    parts = _iter_parts(chunks, part_size)
+
+    def _next_part():
+        slots.acquire()
+        data = next(parts, None)
+        if data is None:
+            slots.release()
+        return data
+
+    first = _next_part()
+    second = _next_part() if first is not None else None
+    if second is None:
+        try:
+            _retry_request(
+                lambda data: client.put_object(
+                    Bucket=bucket, Key=key, Body=data, **extra_args
+                ),
+                first or b"",
+                "Upload of %s" % key,
+            )
+        finally:
+            if first is not None:
+                slots.release()
+        return
+
+    upload_id = _retry_request(
+        lambda _: client.create_multipart_upload(Bucket=bucket, Key=key, **extra_args),
+        None,
+        "Upload of %s" % key,
+    )["UploadId"]
+    failed = []
+
+    def _upload_part(number, data):
+        try:
+            resp = _retry_request(
+                lambda data: client.upload_part(
+                    Bucket=bucket,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumber=number,
+                    Body=data,
+                ),
+                data,
+                "Upload of %s (part %d)" % (key, number),
+            )
+            return {"ETag": resp["ETag"], "PartNumber": number}
+        except:
+            failed.append(number)
+            raise
+        finally:
+            slots.release()
+
+    try:
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(max_concurrency, max_parts))
+        ) as executor:
+            futures = [
+                executor.submit(_upload_part, 1, first),
+                executor.submit(_upload_part, 2, second),
+            ]
+            first = second = None
+            # stop producing parts as soon as one of them could not be uploaded
+            while not failed:
+                data = _next_part()
+                if data is None:
+                    break
+                if len(futures) == MAX_UPLOAD_PARTS:
+                    slots.release()
+                    raise MetaflowException(
+                        "Upload of %s failed: the object is larger than "
+                        "%d parts of %d bytes. Increase METAFLOW_S3_UPLOAD_PART_SIZE "
+                        "to upload it." % (key, MAX_UPLOAD_PARTS, part_size)
+                    )
+                futures.append(executor.submit(_upload_part, len(futures) + 1, data))
+            uploaded = [f.result() for f in futures]
+        _retry_request(
+            lambda _: client.complete_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": uploaded},
+            ),
+            None,
+            "Upload of %s" % key,
+        )
+    except:
+        try:
+            client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        except Exception:
+            # the parts uploaded are eventually removed by the lifecycle
+            # policy of the bucket, if any
+            pass
+        raise
+
+
+def iter_chunks(obj, chunk_size):
+    """
+    Iterate over the data of `obj` (a memoryview, a bytearray, a file object
+    or an iterator of bytes-like objects) in chunks of at most `chunk_size`
+    bytes (iterators are passed through as is).
+    """
+    if isinstance(obj, (memoryview, bytearray)):
+        view = memoryview(obj).cast("B")
+        return (view[i : i + chunk_size] for i in range(0, len(view), chunk_size))
+    if hasattr(obj, "read"):
+        return _read_chunks(obj, chunk_size)
+    return iter(obj)
+
+
+def _read_chunks(f, chunk_size):
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            break
+        yield data
+
+
+def _iter_parts(chunks, part_size):
+    # Regroup the chunks in parts of part_size bytes (the last one may be
+    # smaller)
+    buf = bytearray()
+    for chunk in chunks:
+        buf += chunk
+        while len(buf) >= part_size:
+            yield bytes(buf[:part_size])
+            del buf[:part_size]
+    if buf:
+        yield bytes(buf)
+
+
+def _retry_request(func, arg, description):
+    for i in range(S3_RETRY_COUNT + 1):
+        try:
+            return func(arg)
+        except Exception as ex:
+            if i == S3_RETRY_COUNT or _is_permanent_error(ex):
+                raise
+            sys.stderr.write(
+                "%s failed (%s). Retrying %d more times..\n"
+                % (description, ex, S3_RETRY_COUNT - i)
+            )
+            time.sleep(2 ** i + random.randint(0, 5))
+
+
+def _error_code(ex):
+    response = getattr(ex, "response", None)
+    if not isinstance(response, dict):
+        return None
+    return response.get("Error", {}).get("Code")
+
+
+def _is_permanent_error(ex):
+    # Client errors for which retrying a request is pointless
+    return _error_code(ex) in (
+        "403",
+        "404",
+        "412",
+        "AccessDenied",
+        "AllAccessDisabled",
+        "NoSuchBucket",
+        "NoSuchKey",
+        "PreconditionFailed",
+    )
+
+
 def get_timestamp(dt):
     """
     Python2 compatible way to compute the timestamp (seconds since 1/1/1970)
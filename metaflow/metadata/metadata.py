@@ -155,6 +155,36 @@ class MetadataProvider(object):
         """
         raise NotImplementedError()
 
+    def new_task_ids(self, run_id, step_name, num_tasks, tags=None, sys_tags=None):
+        """
+        Creates `num_tasks` IDs and registers these new tasks.
+
+        This is equivalent to calling new_task_id `num_tasks` times; providers
+        can implement it more efficiently.
+
+        Parameters
+        ----------
+        run_id : int
+            ID of the run
+        step_name : string
+            Name of the step
+        num_tasks : int
+            Number of tasks to create
+        tags : list, optional
+            Tags to apply to these tasks, by default None
+        sys_tags : list, optional
+            System tags to apply to these tasks, by default None
+
+        Returns
+        -------
+        List[int]
+            Task IDs for the tasks
+        """
+        return [
+            self.new_task_id(run_id, step_name, tags=tags, sys_tags=sys_tags)
+            for _ in range(num_tasks)
+        ]
+
     def register_task_id(
         self, run_id, step_name, task_id, attempt=0, tags=None, sys_tags=None
     ):
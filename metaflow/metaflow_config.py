@@ -52,6 +52,21 @@ DEFAULT_PACKAGE_SUFFIXES = from_conf("METAFLOW_DEFAULT_PACKAGE_SUFFIXES", ".py,.
 DEFAULT_AWS_CLIENT_PROVIDER = from_conf("METAFLOW_DEFAULT_AWS_CLIENT_PROVIDER", "boto3")
 
 
+###
+# Local runtime configuration
+###
+# Number of CPUs and memory (in MB) available to the tasks executed locally
+# that request resources with @resources. By default, all the CPUs and the
+# physical memory of the machine.
+RUNTIME_MAX_CPU = from_conf("METAFLOW_RUNTIME_MAX_CPU")
+RUNTIME_MAX_MEMORY = from_conf("METAFLOW_RUNTIME_MAX_MEMORY")
+# Comma-separated list of modules pre-imported by the zygote (see
+# metaflow.zygote) on top of metaflow itself, for example "numpy,pandas".
+# Only modules that are safe to import before forking (that do not start
+# threads or open connections when imported) should be listed.
+ZYGOTE_PRELOAD_MODULES = from_conf("METAFLOW_ZYGOTE_PRELOAD_MODULES", "")
+
+
 ###
 # Datastore configuration
 ###
@@ -87,6 +102,58 @@ DATASTORE_CARD_S3ROOT = from_conf(
 )
 CARD_NO_WARNING = from_conf("METAFLOW_CARD_NO_WARNING", False)
 
+# Compression codec used for the (non-raw) blobs stored in the content
+# addressed store. One of "gzip", "auto", "zstd", "lz4" or "none". With "auto",
+# the codec is picked for each blob based on its size and compressibility.
+# Blobs compressed with anything but gzip can only be read by versions of
+# Metaflow that support them (and, for zstd and lz4, that have the package
+# installed) so any other value should only be used if all the readers of the
+# datastore (tasks, clients, UI) are known to support it.
+CAS_COMPRESSION_CODEC = from_conf("METAFLOW_CAS_COMPRESSION_CODEC", "gzip")
+
+# Number of threads used to hash and compress artifacts when they are saved
+# at the end of a task. 0 or 1 hashes and compresses artifacts serially.
+ARTIFACT_SAVE_MAX_WORKERS = int(from_conf("METAFLOW_ARTIFACT_SAVE_MAX_WORKERS", 0))
+# Maximum number of bytes of artifacts serialized but not yet saved at any
+# given time when they are saved at the end of a task (a single larger
+# artifact is still saved).
+ARTIFACT_SAVE_MAX_INFLIGHT_BYTES = int(
+    from_conf("METAFLOW_ARTIFACT_SAVE_MAX_INFLIGHT_BYTES", 1024 * 1024 * 1024)
+)
+
+# If set, artifacts are pickled using protocol 5 (Python 3.8+) and each
+# out-of-band buffer (numpy arrays, Arrow tables, etc.) is saved as its own
+# blob. This avoids copying large buffers when persisting and loading artifacts
+# but these artifacts can only be read by Python 3.8+ and recent versions of
+# Metaflow. Unless they are memory-mapped (see DATASTORE_LOCAL_MMAP), objects
+# reconstructed from such buffers are read-only.
+ARTIFACT_PICKLE_OUT_OF_BAND = bool(
+    from_conf("METAFLOW_ARTIFACT_PICKLE_OUT_OF_BAND", False)
+)
+
+# If set, blobs in the local datastore are stored uncompressed and artifacts
+# are loaded by memory-mapping them. Tasks reading the same artifacts (e.g.
+# foreach siblings) then share the memory of the artifacts through the page
+# cache; this works best with METAFLOW_ARTIFACT_PICKLE_OUT_OF_BAND.
+DATASTORE_LOCAL_MMAP = bool(from_conf("METAFLOW_DATASTORE_LOCAL_MMAP", False))
+
+# Number of threads used to write files to the local datastore when many files
+# are saved at once (artifacts for example). 0 or 1 writes them serially.
+DATASTORE_LOCAL_SAVE_MAX_WORKERS = int(
+    from_conf("METAFLOW_DATASTORE_LOCAL_SAVE_MAX_WORKERS", 8)
+)
+# If set, files written to the local datastore are flushed to disk (fsync)
+# before being made visible. This is slower but guarantees that the data of a
+# task marked as done survives a crash of the machine.
+DATASTORE_LOCAL_FSYNC = bool(from_conf("METAFLOW_DATASTORE_LOCAL_FSYNC", False))
+
+# The attempts of a task are found by listing the content of the task. This
+# requires strongly consistent listings (which AWS S3 and local filesystems
+# provide); set this for storage systems that don't (some S3-compatible
+# endpoints) so that the metadata files of every possible attempt are probed
+# instead.
+DATASTORE_PROBE_ATTEMPTS = bool(from_conf("METAFLOW_DATASTORE_PROBE_ATTEMPTS", False))
+
 # S3 endpoint url
 S3_ENDPOINT_URL = from_conf("METAFLOW_S3_ENDPOINT_URL", None)
 S3_VERIFY_CERTIFICATE = from_conf("METAFLOW_S3_VERIFY_CERTIFICATE", None)
@@ -97,6 +164,37 @@ S3_VERIFY_CERTIFICATE = from_conf("METAFLOW_S3_VERIFY_CERTIFICATE", None)
 # so setting it to 0 means each operation will be tried once.
 S3_RETRY_COUNT = int(from_conf("METAFLOW_S3_RETRY_COUNT", 7))
 
+# Objects larger than S3_DOWNLOAD_CHUNK_SIZE bytes are downloaded in ranges of
+# this size, S3_DOWNLOAD_MAX_CONCURRENCY of them at once, into a preallocated
+# local file.
+S3_DOWNLOAD_CHUNK_SIZE = int(
+    from_conf("METAFLOW_S3_DOWNLOAD_CHUNK_SIZE", 32 * 1024 * 1024)
+)
+S3_DOWNLOAD_MAX_CONCURRENCY = int(from_conf("METAFLOW_S3_DOWNLOAD_MAX_CONCURRENCY", 16))
+
+# Streams (iterators, non-seekable files, memoryviews) are uploaded to S3 in
+# parts of S3_UPLOAD_PART_SIZE bytes (at least 5MB), up to
+# S3_UPLOAD_MAX_CONCURRENCY of them at once; at most S3_UPLOAD_MAX_MEMORY bytes
+# of parts are held in memory per upload.
+S3_UPLOAD_PART_SIZE = max(
+    5 * 1024 * 1024,
+    int(from_conf("METAFLOW_S3_UPLOAD_PART_SIZE", 32 * 1024 * 1024)),
+)
+S3_UPLOAD_MAX_CONCURRENCY = int(from_conf("METAFLOW_S3_UPLOAD_MAX_CONCURRENCY", 8))
+S3_UPLOAD_MAX_MEMORY = int(
+    from_conf("METAFLOW_S3_UPLOAD_MAX_MEMORY", 256 * 1024 * 1024)
+)
+
+# Batch operations of the S3 client (get_many, put_files, info_many, list_*)
+# on at most this many objects are performed by a pool of threads in the
+# current process instead of a s3op subprocess; this avoids the fixed cost
+# (~1s) of starting the subprocess for small and medium batches. put_many
+# always uploads its objects from memory in the current process.
+S3_INPROCESS_MAX_KEYS = int(from_conf("METAFLOW_S3_INPROCESS_MAX_KEYS", 256))
+# Number of threads used for these in-process batches. Each thread uses its own
+# boto3 client taken from a pool shared by the process.
+S3_INPROCESS_MAX_WORKERS = int(from_conf("METAFLOW_S3_INPROCESS_MAX_WORKERS", 32))
+
 ###
 # Datastore local cache
 ###
@@ -121,6 +219,9 @@ CLIENT_CACHE_MAX_TASKDATASTORE_COUNT = int(
 ###
 METADATA_SERVICE_URL = from_conf("METAFLOW_SERVICE_URL")
 METADATA_SERVICE_NUM_RETRIES = int(from_conf("METAFLOW_SERVICE_RETRY_COUNT", 5))
+# Maximum number of concurrent requests made to the service when registering
+# many objects at once (the tasks of a foreach for example)
+METADATA_SERVICE_MAX_WORKERS = int(from_conf("METAFLOW_SERVICE_MAX_WORKERS", 16))
 METADATA_SERVICE_AUTH_KEY = from_conf("METAFLOW_SERVICE_AUTH_KEY")
 METADATA_SERVICE_HEADERS = json.loads(from_conf("METAFLOW_SERVICE_HEADERS", "{}"))
 if METADATA_SERVICE_AUTH_KEY is not None:
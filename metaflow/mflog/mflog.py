@@ -72,6 +72,27 @@ def decorate(source, line, version=VERSION, now=None, lineid=None):
     )
 
 
+def decorate_many(source, lines, version=VERSION, now=None):
+    # Same as decorate() for many lines logged at the same time. The IDs of
+    # the lines sort in the order of the lines so that merge_logs() keeps
+    # them in order.
+    if now is None:
+        now = datetime.utcnow()
+    prefix = b"".join(
+        (
+            b"[MFLOG|",
+            version,
+            b"|",
+            to_bytes(now.strftime(ISOFORMAT)),
+            b"Z|",
+            to_bytes(source),
+            b"|",
+            to_bytes(str(uuid.uuid4())),
+        )
+    )
+    return [b"%s-%08d]%s" % (prefix, i, to_bytes(line)) for i, line in enumerate(lines)]
+
+
 def is_structured(line):
     line = to_bytes(line)
     return line.startswith(b"[MFLOG|") or line.startswith(b"[![MFLOG|")
@@ -97,6 +97,7 @@ from .environment_decorator import EnvironmentDecorator
 from .parallel_decorator import ParallelDecorator
 from .retry_decorator import RetryDecorator
 from .resources_decorator import ResourcesDecorator
+from .prefetch_decorator import PrefetchDecorator
 from .aws.batch.batch_decorator import BatchDecorator
 from .aws.eks.kubernetes_decorator import KubernetesDecorator
 from .aws.step_functions.step_functions_decorator import StepFunctionsInternalDecorator
@@ -114,6 +115,7 @@ STEP_DECORATORS = [
     TimeoutDecorator,
     EnvironmentDecorator,
     ResourcesDecorator,
+    PrefetchDecorator,
     RetryDecorator,
     BatchDecorator,
     CardDecorator,
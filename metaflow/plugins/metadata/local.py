@@ -1,6 +1,7 @@
 import glob
 import json
 import os
+import threading
 import time
 
 from metaflow.metaflow_config import DATASTORE_LOCAL_DIR
@@ -14,6 +15,7 @@ class LocalMetadataProvider(MetadataProvider):
         super(LocalMetadataProvider, self).__init__(
             environment, flow, event_logger, monitor
         )
+        self._task_id_lock = threading.Lock()
 
     @classmethod
     def compute_info(cls, val):
@@ -66,11 +68,26 @@ class LocalMetadataProvider(MetadataProvider):
             return self._new_run(run_id, tags, sys_tags)
 
     def new_task_id(self, run_id, step_name, tags=None, sys_tags=None):
-        self._task_id_seq += 1
-        task_id = str(self._task_id_seq)
+        [task_id] = self._reserve_task_ids(1)
         self._new_task(run_id, step_name, task_id, tags, sys_tags)
         return task_id
 
+    def new_task_ids(self, run_id, step_name, num_tasks, tags=None, sys_tags=None):
+        task_ids = self._reserve_task_ids(num_tasks)
+        if task_ids:
+            self._ensure_meta("step", run_id, step_name, None)
+        for task_id in task_ids:
+            self._ensure_meta("task", run_id, step_name, task_id, tags, sys_tags)
+            self._register_code_package_metadata(run_id, step_name, task_id, 0)
+        return task_ids
+
+    def _reserve_task_ids(self, num_tasks):
+        # Tasks may be created from several threads (see async_runtime.py)
+        with self._task_id_lock:
+            first = self._task_id_seq + 1
+            self._task_id_seq += num_tasks
+        return [str(first + i) for i in range(num_tasks)]
+
     def register_task_id(
         self, run_id, step_name, task_id, attempt=0, tags=None, sys_tags=None
     ):
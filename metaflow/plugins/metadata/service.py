@@ -2,12 +2,14 @@ import os
 import requests
 import time
 
+from concurrent.futures import ThreadPoolExecutor
 from distutils.version import LooseVersion
 
 from metaflow.exception import MetaflowException
 from metaflow.metaflow_config import (
     METADATA_SERVICE_NUM_RETRIES,
     METADATA_SERVICE_HEADERS,
+    METADATA_SERVICE_MAX_WORKERS,
     METADATA_SERVICE_URL,
 )
 from metaflow.metadata import MetadataProvider
@@ -82,6 +84,27 @@ class ServiceMetadataProvider(MetadataProvider):
     def new_task_id(self, run_id, step_name, tags=None, sys_tags=None):
         return self._new_task(run_id, step_name, tags=tags, sys_tags=sys_tags)
 
+    def new_task_ids(self, run_id, step_name, num_tasks, tags=None, sys_tags=None):
+        if num_tasks <= 0:
+            return []
+        # The service creates tasks one at a time so we only make sure the
+        # step exists once and create the tasks concurrently.
+        self._get_or_create("step", run_id, step_name)
+
+        def _create_task(_):
+            task = self._get_or_create(
+                "task", run_id, step_name, tags=tags, sys_tags=sys_tags
+            )
+            self._register_code_package_metadata(run_id, step_name, task["task_id"], 0)
+            return task["task_id"]
+
+        if num_tasks == 1:
+            return [_create_task(0)]
+        with ThreadPoolExecutor(
+            max_workers=min(num_tasks, METADATA_SERVICE_MAX_WORKERS)
+        ) as executor:
+            return list(executor.map(_create_task, range(num_tasks)))
+
     def register_task_id(
         self, run_id, step_name, task_id, attempt=0, tags=None, sys_tags=None
     ):
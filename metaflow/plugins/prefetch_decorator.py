@@ -0,0 +1,42 @@
+from metaflow.decorators import StepDecorator
+from metaflow.exception import MetaflowException
+from metaflow.util import is_stringish
+
+
+class PrefetchDecorator(StepDecorator):
+    """
+    Step decorator to specify the artifacts a join step reads from its inputs.
+
+    The artifacts listed are fetched for all the inputs of the join, in bulk,
+    before the step starts instead of one input at a time when they are first
+    accessed. This considerably speeds up joins with many inputs, for example
+    at the end of a wide foreach.
+
+    To use, annotate your join step as follows:
+    ```
+    @prefetch(artifacts=["score"])
+    @step
+    def join(self, inputs):
+        self.best = max(inp.score for inp in inputs)
+    ```
+
+    Parameters
+    ----------
+    artifacts : List[str]
+        Names of the artifacts to prefetch from all the inputs. When specified
+        on the command line, use a comma-separated list.
+    """
+
+    name = "prefetch"
+    defaults = {"artifacts": []}
+
+    def step_init(self, flow, graph, step, decos, environment, flow_datastore, logger):
+        if graph[step].type != "join":
+            raise MetaflowException(
+                "@prefetch can only be used on join steps and step *%s* is not "
+                "a join." % step
+            )
+        artifacts = self.attributes["artifacts"]
+        if is_stringish(artifacts):
+            artifacts = [a.strip() for a in artifacts.split(",") if a.strip()]
+        self.attributes["artifacts"] = list(artifacts)
@@ -9,7 +9,10 @@ class ResourcesDecorator(StepDecorator):
     (AWS Batch, Kubernetes, etc.) when requesting resources to execute this
     step.
 
-    This decorator is ignored if the execution of the step happens locally.
+    When the step executes locally, the runtime only launches its tasks when
+    the CPUs and memory requested are available on the machine (see
+    METAFLOW_RUNTIME_MAX_CPU and METAFLOW_RUNTIME_MAX_MEMORY); `gpu` and
+    `shared_memory` are ignored.
 
     To use, annotate your step as follows:
     ```
@@ -0,0 +1,278 @@
+"""
+Run queue of the NativeRuntime
+
+The run queue holds the tasks that are ready to be launched. The order in
+which they are launched is determined by a scheduling policy which assigns a
+priority to each step of the flow; tasks of a same step are always launched in
+the order in which they were queued.
+
+A ResourcePool keeps track of the resources (CPUs and memory) used by the
+tasks running locally so that the runtime only launches the tasks that fit.
+"""
+from collections import deque
+from heapq import heappop, heappush
+
+from .exception import MetaflowException
+
+
+class SchedulingPolicy(object):
+    """
+    Base class for scheduling policies.
+
+    A policy maps each step of the flow to a priority; tasks of steps with a
+    lower priority are launched first. Tasks with the same priority are
+    launched in the order in which they were queued.
+    """
+
+    name = None
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def priority(self, step):
+        raise NotImplementedError
+
+
+class FifoPolicy(SchedulingPolicy):
+    """
+    Launch tasks in the order in which they become ready.
+    """
+
+    name = "fifo"
+
+    def priority(self, step):
+        return 0
+
+
+class CriticalPathPolicy(SchedulingPolicy):
+    """
+    Launch first the tasks of the steps with the longest path (in number of
+    steps) to the end of the flow.
+    """
+
+    name = "critical-path"
+
+    def __init__(self, graph):
+        super(CriticalPathPolicy, self).__init__(graph)
+        self._lengths = {}
+        for node in graph:
+            self._length(node.name, set())
+
+    def _length(self, step, visiting):
+        if step in self._lengths:
+            return self._lengths[step]
+        # graph may contain loops and unknown transitions - ignore them
+        visiting.add(step)
+        length = 1 + max(
+            [
+                self._length(n, visiting)
+                for n in self.graph[step].out_funcs
+                if n in self.graph and n not in visiting
+            ]
+            or [0]
+        )
+        visiting.discard(step)
+        self._lengths[step] = length
+        return length
+
+    def priority(self, step):
+        return -self._lengths.get(step, 0)
+
+
+class DepthFirstPolicy(SchedulingPolicy):
+    """
+    Launch first the tasks of the steps furthest from the start of the flow.
+
+    This completes the branches of a foreach before launching the remaining
+    splits so that their results (and the join) become available early.
+    """
+
+    name = "depth-first"
+
+    def __init__(self, graph):
+        super(DepthFirstPolicy, self).__init__(graph)
+        self._depths = {}
+        if "start" in graph:
+            self._depths["start"] = 0
+            to_visit = deque(["start"])
+            while to_visit:
+                step = to_visit.popleft()
+                for n in graph[step].out_funcs:
+                    # graph may contain loops - only keep the first depth
+                    if n in graph and n not in self._depths:
+                        self._depths[n] = self._depths[step] + 1
+                        to_visit.append(n)
+
+    def priority(self, step):
+        return -self._depths.get(step, 0)
+
+
+SCHEDULING_POLICIES = {
+    p.name: p for p in (FifoPolicy, CriticalPathPolicy, DepthFirstPolicy)
+}
+
+
+class RunQueue(object):
+    """
+    Queue of tasks ready to be launched, ordered by a scheduling policy.
+
+    Tasks are queued per step; a heap keeps the first task of each step
+    ordered by priority. Pushing and popping a task is O(log(num_steps))
+    regardless of the number of tasks queued. Many tasks (the splits of a
+    foreach for example) can be queued at once with `extend` in which case
+    their arguments are only generated when they are popped.
+
+    Parameters
+    ----------
+    graph : FlowGraph
+        Graph of the flow being executed
+    policy : str, optional
+        Name of the scheduling policy (see SCHEDULING_POLICIES), by default
+        "fifo"
+    """
+
+    def __init__(self, graph, policy="fifo"):
+        if policy not in SCHEDULING_POLICIES:
+            raise MetaflowException(
+                "Unknown scheduling policy *%s*. Supported policies are: %s"
+                % (policy, ", ".join(sorted(SCHEDULING_POLICIES)))
+            )
+        self._policy = SCHEDULING_POLICIES[policy](graph)
+        # step -> deque of [seq, task_kwargs, None] for tasks pushed one at a
+        # time and [seq, iterator of task_kwargs, number of tasks left] for
+        # tasks queued with extend
+        self._tasks = {}
+        self._heap = []  # (priority, seq, step) for the first task of each step
+        self._num_queued = {}
+        self._seq = 0
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    __nonzero__ = __bool__
+
+    def push(self, step, task_kwargs):
+        self._append(step, [self._seq, task_kwargs, None], 1)
+
+    def extend(self, step, tasks_kwargs, num_tasks):
+        """
+        Queue `num_tasks` tasks of `step` at once.
+
+        Parameters
+        ----------
+        step : str
+            Step of the tasks
+        tasks_kwargs : Iterator[Dict]
+            Arguments of the tasks. The iterator is consumed lazily, as the
+            tasks are popped, and must yield `num_tasks` items.
+        num_tasks : int
+            Number of tasks
+        """
+        if num_tasks > 0:
+            self._append(step, [self._seq, tasks_kwargs, num_tasks], num_tasks)
+
+    def _append(self, step, entry, num_tasks):
+        tasks = self._tasks.get(step)
+        if tasks is None:
+            tasks = self._tasks[step] = deque()
+        if not tasks:
+            heappush(self._heap, (self._policy.priority(step), self._seq, step))
+        tasks.append(entry)
+        self._seq += 1
+        self._len += num_tasks
+        self._num_queued[step] = self._num_queued.get(step, 0) + num_tasks
+
+    def pop(self, can_launch=None):
+        """
+        Pop the next task to launch.
+
+        Parameters
+        ----------
+        can_launch : Callable[[str], bool], optional
+            If specified, tasks of steps for which this returns False are
+            skipped (and stay in the queue)
+
+        Returns
+        -------
+        Tuple[str, Dict]
+            The step and arguments of the task or None if there are no tasks
+            (that can be launched).
+        """
+        skipped = []
+        result = None
+        while self._heap:
+            priority, seq, step = heappop(self._heap)
+            if can_launch is not None and not can_launch(step):
+                skipped.append((priority, seq, step))
+                continue
+            tasks = self._tasks[step]
+            entry = tasks[0]
+            if entry[2] is None:
+                task_kwargs = entry[1]
+                tasks.popleft()
+            else:
+                task_kwargs = next(entry[1])
+                entry[2] -= 1
+                if not entry[2]:
+                    tasks.popleft()
+            if tasks:
+                heappush(self._heap, (priority, tasks[0][0], step))
+            self._len -= 1
+            self._num_queued[step] -= 1
+            result = (step, task_kwargs)
+            break
+        for item in skipped:
+            heappush(self._heap, item)
+        return result
+
+    def num_queued(self, step):
+        """
+        Number of tasks of `step` in the queue.
+        """
+        return self._num_queued.get(step, 0)
+
+
+class ResourcePool(object):
+    """
+    Resources (e.g. {"cpu": 8, "memory": 16384}) available to local tasks.
+
+    A resource with a capacity of None is not limited. A request that doesn't
+    fit in the pool even when it is empty is granted when no other request is
+    being held so that such tasks still run, one at a time.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = dict(capacity)
+        self.used = {k: 0 for k in self.capacity}
+        self._num_held = 0
+
+    def fits(self, request):
+        if self._num_held == 0:
+            return True
+        for k, v in request.items():
+            capacity = self.capacity.get(k)
+            if capacity is not None and self.used[k] + v > capacity:
+                return False
+        return True
+
+    def exceeds_capacity(self, request):
+        return any(
+            self.capacity.get(k) is not None and v > self.capacity[k]
+            for k, v in request.items()
+        )
+
+    def acquire(self, request):
+        for k, v in request.items():
+            if k in self.used:
+                self.used[k] += v
+        self._num_held += 1
+
+    def release(self, request):
+        for k, v in request.items():
+            if k in self.used:
+                self.used[k] -= v
+        self._num_held -= 1
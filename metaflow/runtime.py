@@ -10,38 +10,53 @@ import sys
 import fcntl
 import time
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from io import BytesIO
 from functools import partial
 
 from . import get_namespace
-from .metaflow_config import MAX_ATTEMPTS
+from .metaflow_config import MAX_ATTEMPTS, RUNTIME_MAX_CPU, RUNTIME_MAX_MEMORY
 from .exception import (
     MetaflowException,
     MetaflowInternalError,
     METAFLOW_EXIT_DISALLOW_RETRY,
 )
 from . import procpoll
-from .datastore import TaskDataStoreSet
+from .datastore import TaskDataStore, TaskDataStoreSet
 from .debug import debug
 from .decorators import flow_decorators
+from .metadata import MetaDatum
 from .mflog import mflog, RUNTIME_LOG_SOURCE
+from .run_queue import ResourcePool, RunQueue
+from .task import ForeachFrame
 from .util import to_unicode, compress_list, unicode_type
 from .unbounded_foreach import (
     CONTROL_TASK_TAG,
     UBF_CONTROL,
     UBF_TASK,
 )
+from .zygote import Zygote
 
 MAX_WORKERS = 16
 MAX_NUM_SPLITS = 100
 MAX_LOG_SIZE = 1024 * 1024
+# Maximum number of task IDs of a foreach reserved at once
+TASK_ID_BATCH_SIZE = 1000
 PROGRESS_INTERVAL = 1000  # ms
+# Logs of a worker are read in chunks of LOG_READ_SIZE bytes, at most
+# LOG_MAX_READS chunks per fd each time the runtime polls the workers
+LOG_READ_SIZE = 64 * 1024
+LOG_MAX_READS = 16
 # The following is a list of the (data) artifacts used by the runtime while
 # executing a flow. These are prefetched during the resume operation by
 # leveraging the TaskDataStoreSet.
 PREFETCH_DATA_ARTIFACTS = ["_foreach_stack", "_task_ok", "_transition"]
 
+# Steps with one of these decorators execute remotely so their @resources
+# don't count against the resources of the local machine.
+REMOTE_COMPUTE_DECORATORS = ("batch", "kubernetes")
+
 # Runtime must use logsource=RUNTIME_LOG_SOURCE for all loglines that it
 # formats according to mflog. See a comment in mflog.__init__
 mflog_msg = partial(mflog.decorate, RUNTIME_LOG_SOURCE)
@@ -68,6 +83,12 @@ class NativeRuntime(object):
         max_workers=MAX_WORKERS,
         max_num_splits=MAX_NUM_SPLITS,
         max_log_size=MAX_LOG_SIZE,
+        launcher="subprocess",
+        scheduler="fifo",
+        max_workers_per_step=None,
+        max_cpu=RUNTIME_MAX_CPU,
+        max_memory=RUNTIME_MAX_MEMORY,
+        log_many=None,
     ):
 
         if run_id is None:
@@ -82,10 +103,48 @@ class NativeRuntime(object):
         self._metadata = metadata
         self._environment = environment
         self._logger = logger
+        # Optional function to write many log lines (given as tuples of the
+        # arguments of logger) at once
+        self._log_many = log_many
         self._max_workers = max_workers
         self._num_active_workers = 0
+        # Optional caps on the number of concurrent tasks of some steps
+        self._max_workers_per_step = max_workers_per_step or {}
+        for step, limit in self._max_workers_per_step.items():
+            if step not in graph:
+                raise MetaflowException(
+                    "Cannot limit the number of workers of step *%s*: "
+                    "there is no such step." % step
+                )
+            if limit < 1:
+                raise MetaflowException(
+                    "The maximum number of workers of step *%s* must be "
+                    "at least 1." % step
+                )
+        self._num_active_workers_per_step = {}
+        # Local tasks of steps with @resources are only launched if the CPUs
+        # and memory they request are available
+        self._step_resources = _local_step_resources(flow)
+        self._resource_pool = ResourcePool(
+            {
+                "cpu": float(max_cpu) if max_cpu else os.cpu_count(),
+                "memory": float(max_memory) if max_memory else _total_memory(),
+            }
+        )
+        for step, request in self._step_resources.items():
+            if self._resource_pool.exceeds_capacity(request):
+                logger(
+                    "Step *%s* requests more resources than available "
+                    "locally; its tasks will run one at a time." % step,
+                    system_msg=True,
+                    bad=True,
+                )
         self._max_num_splits = max_num_splits
         self._max_log_size = max_log_size
+        # With the "zygote" launcher, tasks are forked from a process that
+        # has pre-imported the modules they need (see zygote.py)
+        self._launcher = launcher
+        self._zygote = None
         self._params_task = None
         self._entrypoint = entrypoint
         self.event_logger = event_logger
@@ -123,9 +182,12 @@ class NativeRuntime(object):
                 clone_run_id,
                 prefetch_data_artifacts=PREFETCH_DATA_ARTIFACTS,
             )
-        self._run_queue = []
+        # Tasks ready to be launched, in the order given by the scheduling
+        # policy (see run_queue.py)
+        self._run_queue = RunQueue(graph, scheduler)
         self._poll = procpoll.make_poll()
         self._workers = {}  # fd -> subprocess mapping
+        self._cloned_tasks = []  # tasks cloned by _launch_workers
         self._finished = {}
         self._is_cloned = {}
         # NOTE: In case of unbounded foreach, we need the following to schedule
@@ -133,6 +195,10 @@ class NativeRuntime(object):
         # and ensure that the join tasks runs only if all dependent tasks have
         # finished.
         self._control_num_splits = {}  # control_task -> num_splits mapping
+        # Number of finished tasks of each foreach split (see _mark_finished)
+        # so that checking if a foreach join can run doesn't require looking
+        # up all the siblings of each finished task.
+        self._num_finished_siblings = {}
 
         for step in flow:
             for deco in step.decorators:
@@ -169,6 +235,7 @@ class NativeRuntime(object):
             origin_ds_set=self._origin_ds_set,
             decos=decos,
             logger=self._logger,
+            log_many=self._log_many,
             **kwargs
         )
 
@@ -194,32 +261,12 @@ class NativeRuntime(object):
         else:
             self._queue_push("start", {})
 
-        progress_tstamp = time.time()
+        if self._launcher == "zygote":
+            self._zygote = Zygote(self._entrypoint)
+
         try:
-            # main scheduling loop
             exception = None
-            while self._run_queue or self._num_active_workers > 0:
-
-                # 1. are any of the current workers finished?
-                finished_tasks = list(self._poll_workers())
-                # 2. push new tasks triggered by the finished tasks to the queue
-                self._queue_tasks(finished_tasks)
-                # 3. if there are available worker slots, pop and start tasks
-                #    from the queue.
-                self._launch_workers()
-
-                if time.time() - progress_tstamp > PROGRESS_INTERVAL:
-                    progress_tstamp = time.time()
-                    msg = "%d tasks are running: %s." % (
-                        self._num_active_workers,
-                        "e.g. ...",
-                    )  # TODO
-                    self._logger(msg, system_msg=True)
-                    msg = "%d tasks are waiting in the queue." % len(self._run_queue)
-                    self._logger(msg, system_msg=True)
-                    msg = "%d steps are pending: %s." % (0, "e.g. ...")  # TODO
-                    self._logger(msg, system_msg=True)
-
+            self._run_loop()
         except KeyboardInterrupt as ex:
             self._logger("Workflow interrupted.", system_msg=True, bad=True)
             self._killall()
@@ -238,6 +285,10 @@ class NativeRuntime(object):
 
             self._metadata.stop_heartbeat()
 
+            if self._zygote is not None:
+                self._zygote.close()
+                self._zygote = None
+
         # assert that end was executed and it was successful
         if ("end", ()) in self._finished:
             self._logger("Done!", system_msg=True)
@@ -246,6 +297,31 @@ class NativeRuntime(object):
                 "The *end* step was not successful " "by the end of flow."
             )
 
+    def _run_loop(self):
+        # main scheduling loop
+        progress_tstamp = time.time()
+        while self._run_queue or self._num_active_workers > 0 or self._cloned_tasks:
+
+            # 1. are any of the current workers finished?
+            finished_tasks = list(self._poll_workers())
+            # 2. push new tasks triggered by the finished tasks to the queue
+            self._queue_tasks(finished_tasks)
+            # 3. if there are available worker slots, pop and start tasks
+            #    from the queue.
+            self._launch_workers()
+
+            if time.time() - progress_tstamp > PROGRESS_INTERVAL:
+                progress_tstamp = time.time()
+                msg = "%d tasks are running: %s." % (
+                    self._num_active_workers,
+                    "e.g. ...",
+                )  # TODO
+                self._logger(msg, system_msg=True)
+                msg = "%d tasks are waiting in the queue." % len(self._run_queue)
+                self._logger(msg, system_msg=True)
+                msg = "%d steps are pending: %s." % (0, "e.g. ...")  # TODO
+                self._logger(msg, system_msg=True)
+
     def _killall(self):
         # If we are here, all children have received a signal and are shutting down.
         # We want to give them an opportunity to do so and then kill
@@ -277,10 +353,37 @@ class NativeRuntime(object):
     # Store the parameters needed for task creation, so that pushing on items
     # onto the run_queue is an inexpensive operation.
     def _queue_push(self, step, task_kwargs):
-        self._run_queue.insert(0, (step, task_kwargs))
+        self._run_queue.push(step, task_kwargs)
+
+    # Queue many tasks at once; `tasks_kwargs` is only iterated over as the
+    # tasks are launched so it should generate the parameters on the fly.
+    def _queue_extend(self, step, tasks_kwargs, num_tasks):
+        self._run_queue.extend(step, tasks_kwargs, num_tasks)
 
     def _queue_pop(self):
-        return self._run_queue.pop() if self._run_queue else None
+        if self._max_workers_per_step or self._step_resources:
+            return self._run_queue.pop(can_launch=self._can_launch)
+        return self._run_queue.pop()
+
+    def _can_launch(self, step):
+        limit = self._max_workers_per_step.get(step)
+        if (
+            limit is not None
+            and self._num_active_workers_per_step.get(step, 0) >= limit
+        ):
+            return False
+        request = self._step_resources.get(step)
+        return request is None or self._resource_pool.fits(request)
+
+    def _mark_finished(self, finished_id, path):
+        if finished_id not in self._finished:
+            step, foreach_stack = finished_id
+            if foreach_stack and foreach_stack[-1].index is not None:
+                key = _siblings_key(step, foreach_stack)
+                self._num_finished_siblings[key] = (
+                    self._num_finished_siblings.get(key, 0) + 1
+                )
+        self._finished[finished_id] = path
 
     def _queue_task_join(self, task, next_steps):
         # if the next step is a join, we need to check that
@@ -297,14 +400,14 @@ class NativeRuntime(object):
         else:
             next_step = next_steps[0]
 
-        unbounded_foreach = not task.results.is_none("_unbounded_foreach")
+        unbounded_foreach = task.control["_unbounded_foreach"] is not None
 
         if unbounded_foreach:
             # Before we queue the join, do some post-processing of runtime state
             # (_finished, _is_cloned) for the (sibling) mapper tasks.
             # Update state of (sibling) mapper tasks for control task.
             if task.ubf_context == UBF_CONTROL:
-                mapper_tasks = task.results.get("_control_mapper_tasks")
+                mapper_tasks = task.control["_control_mapper_tasks"]
                 if not mapper_tasks:
                     msg = (
                         "Step *{step}* has a control task which didn't "
@@ -335,18 +438,19 @@ class NativeRuntime(object):
                 self._control_num_splits[task.path] = num_splits
                 if task.is_cloned:
                     # Add mapper tasks to be cloned.
-                    for i in range(num_splits):
-                        # NOTE: For improved robustness, introduce
-                        # `clone_options` as an enum so that we can force that
-                        # clone must occur for this task.
-                        self._queue_push(
+                    # NOTE: For improved robustness, introduce
+                    # `clone_options` as an enum so that we can force that
+                    # clone must occur for this task.
+                    self._queue_extend(
+                        task.step,
+                        self._foreach_splits(
                             task.step,
-                            {
-                                "input_paths": task.input_paths,
-                                "split_index": str(i),
-                                "ubf_context": UBF_TASK,
-                            },
-                        )
+                            num_splits,
+                            input_paths=task.input_paths,
+                            ubf_context=UBF_TASK,
+                        ),
+                        num_splits,
+                    )
                 else:
                     # Update _finished since these tasks were successfully
                     # run elsewhere so that join will be unblocked.
@@ -355,7 +459,7 @@ class NativeRuntime(object):
                     bottom = list(foreach_stack[:-1])
                     for i in range(num_splits):
                         s = tuple(bottom + [top._replace(index=i)])
-                        self._finished[(task.step, s)] = mapper_tasks[i]
+                        self._mark_finished((task.step, s), mapper_tasks[i])
                         self._is_cloned[mapper_tasks[i]] = False
 
             # Find and check status of control task and retrieve its pathspec
@@ -367,7 +471,7 @@ class NativeRuntime(object):
 
             # UBF control can also be the first task of the list. Then
             # it will have index=0 instead of index=None.
-            if task.results.get("_control_task_is_mapper_zero", False):
+            if task.control["_control_task_is_mapper_zero"]:
                 s = tuple(bottom + [top._replace(index=0)])
             control_path = self._finished.get((task.step, s))
             if control_path:
@@ -375,10 +479,15 @@ class NativeRuntime(object):
                 # Additionally check the state of (sibling) mapper tasks as well
                 # (for the sake of resume) before queueing join task.
                 num_splits = self._control_num_splits[control_path]
-                required_tasks = []
-                for i in range(num_splits):
-                    s = tuple(bottom + [top._replace(index=i)])
-                    required_tasks.append(self._finished.get((task.step, s)))
+                num_finished = self._num_finished_siblings.get(
+                    _siblings_key(task.step, foreach_stack), 0
+                )
+                required_tasks = [None]
+                if num_finished >= num_splits:
+                    required_tasks = []
+                    for i in range(num_splits):
+                        s = tuple(bottom + [top._replace(index=i)])
+                        required_tasks.append(self._finished.get((task.step, s)))
 
                 if all(required_tasks):
                     # all tasks to be joined are ready. Schedule the next join step.
@@ -400,10 +509,17 @@ class NativeRuntime(object):
                     for index in range(top.num_splits):
                         yield tuple(bottom + [top._replace(index=index)])
 
-                # required tasks are all split-siblings of the finished task
-                required_tasks = [
-                    self._finished.get((task.step, s)) for s in siblings(foreach_stack)
-                ]
+                # required tasks are all split-siblings of the finished task;
+                # they are only looked up once enough siblings have finished
+                required_tasks = [None]
+                num_finished = self._num_finished_siblings.get(
+                    _siblings_key(task.step, foreach_stack), 0
+                )
+                if num_finished >= foreach_stack[-1].num_splits:
+                    required_tasks = [
+                        self._finished.get((task.step, s))
+                        for s in siblings(foreach_stack)
+                    ]
                 join_type = "foreach"
             else:
                 # next step is a split
@@ -434,10 +550,10 @@ class NativeRuntime(object):
         else:
             next_step = next_steps[0]
 
-        unbounded_foreach = not task.results.is_none("_unbounded_foreach")
+        unbounded_foreach = task.control["_unbounded_foreach"] is not None
         if unbounded_foreach:
             # Need to push control process related task.
-            ubf_iter_name = task.results.get("_foreach_var")
+            ubf_iter_name = task.control["_foreach_var"]
             ubf_iter = task.results.get(ubf_iter_name)
             self._queue_push(
                 next_step,
@@ -448,7 +564,7 @@ class NativeRuntime(object):
                 },
             )
         else:
-            num_splits = task.results["_foreach_num_splits"]
+            num_splits = task.control["_foreach_num_splits"]
             if num_splits > self._max_num_splits:
                 msg = (
                     "Foreach in step *{step}* yielded {num} child steps "
@@ -463,23 +579,40 @@ class NativeRuntime(object):
                     ),
                 )
 
-            # schedule all splits
-            for i in range(num_splits):
-                self._queue_push(
-                    next_step, {"split_index": str(i), "input_paths": [task.path]}
+            # schedule all splits; they are only expanded into tasks as
+            # worker slots become available
+            self._queue_extend(
+                next_step,
+                self._foreach_splits(next_step, num_splits, input_paths=[task.path]),
+                num_splits,
+            )
+
+    def _foreach_splits(self, step, num_splits, **task_kwargs):
+        # Generates the arguments of the split tasks of a foreach. Their task
+        # IDs are reserved in batches, with one call to the metadata provider,
+        # as the splits are launched.
+        for start in range(0, num_splits, TASK_ID_BATCH_SIZE):
+            end = min(start + TASK_ID_BATCH_SIZE, num_splits)
+            task_ids = self._metadata.new_task_ids(self._run_id, step, end - start)
+            for split_index, task_id in zip(range(start, end), task_ids):
+                yield dict(
+                    task_kwargs,
+                    split_index=str(split_index),
+                    task_id=str(task_id),
+                    task_id_registered=True,
                 )
 
     def _queue_tasks(self, finished_tasks):
         # finished tasks include only successful tasks
         for task in finished_tasks:
-            self._finished[task.finished_id] = task.path
+            self._mark_finished(task.finished_id, task.path)
             self._is_cloned[task.path] = task.is_cloned
 
             # CHECK: ensure that runtime transitions match with
             # statically inferred transitions. Make an exception for control
             # tasks, where we just rely on static analysis since we don't
             # execute user code.
-            trans = task.results.get("_transition")
+            trans = task.control["_transition"]
             if trans:
                 next_steps = trans[0]
                 foreach = trans[1]
@@ -517,21 +650,27 @@ class NativeRuntime(object):
                     self._queue_push(step, {"input_paths": [task.path]})
 
     def _poll_workers(self):
+        timeout = PROGRESS_INTERVAL
+        if self._cloned_tasks:
+            # Cloned tasks are already finished so we don't wait for workers
+            cloned_tasks, self._cloned_tasks = self._cloned_tasks, []
+            for task in cloned_tasks:
+                yield task
+            timeout = 0
         if self._workers:
-            for event in self._poll.poll(PROGRESS_INTERVAL):
+            for event in self._poll.poll(timeout):
                 worker = self._workers.get(event.fd)
                 if worker:
                     if event.can_read:
-                        worker.read_logline(event.fd)
+                        worker.read_loglines(event.fd)
                     if event.is_terminated:
                         returncode = worker.terminate()
 
                         for fd in worker.fds():
                             self._poll.remove(fd)
                             del self._workers[fd]
-                        self._num_active_workers -= 1
-
                         task = worker.task
+                        self._release_slot(task.step)
                         if returncode:
                             # worker did not finish successfully
                             if (
@@ -555,34 +694,115 @@ class NativeRuntime(object):
                             yield task
 
     def _launch_workers(self):
-        while self._run_queue and self._num_active_workers < self._max_workers:
-            step, task_kwargs = self._queue_pop()
+        to_clone = []
+        # Cloned tasks don't take a worker slot; their number is bounded so
+        # that the workers are polled (and their logs drained) between batches
+        # of clones when resuming runs with many of them.
+        while (
+            self._run_queue
+            and self._num_active_workers < self._max_workers
+            and len(to_clone) < self._max_workers
+        ):
+            item = self._queue_pop()
+            if item is None:
+                # The remaining tasks are of steps at their concurrency limit
+                break
+            step, task_kwargs = item
             # Initialize the task (which can be expensive using remote datastores)
             # before launching the worker so that cost is amortized over time, instead
             # of doing it during _queue_push.
             task = self._new_task(step, **task_kwargs)
-            self._launch_worker(task)
+            if task.is_cloned and task.clone_origin:
+                # Tasks that are cloned (when resuming) do not need a worker
+                to_clone.append(task)
+            else:
+                self._launch_worker(task)
+        if to_clone:
+            self._clone_tasks(to_clone)
+
+    def _clone_tasks(self, tasks):
+        # Clone the tasks in this process; this only involves copying
+        # metadata so we use threads to overlap the I/O of all the tasks.
+        if len(tasks) == 1:
+            tasks[0].clone()
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(len(tasks), self._max_workers)
+            ) as executor:
+                list(executor.map(lambda task: task.clone(), tasks))
+        self._cloned_tasks.extend(tasks)
 
     def _retry_worker(self, worker):
-        worker.task.retries += 1
-        if worker.task.retries >= MAX_ATTEMPTS:
+        self._next_attempt(worker.task)
+        self._launch_worker(worker.task)
+
+    def _next_attempt(self, task):
+        task.retries += 1
+        if task.retries >= MAX_ATTEMPTS:
             # any results with an attempt ID >= MAX_ATTEMPTS will be ignored
             # by datastore, so running a task with such a retry_could would
             # be pointless and dangerous
             raise MetaflowInternalError(
-                "Too many task attempts (%d)! "
-                "MAX_ATTEMPTS exceeded." % worker.task.retries
+                "Too many task attempts (%d)! " "MAX_ATTEMPTS exceeded." % task.retries
             )
 
-        worker.task.new_attempt()
-        self._launch_worker(worker.task)
+        task.new_attempt()
 
     def _launch_worker(self, task):
-        worker = Worker(task, self._max_log_size)
+        worker = Worker(task, self._max_log_size, self._zygote)
         for fd in worker.fds():
             self._workers[fd] = worker
             self._poll.add(fd)
+        self._acquire_slot(task.step)
+
+    # A slot is held by each running task; it accounts for the task in the
+    # worker limits and in the resources used locally.
+    def _acquire_slot(self, step):
         self._num_active_workers += 1
+        self._num_active_workers_per_step[step] = (
+            self._num_active_workers_per_step.get(step, 0) + 1
+        )
+        if step in self._step_resources:
+            self._resource_pool.acquire(self._step_resources[step])
+
+    def _release_slot(self, step):
+        self._num_active_workers -= 1
+        self._num_active_workers_per_step[step] -= 1
+        if step in self._step_resources:
+            self._resource_pool.release(self._step_resources[step])
+
+
+def _siblings_key(step, foreach_stack):
+    # Identifies the tasks of `step` that are split-siblings in `foreach_stack`.
+    # The number of splits is left out since the control task of an unbounded
+    # foreach doesn't know it.
+    top = foreach_stack[-1]
+    return (step, tuple(foreach_stack[:-1]), top._replace(num_splits=None, index=None))
+
+
+def _local_step_resources(flow):
+    # Resources requested with @resources by the steps executed locally
+    resources = {}
+    for step in flow:
+        decos = {deco.name: deco for deco in step.decorators}
+        if "resources" not in decos or any(
+            name in decos for name in REMOTE_COMPUTE_DECORATORS
+        ):
+            continue
+        attrs = decos["resources"].attributes
+        resources[step.__name__] = {
+            "cpu": float(attrs.get("cpu") or 0),
+            "memory": float(attrs.get("memory") or 0),
+        }
+    return resources
+
+
+def _total_memory():
+    # Physical memory of the machine in MB or None if it can't be determined
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 2
+    except (AttributeError, ValueError, OSError):
+        return None
 
 
 class Task(object):
@@ -608,7 +828,9 @@ class Task(object):
         may_clone=False,
         join_type=None,
         logger=None,
+        log_many=None,
         task_id=None,
+        task_id_registered=False,
         decos=[],
     ):
         if ubf_context == UBF_CONTROL:
@@ -624,8 +846,9 @@ class Task(object):
         # Register only regular Metaflow (non control) tasks.
         if task_id is None:
             task_id = str(metadata.new_task_id(run_id, step))
-        else:
-            # task_id is preset only by persist_constants() or control tasks.
+        elif not task_id_registered:
+            # task_id is preset by persist_constants() or control tasks (and
+            # foreach splits, which are registered by new_task_ids).
             if ubf_context == UBF_CONTROL:
                 tags = [CONTROL_TASK_TAG]
                 metadata.register_task_id(
@@ -658,6 +881,7 @@ class Task(object):
         self.monitor = monitor
 
         self._logger = logger
+        self._log_many = log_many
         self._path = "%s/%s/%s" % (self.run_id, self.step, self.task_id)
 
         self.retries = 0
@@ -673,6 +897,8 @@ class Task(object):
         self._flow_datastore = flow_datastore
         self.datastore_sysroot = flow_datastore.datastore_root
         self._results_ds = None
+        self._finished_id = None
+        self._control = None
 
         if clone_run_id and may_clone:
             self._is_cloned = self._attempt_clone(clone_run_id, join_type)
@@ -732,6 +958,23 @@ class Task(object):
         self._logger(msg, head=prefix, system_msg=system_msg, timestamp=timestamp)
         sys.stdout.flush()
 
+    def log_many(self, lines, system_msg=False, pid=None):
+        # Same as log() for many (msg, timestamp) lines. They are written to
+        # the console at once if the runtime was given a log_many function.
+        if pid:
+            prefix = "[%s (pid %s)] " % (self._path, pid)
+        else:
+            prefix = "[%s] " % self._path
+
+        if self._log_many:
+            self._log_many(
+                [(msg, system_msg, prefix, False, tstamp) for msg, tstamp in lines]
+            )
+        else:
+            for msg, tstamp in lines:
+                self._logger(msg, head=prefix, system_msg=system_msg, timestamp=tstamp)
+        sys.stdout.flush()
+
     def _find_origin_task(self, clone_run_id, join_type):
         if self.step == "_parameters":
             pathspec = "%s/_parameters[]" % clone_run_id
@@ -795,6 +1038,38 @@ class Task(object):
         else:
             return False
 
+    def clone(self):
+        # Clone the results of clone_origin into this task. This is the same
+        # as what MetaflowTask.clone_only does in a task launched with
+        # --clone-only but without starting a process.
+        origin = self._results_ds
+        self._ds = self._flow_datastore.get_task_datastore(
+            self.run_id, self.step, self.task_id, attempt=0, mode="w"
+        )
+        self._ds.init_task()
+        self._ds.clone(origin)
+        metadata_tags = ["attempt_id:0"]
+        self.metadata.register_metadata(
+            self.run_id,
+            self.step,
+            self.task_id,
+            [
+                MetaDatum(
+                    field="origin-task-id",
+                    value=str(origin.task_id),
+                    type="origin-task-id",
+                    tags=metadata_tags,
+                ),
+                MetaDatum(
+                    field="origin-run-id",
+                    value=str(origin.run_id),
+                    type="origin-run-id",
+                    tags=metadata_tags,
+                ),
+            ],
+        )
+        self._ds.done()
+
     @property
     def path(self):
         return self._path
@@ -812,7 +1087,30 @@ class Task(object):
     @property
     def finished_id(self):
         # note: id is not available before the task has finished
-        return (self.step, tuple(self.results["_foreach_stack"]))
+        if self._finished_id is None:
+            self._finished_id = (self.step, tuple(self.control["_foreach_stack"]))
+        return self._finished_id
+
+    @property
+    def control(self):
+        # note: only available once the task has finished successfully.
+        # Internal artifacts used to schedule the next tasks, read in one
+        # fetch from the control record of the task (see
+        # TaskDataStore.CONTROL_FIELDS).
+        if self._control is None:
+            control = self._flow_datastore.load_control_record(
+                self.run_id, self.step, self.task_id, self.retries
+            )
+            if control is None:
+                # The task was cloned from a task without a control record
+                names = [n for n in TaskDataStore.CONTROL_FIELDS if n in self.results]
+                control = dict.fromkeys(TaskDataStore.CONTROL_FIELDS)
+                control.update(self.results.load_artifacts(names))
+            control["_foreach_stack"] = [
+                ForeachFrame(*frame) for frame in control["_foreach_stack"] or []
+            ]
+            self._control = control
+        return self._control
 
     @property
     def is_cloned(self):
@@ -959,9 +1257,10 @@ class CLIArgs(object):
 
 
 class Worker(object):
-    def __init__(self, task, max_logs_size):
+    def __init__(self, task, max_logs_size, zygote=None):
 
         self.task = task
+        self._zygote = zygote
         self._proc = self._launch()
 
         if task.retries > task.user_code_retries:
@@ -983,6 +1282,14 @@ class Worker(object):
             self._proc.stderr.fileno(): (self._proc.stderr, self._stderr),
             self._proc.stdout.fileno(): (self._proc.stdout, self._stdout),
         }
+        # Logs are read directly from the (non-blocking) file descriptors;
+        # incomplete lines are kept here until the rest of the line arrives.
+        self._partial_lines = {}
+        for fd in self._logs:
+            fcntl.fcntl(
+                fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK
+            )
+            self._partial_lines[fd] = b""
 
         self._encoding = sys.stdout.encoding or "UTF-8"
         self.killed = False  # Killed indicates that the task was forcibly killed
@@ -999,42 +1306,55 @@ class Worker(object):
         if self.task.clone_run_id:
             args.command_options["clone-run-id"] = self.task.clone_run_id
 
-        if self.task.is_cloned and self.task.clone_origin:
-            args.command_options["clone-only"] = self.task.clone_origin
-            # disabling atlas sidecar for cloned tasks due to perf reasons
-            args.top_level_options["monitor"] = "nullSidecarMonitor"
-        else:
-            # decorators may modify the CLIArgs object in-place
-            for deco in self.task.decos:
-                deco.runtime_step_cli(
-                    args,
-                    self.task.retries,
-                    self.task.user_code_retries,
-                    self.task.ubf_context,
-                )
+        # NOTE: Cloned tasks are not launched (see NativeRuntime._clone_tasks)
+        # decorators may modify the CLIArgs object in-place
+        for deco in self.task.decos:
+            deco.runtime_step_cli(
+                args,
+                self.task.retries,
+                self.task.user_code_retries,
+                self.task.ubf_context,
+            )
         env.update(args.get_env())
         env["PYTHONUNBUFFERED"] = "x"
-        # NOTE bufsize=1 below enables line buffering which is required
-        # by read_logline() below that relies on readline() not blocking
         # print('running', args)
         cmdline = args.get_args()
         debug.subcommand_exec(cmdline)
+        if self._zygote is not None and self._zygote.can_launch(cmdline, env):
+            proc = self._zygote.launch(cmdline, env)
+            if proc is not None:
+                return proc
         return subprocess.Popen(
             cmdline,
             env=env,
-            bufsize=1,
             stdin=subprocess.PIPE,
             stderr=subprocess.PIPE,
             stdout=subprocess.PIPE,
         )
 
     def emit_log(self, msg, buf, system_msg=False):
-        if mflog.is_structured(msg):
-            res = mflog.parse(msg)
+        self.emit_logs([msg], buf, system_msg=system_msg)
+
+    def emit_logs(self, msgs, buf, system_msg=False):
+        # Lines are parsed and printed in bulk; all the lines of a batch that
+        # are not formatted with mflog share the same timestamp.
+        now = datetime.utcnow()
+        now_local = mflog.utc_to_local(now)
+        is_structured = [mflog.is_structured(msg) for msg in msgs]
+        formatted = iter(
+            mflog.decorate_many(
+                RUNTIME_LOG_SOURCE,
+                [msg for msg, structured in zip(msgs, is_structured) if not structured],
+                now=now,
+            )
+        )
+        lines = []
+        for msg, structured in zip(msgs, is_structured):
+            res = mflog.parse(msg) if structured else None
             if res:
                 # parsing successful
                 plain = res.msg
-                timestamp = res.utc_tstamp
+                timestamp = mflog.utc_to_local(res.utc_tstamp)
                 if res.should_persist:
                     # in special circumstances we may receive structured
                     # loglines that haven't been properly persisted upstream.
@@ -1044,35 +1364,54 @@ class Worker(object):
                     # which we process here
                     buf.write(mflog.unset_should_persist(msg))
             else:
-                # parsing failed, corrupted logline. Print it as-is
-                timestamp = datetime.utcnow()
+                # If the line isn't formatted with mflog already, we format it
+                # here. If parsing failed (corrupted logline), print it as-is.
                 plain = msg
-        else:
-            # If the line isn't formatted with mflog already, we format it here.
-            plain = msg
-            timestamp = datetime.utcnow()
-            # store unformatted loglines in the buffer that will be
-            # persisted, assuming that all previously formatted loglines have
-            # been already persisted at the source.
-            buf.write(mflog_msg(msg, now=timestamp), system_msg=system_msg)
-        text = plain.strip().decode(self._encoding, errors="replace")
-        self.task.log(
-            text,
-            pid=self._proc.pid,
-            timestamp=mflog.utc_to_local(timestamp),
-            system_msg=system_msg,
-        )
-
-    def read_logline(self, fd):
-        fileobj, buf = self._logs[fd]
-        # readline() below should never block thanks to polling and
-        # line buffering. If it does, things will deadlock
-        line = fileobj.readline()
-        if line:
-            self.emit_log(line, buf)
-            return True
-        else:
-            return False
+                timestamp = now_local
+                if not structured:
+                    # store unformatted loglines in the buffer that will be
+                    # persisted, assuming that all previously formatted loglines
+                    # have been already persisted at the source.
+                    buf.write(next(formatted), system_msg=system_msg)
+            text = plain.strip().decode(self._encoding, errors="replace")
+            lines.append((text, timestamp))
+        self.task.log_many(lines, system_msg=system_msg, pid=self._proc.pid)
+
+    def read_loglines(self, fd, final=False):
+        """
+        Emit all the complete lines available on `fd` without blocking.
+
+        Returns False if the end of the file was reached. If `final` is True,
+        everything available is read and an incomplete last line is emitted as
+        well.
+        """
+        _, buf = self._logs[fd]
+        chunks = [self._partial_lines[fd]]
+        eof = False
+        num_reads = 0
+        while final or num_reads < LOG_MAX_READS:
+            try:
+                chunk = os.read(fd, LOG_READ_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
+            num_reads += 1
+            if not chunk:
+                eof = True
+                break
+            chunks.append(chunk)
+            if len(chunk) < LOG_READ_SIZE and not final:
+                # The pipe is most likely empty now; don't waste a read on it
+                break
+        lines = b"".join(chunks).split(b"\n")
+        last = lines.pop()
+        lines = [line + b"\n" for line in lines]
+        if last and (eof or final):
+            lines.append(last)
+            last = b""
+        self._partial_lines[fd] = last
+        if lines:
+            self.emit_logs(lines, buf)
+        return not eof
 
     def fds(self):
         return (self._proc.stderr.fileno(), self._proc.stdout.fileno())
@@ -1102,20 +1441,15 @@ class Worker(object):
         returncode = self._proc.wait()
 
         # consume all remaining loglines
-        # we set the file descriptor to be non-blocking, since
-        # the pipe may stay active due to subprocesses launched by
-        # the worker, e.g. sidecars, so we can't rely on EOF. We try to
-        # read just what's available in the pipe buffer
-        for fileobj, buf in self._logs.values():
-            fileno = fileobj.fileno()
-            fcntl.fcntl(fileno, fcntl.F_SETFL, os.O_NONBLOCK)
+        # the file descriptors are non-blocking since the pipe may stay
+        # active due to subprocesses launched by the worker, e.g. sidecars,
+        # so we can't rely on EOF. We try to read just what's available in
+        # the pipe buffer
+        for fd in self._logs:
             try:
-                while self.read_logline(fileno):
-                    pass
+                self.read_loglines(fd, final=True)
             except:
-                # ignore "resource temporarily unavailable" etc. errors
-                # caused due to non-blocking. Draining is done on a
-                # best-effort basis.
+                # Draining is done on a best-effort basis.
                 pass
 
         # Return early if the task is cloned since we don't want to
@@ -1140,7 +1474,7 @@ class Worker(object):
                     else:
                         self.emit_log(b"Task failed.", self._stderr, system_msg=True)
             else:
-                num = self.task.results["_foreach_num_splits"]
+                num = self.task.control["_foreach_num_splits"]
                 if num:
                     self.task.log(
                         "Foreach yields %d child steps." % num,
@@ -8,6 +8,7 @@ from types import MethodType, FunctionType
 from .metaflow_config import MAX_ATTEMPTS
 from .metadata import MetaDatum
 from .datastore import Inputs, TaskDataStoreSet
+from .datastore.inputs import InputsBlobCache
 from .exception import (
     MetaflowInternalError,
     MetaflowDataMissing,
@@ -117,48 +118,48 @@ class MetaflowTask(object):
             self.flow._datastore.passdown_partial(parameter_ds, all_vars)
         return param_only_vars
 
-    def _init_data(self, run_id, join_type, input_paths):
-        # We prefer to use the parallelized version to initialize datastores
-        # (via TaskDataStoreSet) only with more than 4 datastores, because
-        # the baseline overhead of using the set is ~1.5s and each datastore
-        # init takes ~200-300ms when run sequentially.
-        if len(input_paths) > 4:
-            prefetch_data_artifacts = None
-            if join_type and join_type == "foreach":
-                # Prefetch 'foreach' related artifacts to improve time taken by
-                # _init_foreach.
-                prefetch_data_artifacts = [
-                    "_foreach_stack",
-                    "_foreach_num_splits",
-                    "_foreach_var",
-                ]
-            # Note: Specify `pathspecs` while creating the datastore set to
-            # guarantee strong consistency and guard against missing input.
-            datastore_set = TaskDataStoreSet(
-                self.flow_datastore,
-                run_id,
-                pathspecs=input_paths,
-                prefetch_data_artifacts=prefetch_data_artifacts,
-            )
-            ds_list = [ds for ds in datastore_set]
-            if len(ds_list) != len(input_paths):
-                raise MetaflowDataMissing(
-                    "Some input datastores are missing. "
-                    "Expected: %d Actual: %d" % (len(input_paths), len(ds_list))
-                )
-        else:
-            # initialize directly in the single input case.
-            ds_list = []
-            for input_path in input_paths:
-                run_id, step_name, task_id = input_path.split("/")
-                ds_list.append(
-                    self.flow_datastore.get_task_datastore(run_id, step_name, task_id)
-                )
+    def _init_data(self, run_id, join_type, input_paths, prefetch_artifacts=None):
+        prefetch_data_artifacts = list(prefetch_artifacts or [])
+        if join_type and join_type == "foreach":
+            # Prefetch 'foreach' related artifacts to improve time taken by
+            # _init_foreach.
+            prefetch_data_artifacts += [
+                "_foreach_stack",
+                "_foreach_num_splits",
+                "_foreach_var",
+            ]
+        if len(input_paths) == 1 and not prefetch_data_artifacts:
+            # initialize directly in the single input case: there is nothing
+            # to batch.
+            run_id, step_name, task_id = input_paths[0].split("/")
+            return [self.flow_datastore.get_task_datastore(run_id, step_name, task_id)]
+        # Otherwise, all input datastores are initialized at once via
+        # TaskDataStoreSet: the metadata of all the inputs is loaded in a
+        # single batch and the artifacts to prefetch (if any) in another one.
+        # Note: Specify `pathspecs` while creating the datastore set to
+        # guarantee strong consistency and guard against missing input.
+        datastore_set = TaskDataStoreSet(
+            self.flow_datastore,
+            run_id,
+            pathspecs=input_paths,
+            prefetch_data_artifacts=prefetch_data_artifacts or None,
+        )
+        # Keep the datastores in the order of the input paths.
+        ds_list = [
+            ds
+            for ds in map(datastore_set.get_with_pathspec, input_paths)
+            if ds is not None
+        ]
         if not ds_list:
             # this guards against errors in input paths
             raise MetaflowDataMissing(
                 "Input paths *%s* resolved to zero " "inputs" % ",".join(input_paths)
             )
+        if len(ds_list) != len(input_paths):
+            raise MetaflowDataMissing(
+                "Some input datastores are missing. "
+                "Expected: %d Actual: %d" % (len(input_paths), len(ds_list))
+            )
         return ds_list
 
     def _init_foreach(self, step_name, join_type, inputs, split_index):
@@ -409,7 +410,13 @@ class MetaflowTask(object):
 
         if input_paths:
             # 2. initialize input datastores
-            inputs = self._init_data(run_id, join_type, input_paths)
+            prefetch_artifacts = [
+                artifact
+                for deco in decorators
+                if deco.name == "prefetch"
+                for artifact in deco.attributes["artifacts"]
+            ]
+            inputs = self._init_data(run_id, join_type, input_paths, prefetch_artifacts)
 
             # 3. initialize foreach state
             self._init_foreach(step_name, join_type, inputs, split_index)
@@ -479,6 +486,14 @@ class MetaflowTask(object):
                 # Multiple input contexts are passed in as an argument
                 # to the step function.
                 input_obj = Inputs(self._clone_flow(inp) for inp in inputs)
+                # Artifacts of the inputs are loaded lazily but the loading of
+                # an artifact accessed in several inputs is coalesced.
+                ca_store = self.flow_datastore.ca_store
+                ca_store.set_blob_cache(
+                    InputsBlobCache(
+                        ca_store, inputs, parent_cache=ca_store.get_blob_cache()
+                    )
+                )
                 self.flow._set_datastore(output)
                 # initialize parameters (if they exist)
                 # We take Parameter values from the first input,
@@ -0,0 +1,368 @@
+"""
+Zygote task launcher
+
+Starting a task with subprocess.Popen starts a new Python interpreter that
+re-imports Metaflow and all the libraries used by the flow which can take
+several seconds for each task. A zygote is a long-lived process started once
+per run which pre-imports these modules; tasks are then forked from it.
+
+The processes launched through a Zygote behave like the ones started by
+Worker._launch: they run the same command line with the same environment and
+their stdin, stdout and stderr are pipes to the runtime. The ZygoteProcess
+returned mimics the subset of subprocess.Popen used by the runtime.
+"""
+import array
+import io
+import json
+import os
+import random
+import select
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import traceback
+
+from .debug import debug
+from .metaflow_config import ZYGOTE_PRELOAD_MODULES
+
+# Executed by the interpreter of the zygote. The first argument is the
+# directory of the flow script which is what the tasks would have as sys.path[0]
+ZYGOTE_BOOTSTRAP = (
+    "import sys; sys.path[0] = sys.argv[1]; "
+    "from metaflow.zygote import zygote_main; zygote_main()"
+)
+
+# Environment variables that are read at interpreter startup or when Metaflow
+# is imported. A task that sets them to different values than those of the
+# zygote can't be forked from it.
+STARTUP_ENV_PREFIXES = ("PYTHON", "METAFLOW_", "_METAFLOW_")
+
+# Modules always pre-imported by the zygote; more can be added with
+# METAFLOW_ZYGOTE_PRELOAD_MODULES. Importing arbitrary modules before forking
+# is not safe (a module may start threads or open connections when imported)
+# so only modules listed explicitly are pre-imported.
+PRELOAD_MODULES = ("metaflow",)
+
+# How often (in seconds) the zygote checks for terminated tasks
+REAP_INTERVAL = 0.05
+
+_HEADER = struct.Struct("!I")
+
+
+def _send_message(sock, msg, fds=()):
+    payload = json.dumps(msg).encode("utf-8")
+    ancillary = []
+    if fds:
+        ancillary = [
+            (socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds).tobytes())
+        ]
+    # The file descriptors travel with the header
+    sock.sendmsg([_HEADER.pack(len(payload))], ancillary)
+    sock.sendall(payload)
+
+
+def _recv_exactly(sock, size):
+    buf = b""
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return buf
+
+
+def _recv_message(sock, max_fds=0):
+    fds = array.array("i")
+    header, ancillary, _, _ = sock.recvmsg(
+        _HEADER.size, socket.CMSG_SPACE(max_fds * fds.itemsize) if max_fds else 0
+    )
+    for level, kind, data in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[: len(data) - (len(data) % fds.itemsize)])
+    if not header:
+        return None, list(fds)
+    if len(header) < _HEADER.size:
+        header += _recv_exactly(sock, _HEADER.size - len(header)) or b""
+    payload = _recv_exactly(sock, _HEADER.unpack(header)[0])
+    if payload is None:
+        return None, list(fds)
+    return json.loads(payload.decode("utf-8")), list(fds)
+
+
+def _returncode(status):
+    # Same convention as subprocess: -N if the process was killed by signal N
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class ZygoteProcess(object):
+    """
+    Handle on a task forked by the zygote. Its return code is sent by the
+    zygote through a dedicated pipe when the task terminates.
+    """
+
+    def __init__(self, pid, stdin, stdout, stderr, status_fd):
+        self.pid = pid
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+        self._status_fd = status_fd
+
+    def _read_status(self):
+        data = b""
+        while True:
+            chunk = os.read(self._status_fd, 64)
+            if not chunk:
+                break
+            data += chunk
+        os.close(self._status_fd)
+        self._status_fd = None
+        try:
+            self.returncode = int(data)
+        except ValueError:
+            # The zygote went away without reporting the status of the task
+            self.returncode = 1
+        try:
+            self.stdin.close()
+        except OSError:
+            pass
+
+    def poll(self):
+        if self.returncode is None:
+            ready, _, _ = select.select([self._status_fd], [], [], 0)
+            if ready:
+                self._read_status()
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None:
+            self._read_status()
+        return self.returncode
+
+    def kill(self):
+        if self.returncode is None:
+            os.kill(self.pid, signal.SIGKILL)
+
+
+class Zygote(object):
+    """
+    Runtime side of the zygote process.
+
+    Parameters
+    ----------
+    entrypoint : List[str]
+        Interpreter and flow script used to launch tasks (Task.entrypoint)
+    modules : List[str], optional
+        Modules to pre-import in the zygote. By default, PRELOAD_MODULES and
+        the modules listed in METAFLOW_ZYGOTE_PRELOAD_MODULES.
+    """
+
+    def __init__(self, entrypoint, modules=None):
+        self.entrypoint = list(entrypoint)
+        self.env = dict(os.environ)
+        if modules is None:
+            modules = list(PRELOAD_MODULES) + [
+                name.strip()
+                for name in ZYGOTE_PRELOAD_MODULES.split(",")
+                if name.strip()
+            ]
+        script_dir = os.path.dirname(os.path.realpath(self.entrypoint[1]))
+        self._sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        cmdline = [
+            self.entrypoint[0],
+            "-c",
+            ZYGOTE_BOOTSTRAP,
+            script_dir,
+            str(child_sock.fileno()),
+        ] + list(modules)
+        debug.subcommand_exec(cmdline)
+        self._proc = subprocess.Popen(
+            cmdline,
+            env=self.env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            pass_fds=[child_sock.fileno()],
+        )
+        child_sock.close()
+        self.alive = True
+
+    def can_launch(self, cmdline, env):
+        """
+        Returns True if the task with the given command line and environment
+        can be forked from this zygote.
+        """
+        if not self.alive or len(cmdline) < 2:
+            return False
+        if cmdline[:2] != self.entrypoint[:2]:
+            # For example, a different interpreter (@conda)
+            return False
+        for k in set(env).union(self.env):
+            if env.get(k) != self.env.get(k) and k.startswith(STARTUP_ENV_PREFIXES):
+                if k != "PYTHONUNBUFFERED":
+                    return False
+        return True
+
+    def launch(self, cmdline, env):
+        """
+        Fork a task running `cmdline` with environment `env`.
+
+        Returns a ZygoteProcess or None if the zygote is not usable anymore
+        (in which case the task should be started in the regular way).
+        """
+        stdin_r, stdin_w = os.pipe()
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        status_r, status_w = os.pipe()
+        try:
+            _send_message(
+                self._sock,
+                {"args": cmdline[1:], "env": env},
+                [stdin_r, stdout_w, stderr_w, status_w],
+            )
+            reply, _ = _recv_message(self._sock)
+        except (OSError, ValueError):
+            reply = None
+        finally:
+            # The zygote (and the task) have their own copies now
+            for fd in (stdin_r, stdout_w, stderr_w, status_w):
+                os.close(fd)
+        if reply is None:
+            self.alive = False
+            for fd in (stdin_w, stdout_r, stderr_r, status_r):
+                os.close(fd)
+            return None
+        return ZygoteProcess(
+            reply["pid"],
+            os.fdopen(stdin_w, "wb"),
+            os.fdopen(stdout_r, "rb"),
+            os.fdopen(stderr_r, "rb"),
+            status_r,
+        )
+
+    def close(self):
+        # The zygote exits once all its tasks are done
+        self.alive = False
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+        self._proc.wait()
+
+
+def _run_task(args, env):
+    # Executed in the forked task. Make it look like a new interpreter started
+    # with `python <args>` and environment `env`.
+    os.environ.clear()
+    os.environ.update(env)
+    sys.argv = list(args)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    random.seed()
+    sys.stdin = io.TextIOWrapper(io.FileIO(0, "r", closefd=False))
+    # Unbuffered, as with PYTHONUNBUFFERED
+    sys.stdout = io.TextIOWrapper(
+        io.FileIO(1, "w", closefd=False), line_buffering=True, write_through=True
+    )
+    sys.stderr = io.TextIOWrapper(
+        io.FileIO(2, "w", closefd=False),
+        errors="backslashreplace",
+        line_buffering=True,
+        write_through=True,
+    )
+    import runpy
+
+    code = 0
+    try:
+        runpy.run_path(args[0], run_name="__main__")
+    except SystemExit as ex:
+        if ex.code is None:
+            code = 0
+        elif isinstance(ex.code, int):
+            code = ex.code
+        else:
+            print(ex.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    try:
+        _shutdown()
+    finally:
+        os._exit(code)
+
+
+def _shutdown():
+    # What the interpreter does when it exits normally (the task terminates
+    # with os._exit instead, to not return to the loop of the zygote): wait
+    # for the non-daemon threads and run the atexit handlers.
+    import atexit
+
+    current = threading.current_thread()
+    for thread in threading.enumerate():
+        if thread is not current and not thread.daemon:
+            try:
+                thread.join()
+            except BaseException:
+                traceback.print_exc()
+    atexit._run_exitfuncs()
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+
+def zygote_main():
+    sock = socket.socket(fileno=int(sys.argv[2]))
+    # Interrupts are handled by the runtime (and the tasks)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for name in sys.argv[3:]:
+        try:
+            __import__(name)
+        except BaseException:
+            # Modules that can't be imported here are imported by the tasks
+            pass
+
+    children = {}  # pid -> status fd
+
+    def _reap(block=False):
+        while children:
+            pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+            if pid == 0:
+                return
+            status_fd = children.pop(pid, None)
+            if status_fd is not None:
+                os.write(status_fd, str(_returncode(status)).encode("utf-8"))
+                os.close(status_fd)
+
+    while True:
+        readable, _, _ = select.select(
+            [sock], [], [], REAP_INTERVAL if children else None
+        )
+        _reap()
+        if not readable:
+            continue
+        msg, fds = _recv_message(sock, max_fds=4)
+        if msg is None:
+            # The runtime is done
+            break
+        stdin_fd, stdout_fd, stderr_fd, status_fd = fds
+        pid = os.fork()
+        if pid == 0:
+            try:
+                sock.close()
+                for fd in children.values():
+                    os.close(fd)
+                os.close(status_fd)
+                for target, fd in enumerate((stdin_fd, stdout_fd, stderr_fd)):
+                    os.dup2(fd, target)
+                    os.close(fd)
+                _run_task(msg["args"], msg["env"])
+            finally:
+                os._exit(1)
+        for fd in (stdin_fd, stdout_fd, stderr_fd):
+            os.close(fd)
+        children[pid] = status_fd
+        _send_message(sock, {"pid": pid})
+    _reap(block=True)
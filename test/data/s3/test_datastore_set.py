@@ -0,0 +1,87 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from metaflow.datastore import FlowDataStore, TaskDataStoreSet
+from metaflow.datastore.s3_storage import S3Storage
+
+from .. import S3ROOT
+
+FLOW_NAME = "DataStoreSetBenchmarkFlow"
+RUN_ID = "1"
+STEP_NAME = "body"
+
+# Number of inputs of the join being benchmarked. Initializing the input
+# datastores used to switch implementation at 4 inputs; the time taken should
+# now grow smoothly with the number of inputs.
+BENCHMARK_NUM_INPUTS = [1, 2, 4, 5, 8, 16, 64, 256, 1024, 10000]
+
+
+def _flow_datastore():
+    return FlowDataStore(
+        FLOW_NAME,
+        None,
+        storage_impl=S3Storage,
+        ds_root=os.path.join(S3ROOT, "datastore_set"),
+    )
+
+
+def _pathspecs(num_inputs):
+    return [
+        "/".join((RUN_ID, STEP_NAME, str(task_id))) for task_id in range(num_inputs)
+    ]
+
+
+@pytest.fixture(scope="module")
+def flow_datastore():
+    flow_datastore = _flow_datastore()
+    storage = flow_datastore._storage_impl
+    mark = storage.path_join(FLOW_NAME, "ALL_OK")
+    if not storage.is_file([mark])[0]:
+        print("Uploading datastore set test data")
+
+        def _make_task(task_id):
+            ds = flow_datastore.get_task_datastore(
+                RUN_ID, STEP_NAME, str(task_id), attempt=0, mode="w"
+            )
+            ds.init_task()
+            ds.save_artifacts(
+                [("_foreach_stack", []), ("_foreach_var", None), ("score", task_id)]
+            )
+            ds.done()
+
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            list(executor.map(_make_task, range(max(BENCHMARK_NUM_INPUTS))))
+        storage.save_bytes(iter([(mark, b"")]), overwrite=True)
+    return flow_datastore
+
+
+@pytest.mark.parametrize("num_inputs", BENCHMARK_NUM_INPUTS)
+@pytest.mark.benchmark(max_time=60)
+def test_datastore_set_benchmark(benchmark, flow_datastore, num_inputs):
+    pathspecs = _pathspecs(num_inputs)
+
+    def _do():
+        datastore_set = TaskDataStoreSet(
+            _flow_datastore(),
+            RUN_ID,
+            pathspecs=pathspecs,
+            prefetch_data_artifacts=["_foreach_stack", "_foreach_var", "score"],
+        )
+        return [datastore_set.get_with_pathspec(p)["score"] for p in pathspecs]
+
+    assert benchmark(_do) == list(range(num_inputs))
+
+
+@pytest.mark.parametrize("num_inputs", [n for n in BENCHMARK_NUM_INPUTS if n <= 64])
+@pytest.mark.benchmark(max_time=60)
+def test_datastore_sequential_benchmark(benchmark, flow_datastore, num_inputs):
+    # Baseline: initialize the datastores one at a time
+    pathspecs = _pathspecs(num_inputs)
+
+    def _do():
+        fds = _flow_datastore()
+        return [fds.get_task_datastore(*p.split("/"))["score"] for p in pathspecs]
+
+    assert benchmark(_do) == list(range(num_inputs))
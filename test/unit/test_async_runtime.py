@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+
+import metaflow
+
+FLOW = """
+from metaflow import FlowSpec, current, retry, step
+
+
+class AsyncRuntimeFlow(FlowSpec):
+    @step
+    def start(self):
+        self.items = list(range(5))
+        self.next(self.body, foreach="items")
+
+    @retry(times=1, minutes_between_retries=0)
+    @step
+    def body(self):
+        if self.input == 3 and current.retry_count == 0:
+            raise ValueError("first attempt fails")
+        self.value = self.input * 10
+        self.next(self.join)
+
+    @step
+    def join(self, inputs):
+        print("total %d" % sum(i.value for i in inputs))
+        self.next(self.end)
+
+    @step
+    def end(self):
+        pass
+
+
+if __name__ == "__main__":
+    AsyncRuntimeFlow()
+"""
+
+
+def test_run_with_asyncio_event_loop(tmp_path):
+    script = tmp_path / "flow.py"
+    script.write_text(FLOW)
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.path.dirname(os.path.dirname(metaflow.__file__)),
+        METAFLOW_USER="tester",
+        METAFLOW_DEFAULT_METADATA="local",
+        METAFLOW_DEFAULT_DATASTORE="local",
+    )
+    proc = subprocess.run(
+        [
+            sys.executable,
+            str(script),
+            "--no-pylint",
+            "run",
+            "--event-loop",
+            "asyncio",
+            "--max-workers",
+            "3",
+        ],
+        cwd=str(tmp_path),
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    out = proc.stdout.decode("utf-8")
+    assert proc.returncode == 0, out
+    assert "total 100" in out
+    assert "Task is starting (retry)." in out
+    assert "Done!" in out
@@ -0,0 +1,172 @@
+import os
+import threading
+
+import pytest
+
+import metaflow.datastore.content_addressed_store as cas
+from metaflow.datastore.content_addressed_store import ContentAddressedStore
+from metaflow.datastore.exceptions import DataException
+from metaflow.datastore.local_storage import LocalStorage
+
+
+class CountingStorage(LocalStorage):
+    def __init__(self, root=None):
+        super(CountingStorage, self).__init__(root)
+        self.is_file_calls = []
+        self.saved_paths = []
+
+    def is_file(self, paths):
+        self.is_file_calls.append(list(paths))
+        return super(CountingStorage, self).is_file(paths)
+
+    def save_bytes(self, path_and_bytes_iter, overwrite=False, len_hint=0):
+        def _record():
+            for path, obj in path_and_bytes_iter:
+                self.saved_paths.append(path)
+                yield path, obj
+
+        return super(CountingStorage, self).save_bytes(
+            _record(), overwrite=overwrite, len_hint=len_hint
+        )
+
+
+def _make_store(tmp_path):
+    storage = CountingStorage(str(tmp_path))
+    return storage, ContentAddressedStore("Flow/data", storage)
+
+
+def test_save_blobs_single_existence_check(tmp_path):
+    storage, store = _make_store(tmp_path)
+    blobs = [("blob-%d" % i).encode("utf-8") for i in range(50)]
+
+    results = store.save_blobs(iter(blobs))
+    assert len(results) == 50
+    assert len(storage.is_file_calls) == 1
+    assert len(storage.is_file_calls[0]) == 50
+    assert len(storage.saved_paths) == 50
+
+    loaded = dict(store.load_blobs([r.key for r in results]))
+    assert [loaded[r.key] for r in results] == blobs
+
+
+def test_save_blobs_skips_existing_and_duplicates(tmp_path):
+    storage, store = _make_store(tmp_path)
+    store.save_blobs(iter([b"a", b"b"]))
+    storage.is_file_calls = []
+    storage.saved_paths = []
+
+    results = store.save_blobs(iter([b"a", b"c", b"c", b"b"]))
+    assert [r.key for r in results][1] == [r.key for r in results][2]
+    assert len(storage.is_file_calls) == 1
+    # Only one of the two "c" blobs is new and saved
+    assert len(storage.saved_paths) == 1
+
+    storage.saved_paths = []
+    assert store.save_blobs(iter([])) == []
+    assert storage.saved_paths == []
+
+
+def test_default_codec_is_readable_by_older_versions(tmp_path):
+    storage, store = _make_store(tmp_path)
+    incompressible = os.urandom(store.SAMPLE_MIN_SIZE * 2)
+    for blob in (b"small", incompressible):
+        [result] = store.save_blobs(iter([blob]))
+        _, meta = storage.info_file(
+            storage.path_join("Flow/data", result.key[:2], result.key)
+        )
+        assert meta == {"cas_raw": False, "cas_version": 1}
+
+
+def test_save_blobs_in_batches(tmp_path, monkeypatch):
+    storage, store = _make_store(tmp_path)
+    monkeypatch.setattr(store, "SAVE_BATCH_SIZE", 3)
+    blobs = [("blob-%d" % i).encode("utf-8") for i in range(8)] + [b"blob-0"]
+
+    results = store.save_blobs(iter(blobs))
+    # Blobs already checked (or saved) by a previous batch are not checked again
+    assert [len(paths) for paths in storage.is_file_calls] == [3, 3, 2]
+    assert len(storage.saved_paths) == 8
+    assert results[0] == results[-1]
+
+
+def test_codec_round_trip(tmp_path, monkeypatch):
+    storage, store = _make_store(tmp_path)
+    for codec in ("gzip", "none"):
+        monkeypatch.setattr(cas, "CAS_COMPRESSION_CODEC", codec)
+        blob = ("%s-payload" % codec).encode("utf-8") * 100
+        [result] = store.save_blobs(iter([blob]))
+        _, meta = storage.info_file(
+            storage.path_join("Flow/data", result.key[:2], result.key)
+        )
+        if codec == "gzip":
+            assert meta == {"cas_raw": False, "cas_version": 1}
+        else:
+            assert meta == {"cas_raw": False, "cas_version": 2, "cas_codec": codec}
+        assert dict(store.load_blobs([result.key]))[result.key] == blob
+
+
+def test_auto_codec_selection(tmp_path, monkeypatch):
+    _, store = _make_store(tmp_path)
+    monkeypatch.setattr(cas, "CAS_COMPRESSION_CODEC", "auto")
+    monkeypatch.setattr(cas, "zstandard", None)
+    monkeypatch.setattr(cas, "lz4_frame", None)
+
+    compressible = b"0123456789" * (store.SAMPLE_MIN_SIZE // 5)
+    incompressible = os.urandom(store.SAMPLE_MIN_SIZE * 2)
+    assert store._select_codec(b"small") == "gzip"
+    assert store._select_codec(compressible) == "gzip"
+    assert store._select_codec(incompressible) == "none"
+
+    monkeypatch.setattr(cas, "CAS_COMPRESSION_CODEC", "zstd")
+    with pytest.raises(DataException):
+        store._select_codec(compressible)
+
+
+def test_parallel_save_blobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(cas, "CAS_COMPRESSION_CODEC", "gzip")
+    storage, store = _make_store(tmp_path)
+    monkeypatch.setattr(store, "PACK_CHUNK_SIZE", 1000)
+    blobs = [("blob-%d" % i).encode("utf-8") * (i * 100 + 1) for i in range(20)]
+
+    results = store.save_blobs(iter(blobs), max_workers=4, max_inflight_bytes=5000)
+    # The blobs are checked and saved in batches of about 5000 bytes
+    assert len(storage.is_file_calls) > 1
+    assert sum(len(paths) for paths in storage.is_file_calls) == 20
+    # Blobs are saved in order even if they are compressed in parallel
+    assert storage.saved_paths == [
+        storage.path_join("Flow/data", r.key[:2], r.key) for r in results
+    ]
+    loaded = dict(store.load_blobs([r.key for r in results]))
+    assert [loaded[r.key] for r in results] == blobs
+
+
+def test_parallel_save_produced_blobs(tmp_path, monkeypatch):
+    storage, store = _make_store(tmp_path)
+    blobs = [("blob-%d" % i).encode("utf-8") * 500 for i in range(20)]
+    lock = threading.Lock()
+    produced = []
+    max_unsaved = [0]
+
+    def producer(i):
+        def _produce():
+            with lock:
+                produced.append(i)
+                unsaved = sum(len(blobs[j]) for j in produced) - sum(
+                    len(blobs[j]) for j in range(len(storage.saved_paths))
+                )
+                max_unsaved[0] = max(max_unsaved[0], unsaved)
+            return blobs[i]
+
+        return _produce
+
+    results = store.save_blobs(
+        (producer(i) for i in range(20)), max_workers=4, max_inflight_bytes=10000
+    )
+    # Blobs produced but not yet saved stay within the budget (plus the blobs
+    # being produced when it is reached)
+    assert max_unsaved[0] <= 10000 + 4 * len(blobs[0])
+    assert storage.saved_paths == [
+        storage.path_join("Flow/data", r.key[:2], r.key) for r in results
+    ]
+    loaded = dict(store.load_blobs([r.key for r in results]))
+    assert [loaded[r.key] for r in results] == blobs
@@ -0,0 +1,42 @@
+import os
+from io import BytesIO
+
+import metaflow.datastore.local_storage as local_storage
+from metaflow.datastore.local_storage import LocalStorage
+
+
+def test_save_bytes_parallel(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_storage, "DATASTORE_LOCAL_FSYNC", True)
+    storage = LocalStorage(str(tmp_path))
+    paths = ["d%d/blob" % i for i in range(20)]
+    storage.save_bytes(
+        ((p, (BytesIO(p.encode("utf-8")), {"path": p})) for p in paths),
+        len_hint=len(paths),
+    )
+    with storage.load_bytes(paths) as results:
+        for path, local_path, meta in results:
+            with open(local_path, "rb") as f:
+                assert f.read() == path.encode("utf-8")
+            assert meta == {"path": path}
+    # No temporary file is left behind
+    for i in range(20):
+        assert sorted(os.listdir(str(tmp_path / ("d%d" % i)))) == [
+            "blob",
+            "blob_meta",
+        ]
+
+
+def test_save_bytes_overwrite(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    storage.save_bytes(iter([("a/b", BytesIO(b"first"))]))
+    storage.save_bytes(iter([("a/b", BytesIO(b"second"))]))
+    with storage.load_bytes(["a/b"]) as results:
+        [(_, local_path, _)] = list(results)
+        with open(local_path, "rb") as f:
+            assert f.read() == b"first"
+
+    storage.save_bytes(iter([("a/b", BytesIO(b"second"))]), overwrite=True)
+    with storage.load_bytes(["a/b"]) as results:
+        [(_, local_path, _)] = list(results)
+        with open(local_path, "rb") as f:
+            assert f.read() == b"second"
@@ -0,0 +1,112 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from metaflow.datastore.local_storage import LocalStorage
+from metaflow.plugins.metadata.local import LocalMetadataProvider
+import metaflow.plugins.metadata.service as service
+from metaflow.plugins.metadata.service import ServiceMetadataProvider
+
+
+class FakeEnvironment(object):
+    def get_environment_info(self):
+        return {
+            "runtime": "dev",
+            "python_version_code": "3",
+            "metaflow_version": None,
+        }
+
+
+class FakeFlow(object):
+    name = "MetadataFlow"
+
+
+class StubService(BaseHTTPRequestHandler):
+    # Minimal metadata service: objects don't exist until they are created
+    # and tasks get sequential IDs
+    lock = threading.Lock()
+    requests = []
+    num_tasks = 0
+
+    def _reply(self, code, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        with self.lock:
+            self.requests.append(("GET", self.path))
+        self._reply(404, {})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.lock:
+            self.requests.append(("POST", self.path))
+            if self.path.endswith("/task"):
+                StubService.num_tasks += 1
+                body["task_id"] = StubService.num_tasks
+        self._reply(200, body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def username(monkeypatch):
+    monkeypatch.setenv("METAFLOW_USER", "tester")
+
+
+@pytest.fixture
+def service_url(monkeypatch):
+    StubService.requests = []
+    StubService.num_tasks = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubService)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = "http://127.0.0.1:%d" % server.server_port
+    monkeypatch.setattr(service, "METADATA_SERVICE_URL", url)
+    monkeypatch.setattr(ServiceMetadataProvider, "_INFO", url)
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+def test_service_new_task_ids(service_url):
+    provider = ServiceMetadataProvider(FakeEnvironment(), FakeFlow(), None, None)
+    task_ids = provider.new_task_ids("1", "body", 50)
+    assert sorted(task_ids) == list(range(1, 51))
+    # The step is created once and then all the tasks
+    paths = [path for method, path in StubService.requests if method == "POST"]
+    assert paths.count("/flows/MetadataFlow/runs/1/steps/body/step") == 1
+    assert paths.count("/flows/MetadataFlow/runs/1/steps/body/task") == 50
+    assert provider.new_task_ids("1", "body", 0) == []
+    assert provider.new_task_id("1", "body") == 51
+
+
+def test_local_new_task_ids(tmp_path, monkeypatch):
+    monkeypatch.setattr(LocalStorage, "datastore_root", str(tmp_path))
+    provider = LocalMetadataProvider(FakeEnvironment(), FakeFlow(), None, None)
+    assert provider.new_task_id("1", "start") == "0"
+    task_ids = provider.new_task_ids("1", "body", 3)
+    assert task_ids == ["1", "2", "3"]
+    assert provider.new_task_id("1", "join") == "4"
+    for task_id in task_ids:
+        assert (
+            tmp_path / "MetadataFlow" / "1" / "body" / task_id / "_meta" / "_self.json"
+        ).is_file()
+
+
+def test_local_new_task_id_threads(tmp_path, monkeypatch):
+    # Tasks are created from the threads of the asyncio runtime
+    monkeypatch.setattr(LocalStorage, "datastore_root", str(tmp_path))
+    provider = LocalMetadataProvider(FakeEnvironment(), FakeFlow(), None, None)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        task_ids = list(
+            executor.map(lambda _: provider.new_task_id("1", "body"), range(200))
+        )
+    assert sorted(task_ids, key=int) == [str(i) for i in range(200)]
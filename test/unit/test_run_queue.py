@@ -0,0 +1,213 @@
+import importlib.util
+
+import pytest
+
+from metaflow.exception import MetaflowException
+from metaflow.run_queue import ResourcePool, RunQueue
+
+
+class FakeNode(object):
+    def __init__(self, name, out_funcs):
+        self.name = name
+        self.out_funcs = out_funcs
+
+
+class FakeGraph(object):
+    def __init__(self, edges):
+        self.nodes = {name: FakeNode(name, out) for name, out in edges.items()}
+
+    def __getitem__(self, name):
+        return self.nodes[name]
+
+    def __contains__(self, name):
+        return name in self.nodes
+
+    def __iter__(self):
+        return iter(self.nodes.values())
+
+
+# start splits into a short branch and a long branch with a foreach
+GRAPH = FakeGraph(
+    {
+        "start": ["short", "foreach"],
+        "short": ["join"],
+        "foreach": ["body"],
+        "body": ["body_join"],
+        "body_join": ["join"],
+        "join": ["end"],
+        "end": [],
+    }
+)
+
+
+def _drain(queue, can_launch=None):
+    items = []
+    while True:
+        item = queue.pop(can_launch)
+        if item is None:
+            return items
+        items.append(item)
+
+
+def test_fifo():
+    queue = RunQueue(GRAPH)
+    for i in range(5):
+        queue.push("body", {"split_index": i})
+        queue.push("short", {"split_index": i})
+    assert len(queue) == 10
+    assert _drain(queue) == [
+        (step, {"split_index": i}) for i in range(5) for step in ("body", "short")
+    ]
+    assert not queue
+
+
+def test_critical_path():
+    queue = RunQueue(GRAPH, "critical-path")
+    queue.push("short", {})
+    queue.push("body", {"split_index": 0})
+    queue.push("foreach", {})
+    queue.push("body", {"split_index": 1})
+    assert [step for step, _ in _drain(queue)] == ["foreach", "body", "body", "short"]
+
+
+def test_depth_first():
+    queue = RunQueue(GRAPH, "depth-first")
+    queue.push("foreach", {})
+    for i in range(3):
+        queue.push("body", {"split_index": i})
+    queue.push("body_join", {})
+    # Joins of foreach branches are launched before the remaining splits
+    assert [step for step, _ in _drain(queue)] == [
+        "body_join",
+        "body",
+        "body",
+        "body",
+        "foreach",
+    ]
+
+
+def test_can_launch():
+    queue = RunQueue(GRAPH, "critical-path")
+    for i in range(3):
+        queue.push("body", {"split_index": i})
+    queue.push("short", {})
+    assert queue.pop(lambda step: step != "body") == ("short", {})
+    assert queue.pop(lambda step: step != "body") is None
+    assert queue.num_queued("body") == 3
+    # Skipped tasks keep their order
+    assert _drain(queue) == [("body", {"split_index": i}) for i in range(3)]
+
+
+def test_extend_is_lazy():
+    generated = []
+
+    def _splits(num_splits):
+        for i in range(num_splits):
+            generated.append(i)
+            yield {"split_index": i}
+
+    queue = RunQueue(GRAPH, "depth-first")
+    queue.extend("body", _splits(1000000), 1000000)
+    queue.extend("start", iter([]), 0)
+    queue.push("foreach", {})
+    assert len(queue) == 1000001
+    assert generated == []
+    assert queue.pop() == ("body", {"split_index": 0})
+    queue.push("body_join", {})
+    assert queue.pop() == ("body_join", {})
+    assert queue.pop() == ("body", {"split_index": 1})
+    assert generated == [0, 1]
+    assert queue.num_queued("body") == 999998
+
+
+def test_loops_and_unknown_policy():
+    graph = FakeGraph({"start": ["a", "unknown"], "a": ["b"], "b": ["a", "end"]})
+    for policy in ("critical-path", "depth-first"):
+        queue = RunQueue(graph, policy)
+        queue.push("b", {})
+        queue.push("a", {})
+        assert len(_drain(queue)) == 2
+    with pytest.raises(MetaflowException):
+        RunQueue(graph, "random")
+
+
+requires_benchmark = pytest.mark.skipif(
+    importlib.util.find_spec("pytest_benchmark") is None,
+    reason="pytest-benchmark is not installed",
+)
+
+# Number of splits of the synthetic foreach. The time taken per task to queue
+# and launch the splits should not depend on the number of splits.
+BENCHMARK_NUM_SPLITS = [1000, 10000, 100000]
+
+
+def _schedule(queue, num_splits):
+    queue.push("foreach", {})
+    queue.pop()
+    queue.extend("body", ({"split_index": i} for i in range(num_splits)), num_splits)
+    # As in the runtime, tasks of the next step become ready while the
+    # remaining splits are still queued
+    launched = 1
+    while queue:
+        step, _ = queue.pop()
+        if step == "body":
+            queue.push("body_join", {})
+        launched += 1
+    return launched
+
+
+@requires_benchmark
+@pytest.mark.parametrize("num_splits", BENCHMARK_NUM_SPLITS)
+@pytest.mark.parametrize("policy", ["fifo", "critical-path", "depth-first"])
+def test_run_queue_benchmark(benchmark, policy, num_splits):
+    assert (
+        benchmark(lambda: _schedule(RunQueue(GRAPH, policy), num_splits))
+        == 2 * num_splits + 1
+    )
+
+
+class ListQueue(object):
+    # Baseline: the list used by the runtime before the RunQueue
+    def __init__(self):
+        self._queue = []
+
+    def __len__(self):
+        return len(self._queue)
+
+    def push(self, step, task_kwargs):
+        self._queue.insert(0, (step, task_kwargs))
+
+    def extend(self, step, tasks_kwargs, num_tasks):
+        for task_kwargs in tasks_kwargs:
+            self.push(step, task_kwargs)
+
+    def pop(self):
+        return self._queue.pop() if self._queue else None
+
+
+@requires_benchmark
+@pytest.mark.parametrize("num_splits", [n for n in BENCHMARK_NUM_SPLITS if n <= 10000])
+def test_list_queue_benchmark(benchmark, num_splits):
+    assert benchmark(lambda: _schedule(ListQueue(), num_splits)) == 2 * num_splits + 1
+
+
+def test_resource_pool():
+    pool = ResourcePool({"cpu": 4, "memory": None})
+    small = {"cpu": 1, "memory": 4096}
+    assert not pool.exceeds_capacity(small)
+    for _ in range(4):
+        assert pool.fits(small)
+        pool.acquire(small)
+    assert not pool.fits(small)
+    pool.release(small)
+    assert pool.fits(small)
+
+    # A request larger than the pool is granted when the pool is empty
+    large = {"cpu": 8, "memory": 0}
+    assert pool.exceeds_capacity(large)
+    assert not pool.fits(large)
+    for _ in range(3):
+        pool.release(small)
+    assert pool.fits(large)
+    pool.acquire(large)
+    assert not pool.fits(small)
@@ -0,0 +1,66 @@
+from metaflow.datatools import s3op
+from metaflow.datatools.s3op import AdaptiveConcurrency
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+def test_adaptive_concurrency(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(s3op.time, "time", clock.time)
+    concurrency = AdaptiveConcurrency(4, 16, window=1.0)
+
+    def run_window(num_bytes):
+        clock.now += 1.0
+        concurrency.record(num_bytes)
+
+    # the concurrency doubles as long as the throughput improves
+    run_window(100)
+    assert concurrency.target == 8
+    run_window(200)
+    assert concurrency.target == 16
+    run_window(400)
+    assert concurrency.target == 16
+    # but not if it does not
+    run_window(100)
+    assert concurrency.target == 16
+
+    # throttling halves it, once per window
+    concurrency.throttled()
+    concurrency.throttled()
+    assert concurrency.target == 8
+    assert concurrency.num_throttled == 2
+    # the first window after a backoff only measures the throughput
+    run_window(100)
+    assert concurrency.target == 8
+    run_window(200)
+    assert concurrency.target == 16
+    assert concurrency.peak == 16
+    assert concurrency.total_bytes == 1100
+
+
+def test_hard_reset_keeps_shared_client(monkeypatch):
+    created = []
+
+    def get_s3_client(max_pool_connections=0):
+        created.append(max_pool_connections)
+        return object(), Exception
+
+    monkeypatch.setattr(s3op, "get_s3_client", get_s3_client)
+    monkeypatch.setattr(s3op, "_shared_client", None)
+    monkeypatch.setattr(s3op, "_shared_client_pool_size", 0)
+    shared, _ = s3op.get_shared_s3_client(max_pool_connections=64)
+
+    ops = s3op.S3Ops()
+    ops.reset_client()
+    assert ops.s3 is shared
+    # a hard reset does not replace the client used by the other threads
+    ops.reset_client(hard_reset=True)
+    assert ops.s3 is not shared
+    assert s3op.get_shared_s3_client()[0] is shared
+    assert created == [64, 0]
@@ -0,0 +1,287 @@
+import datetime
+import os
+import threading
+from io import BytesIO
+
+import pytest
+from botocore.exceptions import ClientError
+
+from metaflow.datastore.s3_storage import S3Storage
+from metaflow.exception import MetaflowException
+from metaflow.datatools import s3transfer
+from metaflow.datatools.s3 import (
+    S3,
+    MetaflowS3Exception,
+    MetaflowS3InvalidObject,
+    MetaflowS3NotFound,
+)
+from metaflow.datatools.s3util import (
+    download_in_ranges,
+    download_object,
+    upload_in_parts,
+)
+
+
+class FakePaginator(object):
+    def __init__(self, objects):
+        self._objects = objects
+
+    def paginate(self, Bucket, Prefix, Delimiter):
+        contents = []
+        prefixes = set()
+        for (bucket, key), (data, _) in sorted(self._objects.items()):
+            if bucket != Bucket or not key.startswith(Prefix):
+                continue
+            rest = key[len(Prefix) :]
+            if Delimiter and Delimiter in rest:
+                prefixes.add(Prefix + rest.split(Delimiter)[0] + Delimiter)
+            else:
+                contents.append({"Key": key, "Size": len(data)})
+        yield {
+            "Contents": contents,
+            "CommonPrefixes": [{"Prefix": p} for p in sorted(prefixes)],
+        }
+
+
+class FakeS3Client(object):
+    # In-memory implementation of the boto3 calls made by S3TransferEngine.
+    # Keys listed in `failures` fail (with a 500 error) that many times.
+    def __init__(self, objects, failures, uploads):
+        self._objects = objects
+        self._failures = failures
+        self._uploads = uploads
+        self._lock = threading.Lock()
+
+    def _maybe_fail(self, key, op):
+        with self._lock:
+            if self._failures.get(key):
+                self._failures[key] -= 1
+                raise ClientError({"Error": {"Code": "500"}}, op)
+
+    def _lookup(self, bucket, key, op):
+        self._maybe_fail(key, op)
+        if (bucket, key) not in self._objects:
+            raise ClientError({"Error": {"Code": "404"}}, op)
+        return self._objects[(bucket, key)]
+
+    def head_object(self, Bucket, Key):
+        data, metadata = self._lookup(Bucket, Key, "HeadObject")
+        return {
+            "ContentLength": len(data),
+            "ContentType": "binary/octet-stream",
+            "Metadata": metadata,
+            "LastModified": datetime.datetime(2022, 1, 1),
+        }
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        resp = self.head_object(Bucket, Key)
+        data = self._objects[(Bucket, Key)][0]
+        if Range:
+            if not data:
+                raise ClientError({"Error": {"Code": "InvalidRange"}}, "GetObject")
+            start, end = map(int, Range[len("bytes=") :].split("-"))
+            end = min(end, len(data) - 1)
+            resp["ContentRange"] = "bytes %d-%d/%d" % (start, end, len(data))
+            data = data[start : end + 1]
+            resp["ContentLength"] = len(data)
+        resp["Body"] = BytesIO(data)
+        return resp
+
+    def upload_file(self, local, bucket, key, ExtraArgs=None):
+        with open(local, "rb") as f:
+            metadata = (ExtraArgs or {}).get("Metadata", {})
+            self._objects[(bucket, key)] = (f.read(), metadata)
+
+    def upload_fileobj(self, f, bucket, key, ExtraArgs=None):
+        metadata = (ExtraArgs or {}).get("Metadata", {})
+        self._objects[(bucket, key)] = (f.read(), metadata)
+
+    def put_object(self, Bucket, Key, Body, Metadata=None):
+        self._objects[(Bucket, Key)] = (bytes(Body), Metadata or {})
+
+    def create_multipart_upload(self, Bucket, Key, Metadata=None):
+        with self._lock:
+            self._uploads[Key] = ({}, Metadata or {})
+        return {"UploadId": Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._maybe_fail(Key, "UploadPart")
+        self._uploads[UploadId][0][PartNumber] = bytes(Body)
+        return {"ETag": str(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts, metadata = self._uploads.pop(UploadId)
+        numbers = [p["PartNumber"] for p in MultipartUpload["Parts"]]
+        assert numbers == sorted(parts)
+        self._objects[(Bucket, Key)] = (b"".join(parts[n] for n in numbers), metadata)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._uploads.pop(UploadId)
+
+    def get_paginator(self, name):
+        return FakePaginator(self._objects)
+
+
+@pytest.fixture
+def fake_s3(monkeypatch):
+    objects = {}
+    failures = {}
+    uploads = {}
+
+    def _get_s3_client():
+        return FakeS3Client(objects, failures, uploads), ClientError
+
+    monkeypatch.setattr(s3transfer, "get_s3_client", _get_s3_client)
+    monkeypatch.setattr(s3transfer, "_client_pool", s3transfer.S3ClientPool())
+    monkeypatch.setattr(s3transfer, "S3_RETRY_COUNT", 1)
+    monkeypatch.setattr(s3transfer.time, "sleep", lambda _: None)
+    return objects, failures
+
+
+def test_batch_operations_in_process(fake_s3, tmp_path):
+    objects, _ = fake_s3
+    with S3(s3root="s3://bucket/root", tmproot=str(tmp_path)) as s3:
+        assert s3.get_many([]) == []
+        assert s3.info_many([]) == []
+        assert s3.put_files([]) == []
+        put = s3.put_many([("a/1", b"one"), ("a/2", b"two"), ("b", b"three")])
+        assert sorted(key for key, _ in put) == ["a/1", "a/2", "b"]
+        assert objects[("bucket", "root/a/2")][0] == b"two"
+
+        objs = s3.get_many(["a/1", "b", "missing"], return_missing=True)
+        assert [o.blob for o in objs[:2]] == [b"one", b"three"]
+        assert not objs[2].exists
+        with pytest.raises(MetaflowS3NotFound):
+            s3.get_many(["a/1", "missing"])
+
+        infos = s3.info_many(["a/1", "missing"], return_missing=True)
+        assert infos[0].size == 3 and not infos[1].exists
+
+        listing = s3.list_paths()
+        assert sorted((o.key, o.exists) for o in listing) == [
+            ("a", False),
+            ("b", True),
+        ]
+        assert [o.url for o in s3.list_recursive(["a"])] == [
+            "s3://bucket/root/a/1",
+            "s3://bucket/root/a/2",
+        ]
+
+
+def test_s3_storage_empty_batches(fake_s3):
+    storage = S3Storage("s3://bucket/root")
+    assert storage.is_file([]) == []
+    with storage.load_bytes([]) as loaded:
+        assert list(loaded) == []
+
+
+def test_transient_errors_are_retried(fake_s3, tmp_path):
+    objects, failures = fake_s3
+    objects[("bucket", "root/x")] = (b"x", {})
+    objects[("bucket", "root/y")] = (b"y", {})
+    with S3(s3root="s3://bucket/root", tmproot=str(tmp_path)) as s3:
+        failures["root/x"] = 1
+        assert [o.blob for o in s3.get_many(["x", "y"])] == [b"x", b"y"]
+
+        failures["root/x"] = 2
+        with pytest.raises(MetaflowS3Exception):
+            s3.get_many(["x", "y"])
+
+
+def test_iter_get_many_with_spool(fake_s3, tmp_path):
+    objects, _ = fake_s3
+    for i in range(5):
+        objects[("bucket", "root/d/%d" % i)] = (b"%d" % i, {})
+    with S3(s3root="s3://bucket/root", tmproot=str(tmp_path)) as s3:
+        keys = ["d/%d" % i for i in range(5)] + ["missing"]
+        seen = []
+        previous = None
+        for obj in s3.iter_get_many(keys, return_missing=True, max_spooled=2):
+            if previous is not None:
+                # the file of the previous object has been removed
+                assert not os.path.exists(previous)
+            if obj.exists:
+                seen.append(obj.blob)
+                previous = obj.path
+            else:
+                seen.append(None)
+                previous = None
+        assert sorted(seen, key=lambda b: b or b"") == [None] + [
+            b"%d" % i for i in range(5)
+        ]
+
+        objs = list(s3.iter_get_recursive(["d"]))
+        assert sorted(o.blob for o in objs) == [b"%d" % i for i in range(5)]
+        assert all(os.path.exists(o.path) for o in objs)
+
+
+def test_download_in_ranges(fake_s3, tmp_path, monkeypatch):
+    objects, failures = fake_s3
+    data = bytes(bytearray(range(256))) * 40
+    objects[("bucket", "big")] = (data, {})
+    # the first range fails once and is retried on its own
+    failures["big"] = 1
+    monkeypatch.setattr("metaflow.datatools.s3util.time.sleep", lambda _: None)
+    client, _ = s3transfer.get_s3_client()
+    dst = str(tmp_path / "big")
+    download_in_ranges(
+        client, "bucket", "big", len(data), dst, chunk_size=1000, max_concurrency=4
+    )
+    with open(dst, "rb") as f:
+        assert f.read() == data
+
+    # the first range tells the size of the object
+    objects[("bucket", "empty")] = (b"", {})
+    for key, expected in (("big", data), ("empty", b"")):
+        resp = download_object(
+            client, "bucket", key, dst, chunk_size=1000, max_concurrency=4
+        )
+        assert resp["ContentLength"] == len(expected)
+        with open(dst, "rb") as f:
+            assert f.read() == expected
+
+
+def test_put_streams(fake_s3, tmp_path, monkeypatch):
+    objects, failures = fake_s3
+    monkeypatch.setattr("metaflow.datatools.s3util.time.sleep", lambda _: None)
+    data = bytes(bytearray(range(256))) * 40
+    with S3(s3root="s3://bucket/root", tmproot=str(tmp_path)) as s3:
+        # an upload that fits in a single part
+        s3.put("gen", (data[i : i + 100] for i in range(0, len(data), 100)))
+        assert objects[("bucket", "root/gen")][0] == data
+        s3.put_many([("view", memoryview(data)), ("bytes", data)])
+        assert objects[("bucket", "root/view")][0] == data
+        assert objects[("bucket", "root/bytes")][0] == data
+        # only iterators of bytes are streamed
+        for obj in ({"a": 1}, [b"a"], iter(["text"])):
+            with pytest.raises(MetaflowS3InvalidObject):
+                s3.put("invalid", obj)
+        assert ("bucket", "root/invalid") not in objects
+
+    # a multipart upload of parts of 1000 bytes, one of which is retried
+    failures["big"] = 1
+    client, _ = s3transfer.get_s3_client()
+    upload_in_parts(
+        client,
+        "bucket",
+        "big",
+        iter([data[:1500], data[1500:]]),
+        part_size=1000,
+        max_concurrency=2,
+        max_memory=3000,
+    )
+    assert objects[("bucket", "big")][0] == data
+
+    # data that does not fit in MAX_UPLOAD_PARTS parts is not uploaded
+    monkeypatch.setattr("metaflow.datatools.s3util.MAX_UPLOAD_PARTS", 5)
+    with pytest.raises(MetaflowException):
+        upload_in_parts(
+            client,
+            "bucket",
+            "too-big",
+            iter([data]),
+            part_size=1000,
+            max_concurrency=2,
+            max_memory=3000,
+        )
+    assert ("bucket", "too-big") not in objects
@@ -0,0 +1,256 @@
+import mmap
+import pickle
+
+import pytest
+
+from metaflow.datastore.flow_datastore import FlowDataStore
+from metaflow.datastore.inputs import InputsBlobCache
+from metaflow.datastore.local_storage import LocalStorage
+from metaflow.datastore.task_datastore import TaskDataStore
+
+
+class OutOfBandBuffer(object):
+    # Mimics how numpy arrays expose their memory with pickle protocol 5
+    def __init__(self, data):
+        self.data = data
+
+    def __reduce_ex__(self, protocol):
+        if protocol >= 5:
+            return OutOfBandBuffer, (pickle.PickleBuffer(self.data),)
+        return OutOfBandBuffer, (bytes(self.data),)
+
+
+def _make_task_datastore(tmp_path):
+    flow_datastore = FlowDataStore(
+        "TestFlow", None, storage_impl=LocalStorage, ds_root=str(tmp_path)
+    )
+    task_ds = flow_datastore.get_task_datastore("1", "start", "1", attempt=0, mode="w")
+    task_ds.init_task()
+    return flow_datastore, task_ds
+
+
+def test_out_of_band_artifacts(tmp_path, monkeypatch):
+    monkeypatch.setattr("metaflow.metaflow_config.ARTIFACT_PICKLE_OUT_OF_BAND", True)
+    flow_datastore, task_ds = _make_task_datastore(tmp_path)
+    payload = bytearray(b"0123456789" * 1000)
+    task_ds.save_artifacts(
+        iter([("buf", OutOfBandBuffer(payload)), ("plain", {"a": 1})])
+    )
+    task_ds.done()
+
+    assert task_ds._info["buf"]["encoding"] == TaskDataStore.OUT_OF_BAND_ENCODING
+    assert task_ds._info["buf"]["size"] > len(payload)
+
+    read_ds = flow_datastore.get_task_datastore("1", "start", "1")
+    loaded = dict(read_ds.load_artifacts(["buf", "plain"]))
+    assert loaded["plain"] == {"a": 1}
+    # The buffer is handed to the object without being copied
+    assert isinstance(loaded["buf"].data, memoryview)
+    assert loaded["buf"].data.readonly
+    assert bytes(loaded["buf"].data) == bytes(payload)
+
+
+def test_mmap_local_artifacts(tmp_path, monkeypatch):
+    monkeypatch.setattr("metaflow.metaflow_config.ARTIFACT_PICKLE_OUT_OF_BAND", True)
+    monkeypatch.setattr("metaflow.metaflow_config.DATASTORE_LOCAL_MMAP", True)
+    monkeypatch.setattr(
+        "metaflow.datastore.content_addressed_store.DATASTORE_LOCAL_MMAP", True
+    )
+    flow_datastore, task_ds = _make_task_datastore(tmp_path)
+    payload = bytearray(b"0123456789" * 1000)
+    task_ds.save_artifacts(
+        iter([("buf", OutOfBandBuffer(payload)), ("plain", {"a": 1})])
+    )
+    task_ds.done()
+
+    read_ds = flow_datastore.get_task_datastore("1", "start", "1")
+    loaded = dict(read_ds.load_artifacts(["buf", "plain"]))
+    assert loaded["plain"] == {"a": 1}
+    # The buffer is backed by a (copy-on-write) mapping of the blob file
+    assert isinstance(loaded["buf"].data.obj, mmap.mmap)
+    assert bytes(loaded["buf"].data) == bytes(payload)
+    loaded["buf"].data[0:1] = b"x"
+    reloaded = dict(read_ds.load_artifacts(["buf"]))
+    assert bytes(reloaded["buf"].data) == bytes(payload)
+
+
+def test_mmap_aliased_artifacts_are_distinct(tmp_path, monkeypatch):
+    monkeypatch.setattr("metaflow.metaflow_config.ARTIFACT_PICKLE_OUT_OF_BAND", True)
+    monkeypatch.setattr("metaflow.metaflow_config.DATASTORE_LOCAL_MMAP", True)
+    monkeypatch.setattr(
+        "metaflow.datastore.content_addressed_store.DATASTORE_LOCAL_MMAP", True
+    )
+    flow_datastore, task_ds = _make_task_datastore(tmp_path)
+    payload = bytearray(b"0123456789" * 1000)
+    task_ds.save_artifacts(
+        iter([("buf", OutOfBandBuffer(payload)), ("alias", OutOfBandBuffer(payload))])
+    )
+    task_ds.done()
+
+    read_ds = flow_datastore.get_task_datastore("1", "start", "1")
+    loaded = dict(read_ds.load_artifacts(["buf", "alias"]))
+    loaded["buf"].data[0:1] = b"x"
+    assert bytes(loaded["alias"].data) == bytes(payload)
+    loaded["alias"].data[1:2] = b"y"
+    assert bytes(loaded["buf"].data) == b"x" + bytes(payload[1:])
+
+
+def test_inputs_blob_cache_coalesces_loads(tmp_path, monkeypatch):
+    flow_datastore = FlowDataStore(
+        "TestFlow", None, storage_impl=LocalStorage, ds_root=str(tmp_path)
+    )
+    for i in range(10):
+        task_ds = flow_datastore.get_task_datastore(
+            "1", "a", str(i), attempt=0, mode="w"
+        )
+        task_ds.init_task()
+        task_ds.save_artifacts(iter([("score", i), ("other", "other-%d" % i)]))
+        task_ds.done()
+    inputs = [flow_datastore.get_task_datastore("1", "a", str(i)) for i in range(10)]
+
+    loaded_paths = []
+    load_bytes = flow_datastore._storage_impl.load_bytes
+
+    def counting_load_bytes(paths):
+        loaded_paths.append(list(paths))
+        return load_bytes(paths)
+
+    monkeypatch.setattr(flow_datastore._storage_impl, "load_bytes", counting_load_bytes)
+    ca_store = flow_datastore.ca_store
+    ca_store.set_blob_cache(InputsBlobCache(ca_store, inputs))
+
+    assert [inp["score"] for inp in inputs] == list(range(10))
+    # One load for the first input, then one for all the other inputs
+    assert [len(p) for p in loaded_paths if p] == [1, 9]
+    # Artifacts only accessed in one input are not prefetched
+    assert inputs[3]["other"] == "other-3"
+    assert [len(p) for p in loaded_paths if p] == [1, 9, 1]
+
+
+def test_inputs_blob_cache_bounds_prefetch(tmp_path, monkeypatch):
+    flow_datastore = FlowDataStore(
+        "TestFlow", None, storage_impl=LocalStorage, ds_root=str(tmp_path)
+    )
+    for i in range(10):
+        task_ds = flow_datastore.get_task_datastore(
+            "1", "a", str(i), attempt=0, mode="w"
+        )
+        task_ds.init_task()
+        task_ds.save_artifacts(iter([("data", ("data-%d" % i) * 100)]))
+        task_ds.done()
+    inputs = [flow_datastore.get_task_datastore("1", "a", str(i)) for i in range(10)]
+    size = dict(inputs[0].get_artifact_sizes(["data"]))["data"]
+
+    loaded_paths = []
+    load_bytes = flow_datastore._storage_impl.load_bytes
+
+    def counting_load_bytes(paths):
+        loaded_paths.append(list(paths))
+        return load_bytes(paths)
+
+    monkeypatch.setattr(flow_datastore._storage_impl, "load_bytes", counting_load_bytes)
+    ca_store = flow_datastore.ca_store
+    cache = InputsBlobCache(ca_store, inputs)
+    monkeypatch.setattr(cache, "MAX_PREFETCH_BYTES", 3 * size)
+    ca_store.set_blob_cache(cache)
+
+    assert [inp["data"] for inp in inputs] == [("data-%d" % i) * 100 for i in range(10)]
+    # At most three blobs are prefetched at once
+    assert [len(p) for p in loaded_paths if p] == [1, 3, 3, 3]
+    assert cache._blobs_bytes == 0
+
+
+@pytest.mark.parametrize("probe_attempts", [False, True])
+def test_get_latest_task_datastores(tmp_path, monkeypatch, probe_attempts):
+    monkeypatch.setattr(
+        "metaflow.metaflow_config.DATASTORE_PROBE_ATTEMPTS", probe_attempts
+    )
+    flow_datastore = FlowDataStore(
+        "TestFlow", None, storage_impl=LocalStorage, ds_root=str(tmp_path)
+    )
+    for task_id, attempts in (("1", 1), ("2", 2)):
+        for attempt in range(attempts):
+            task_ds = flow_datastore.get_task_datastore(
+                "1", "body", task_id, attempt=attempt, mode="w"
+            )
+            task_ds.init_task()
+            task_ds.save_artifacts(iter([("attempt", attempt)]))
+            task_ds.done()
+    # Attempt 2 of task 2 started but is not done
+    flow_datastore.get_task_datastore("1", "body", "2", attempt=2, mode="w").init_task()
+    # A task that never started
+    flow_datastore.get_task_datastore("1", "body", "3", attempt=0, mode="w")
+
+    loaded_paths = []
+    storage = flow_datastore._storage_impl
+    load_bytes = storage.load_bytes
+
+    def _load_bytes(paths):
+        loaded_paths.extend(paths)
+        return load_bytes(paths)
+
+    storage.load_bytes = _load_bytes
+    datastores = flow_datastore.get_latest_task_datastores(
+        pathspecs=["1/body/1", "1/body/2", "1/body/3"]
+    )
+    assert {(ds.task_id, ds.attempt) for ds in datastores} == {("1", 0)}
+    # Only the data metadata of the latest done attempts is loaded
+    assert loaded_paths == ["TestFlow/1/body/1/0.data.json"]
+
+    datastores = flow_datastore.get_latest_task_datastores(
+        "1", steps=["body"], allow_not_done=True
+    )
+    assert {(ds.task_id, ds.attempt) for ds in datastores} == {("1", 0), ("2", 2)}
+
+
+class ControlFlow(object):
+    _EPHEMERAL = set()
+    _datastore = None
+
+    def __init__(self, **artifacts):
+        for name, value in artifacts.items():
+            setattr(self, name, value)
+
+
+def test_control_record(tmp_path):
+    flow_datastore, task_ds = _make_task_datastore(tmp_path)
+    task_ds.persist(
+        ControlFlow(
+            _transition=(["body"], "items"),
+            _foreach_stack=[],
+            _foreach_num_splits=3,
+            _foreach_var="items",
+            items=[1, 2, 3],
+        )
+    )
+    task_ds.done()
+
+    control = flow_datastore.load_control_record("1", "start", "1", 0)
+    assert control == {
+        "_transition": [["body"], "items"],
+        "_foreach_stack": [],
+        "_foreach_num_splits": 3,
+        "_foreach_var": "items",
+        "_unbounded_foreach": None,
+        "_control_mapper_tasks": None,
+        "_control_task_is_mapper_zero": None,
+    }
+    assert flow_datastore.load_control_record("1", "start", "1", 1) is None
+
+    # Clones have the control record of their origin
+    origin = flow_datastore.get_task_datastore("1", "start", "1")
+    clone_ds = flow_datastore.get_task_datastore("2", "start", "1", attempt=0, mode="w")
+    clone_ds.init_task()
+    clone_ds.clone(origin)
+    clone_ds.done()
+    assert flow_datastore.load_control_record("2", "start", "1", 0) == control
+
+
+def test_control_record_not_json(tmp_path):
+    # The runtime falls back to the artifacts for such tasks
+    flow_datastore, task_ds = _make_task_datastore(tmp_path)
+    task_ds.persist(ControlFlow(_transition=(["end"], None), _foreach_var=object()))
+    task_ds.done()
+    assert flow_datastore.load_control_record("1", "start", "1", 0) is None
+    read_ds = flow_datastore.get_task_datastore("1", "start", "1")
+    assert read_ds["_transition"] == (["end"], None)
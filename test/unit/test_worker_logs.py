@@ -0,0 +1,145 @@
+import fcntl
+import importlib.util
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from metaflow import procpoll
+from metaflow.cli import log_many, logger
+from metaflow.mflog import mflog
+from metaflow.runtime import Task, Worker
+
+requires_benchmark = pytest.mark.skipif(
+    importlib.util.find_spec("pytest_benchmark") is None,
+    reason="pytest-benchmark is not installed",
+)
+
+
+class FakeTask(object):
+    retries = 0
+    user_code_retries = 0
+    is_cloned = False
+    control = {"_foreach_num_splits": None}
+    log = Task.log
+    log_many = Task.log_many
+    _log_many = None
+
+    def __init__(self, script):
+        self.script = script
+        self._path = "1/chatty/1"
+        self.logs = None
+        self.lines = []
+
+    def _logger(self, body, head="", system_msg=False, timestamp=True):
+        self.lines.append(body)
+
+    def save_metadata(self, name, metadata):
+        pass
+
+    def save_logs(self, logs):
+        self.logs = {name: buf.read() for name, buf in logs.items()}
+
+
+class FakeTaskConsole(FakeTask):
+    # Prints the logs to the console (like the runtime does)
+    _logger = staticmethod(logger)
+    _log_many = staticmethod(log_many)
+
+
+class ChattyWorker(Worker):
+    def _launch(self):
+        return subprocess.Popen(
+            [sys.executable, "-c", self.task.script],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+
+class LineWorker(ChattyWorker):
+    # Baseline: one line per wakeup, as the runtime used to do
+    def read_loglines(self, fd, final=False):
+        fileobj, buf = self._logs[fd]
+        if final:
+            # The task has exited; read the lines left in the buffer and pipe
+            fcntl.fcntl(
+                fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_NONBLOCK
+            )
+            for line in fileobj:
+                self.emit_log(line, buf)
+            return False
+        fcntl_flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl_flags & ~os.O_NONBLOCK)
+        line = fileobj.readline()
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl_flags)
+        if line:
+            self.emit_log(line, buf)
+        return bool(line)
+
+
+def _run(workers):
+    # Same loop as NativeRuntime._poll_workers
+    poll = procpoll.make_poll()
+    active = {}
+    for worker in workers:
+        for fd in worker.fds():
+            active[fd] = worker
+            poll.add(fd)
+    while active:
+        for event in poll.poll(100):
+            worker = active.get(event.fd)
+            if worker is None:
+                continue
+            if event.can_read:
+                worker.read_loglines(event.fd)
+            if event.is_terminated:
+                worker.terminate()
+                for fd in worker.fds():
+                    poll.remove(fd)
+                    del active[fd]
+
+
+def _script(num_lines):
+    return (
+        "import sys\n"
+        "for i in range(%d):\n"
+        "    print('line %%d' %% i)\n"
+        "sys.stderr.write('error\\n')\n"
+        "sys.stdout.write('no newline')\n" % num_lines
+    )
+
+
+def test_read_loglines():
+    task = FakeTask(_script(10000))
+    _run([ChattyWorker(task, 1024 * 1024)])
+    expected = ["line %d" % i for i in range(10000)] + ["no newline"]
+    assert [line for line in task.lines if line.startswith(("line", "no"))] == expected
+    assert "error" in task.lines
+    stdout = [
+        mflog.parse(line).msg
+        for line in task.logs["stdout"].splitlines()
+        if line and not line.endswith(b"Task finished successfully.")
+    ]
+    assert stdout == [line.encode("utf-8") for line in expected]
+    assert mflog.parse(task.logs["stderr"].splitlines()[0]).msg == b"error"
+
+
+@requires_benchmark
+@pytest.mark.parametrize("worker_cls", [ChattyWorker, LineWorker])
+@pytest.mark.benchmark(timer=time.process_time, max_time=10)
+def test_read_loglines_benchmark(benchmark, capsys, worker_cls):
+    # CPU time used by the runtime to process the logs of 16 workers, each
+    # printing 5000 lines as fast as it can
+    def _do():
+        _run(
+            [
+                worker_cls(FakeTaskConsole(_script(5000)), 100 * 1024 * 1024)
+                for _ in range(16)
+            ]
+        )
+        return len(capsys.readouterr().out.splitlines())
+
+    assert benchmark.pedantic(_do, rounds=3) == 16 * 5004
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import metaflow
+from metaflow.zygote import Zygote
+
+
+def test_zygote_launch(tmp_path, monkeypatch):
+    # The zygote needs to be able to import metaflow
+    monkeypatch.setenv(
+        "PYTHONPATH", os.path.dirname(os.path.dirname(metaflow.__file__))
+    )
+    script = tmp_path / "script.py"
+    script.write_text(
+        "import atexit, os, sys, threading, time\n"
+        "print('args', ' '.join(sys.argv[1:]))\n"
+        "print('env', os.environ.get('ZYGOTE_TEST'))\n"
+        "sys.stderr.write('error\\n')\n"
+        "atexit.register(print, 'atexit')\n"
+        "threading.Thread(target=lambda: (time.sleep(0.1), print('thread'))).start()\n"
+        "sys.exit(int(sys.argv[1]))\n"
+    )
+    entrypoint = [sys.executable, str(script)]
+    zygote = Zygote(entrypoint, modules=["json"])
+    try:
+        env = dict(os.environ, ZYGOTE_TEST="value", PYTHONUNBUFFERED="x")
+        assert zygote.can_launch(entrypoint + ["3"], env)
+        assert not zygote.can_launch(["python2"] + entrypoint[1:], env)
+        assert not zygote.can_launch(
+            entrypoint, dict(env, METAFLOW_DEFAULT_DATASTORE="s3")
+        )
+
+        proc = zygote.launch(entrypoint + ["3", "x"], env)
+        assert proc.wait() == 3
+        assert proc.poll() == 3
+        # non-daemon threads and atexit handlers run before the task exits
+        assert proc.stdout.read() == b"args 3 x\nenv value\nthread\natexit\n"
+        assert proc.stderr.read() == b"error\n"
+
+        proc = zygote.launch(entrypoint + ["0"], env)
+        assert proc.wait() == 0
+        proc.stdout.close()
+        proc.stderr.close()
+    finally:
+        zygote.close()
+    assert not zygote.can_launch(entrypoint, env)